@@ -0,0 +1,218 @@
+"""Micro-benchmarks for the segmentation pipeline stages.
+
+Usage::
+
+    python benchmark.py slic [--segments 1000] [--compactness 10]
+                             [--mode dense|pyramid] [--workers N]
+                             [--sparse [--alpha-threshold 0]] [ICON ...]
+    python benchmark.py connectivity [--segments 1000] [--noise 8] [ICON ...]
+    python benchmark.py lab [ICON ...]
+    python benchmark.py kmeans [--segments 1000] [--k-min 2] [--k-max 32]
+                               [--repeat 3] [ICON ...]
+    python benchmark.py layers [--segments 1000] [--clusters 8] [ICON ...]
+
+Icons default to the sample set in ``another-way/icons``.
+"""
+
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+import clustering
+import colorspace
+import layers
+import slic
+import slic_tiled
+from colorspace import srgb_to_lab
+from sparse import PixelIndex
+from superpixels import superpixel_features
+
+DEFAULT_ICONS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "another-way", "icons", "*.png")
+
+
+def load_rgba(path):
+    with Image.open(path) as im:
+        return np.asarray(im.convert("RGBA"))
+
+
+def icon_paths(paths):
+    return paths or sorted(glob.glob(DEFAULT_ICONS))
+
+
+def bench_slic(args):
+    print(f"{'icon':40s} {'size':>11s} {'iters':>5s} {'ms/iter':>9s} "
+          f"{'min':>8s} {'max':>8s} {'total ms':>9s}")
+    for path in icon_paths(args.icons):
+        rgba = load_rgba(path)
+        lab = srgb_to_lab(rgba)
+        times = []
+        start = time.perf_counter()
+        if args.sparse:
+            index = PixelIndex.from_alpha(rgba, args.alpha_threshold)
+            slic.slic_sparse(index.gather(lab), index, n_segments=args.segments,
+                             compactness=args.compactness, max_iter=args.iterations,
+                             callback=lambda i, seconds: times.append(seconds))
+        elif args.workers > 1:
+            slic_tiled.tiled_slic(lab, n_segments=args.segments,
+                                  compactness=args.compactness,
+                                  max_iter=args.iterations, workers=args.workers,
+                                  callback=lambda i, seconds: times.append(seconds))
+        else:
+            slic.slic(lab, n_segments=args.segments, compactness=args.compactness,
+                      max_iter=args.iterations, mode=args.mode,
+                      pyramid_factor=args.factor, refine_iter=args.refine,
+                      callback=lambda i, seconds: times.append(seconds))
+        total = time.perf_counter() - start
+        ms = np.array(times) * 1000.0
+        size = f"{rgba.shape[1]}x{rgba.shape[0]}"
+        print(f"{os.path.basename(path)[:40]:40s} {size:>11s} {len(ms):5d} "
+              f"{ms.mean():9.1f} {ms.min():8.1f} {ms.max():8.1f} {total * 1000:9.1f}")
+
+
+def bench_connectivity(args):
+    rng = np.random.default_rng(0)
+    print(f"{'icon':40s} {'size':>11s} {'fragments':>9s} {'segments':>8s} {'ms':>8s}")
+    for path in icon_paths(args.icons):
+        rgba = load_rgba(path)
+        rgb = rgba[..., :3].astype(np.int16)
+        if args.noise:
+            rgb += rng.integers(-args.noise, args.noise + 1, rgb.shape, dtype=np.int16)
+        lab = srgb_to_lab(np.clip(rgb, 0, 255).astype(np.uint8))
+        raw = slic.slic(lab, n_segments=args.segments, enforce=False)
+        same, _ = slic._neighbour_pairs(raw)
+        fragments = slic.connected_components(
+            slic.coo_matrix((np.ones(same[0].size), same), shape=(raw.size,) * 2),
+            directed=False)[0]
+        min_size = int(0.5 * raw.size / args.segments)
+        start = time.perf_counter()
+        labels = slic.enforce_connectivity(raw, min_size)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        size = f"{rgba.shape[1]}x{rgba.shape[0]}"
+        print(f"{os.path.basename(path)[:40]:40s} {size:>11s} {fragments:9d} "
+              f"{labels.max() + 1:8d} {elapsed:8.1f}")
+
+
+def bench_lab(args):
+    start = time.perf_counter()
+    colorspace.lab_table()
+    print(f"LAB table ready in {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(f"{'icon':40s} {'size':>11s} {'exact ms':>9s} {'lut ms':>8s} {'max err':>8s}")
+    for path in icon_paths(args.icons):
+        rgba = load_rgba(path)
+        start = time.perf_counter()
+        exact = srgb_to_lab(rgba, backend="exact")
+        mid = time.perf_counter()
+        lut = srgb_to_lab(rgba, backend="lut")
+        end = time.perf_counter()
+        size = f"{rgba.shape[1]}x{rgba.shape[0]}"
+        print(f"{os.path.basename(path)[:40]:40s} {size:>11s} {(mid - start) * 1000:9.1f} "
+              f"{(end - mid) * 1000:8.1f} {np.abs(exact - lut).max():8.1e}")
+
+
+def bench_kmeans(args):
+    print(f"{'icon':40s} {'points':>6s} {'k':>3s} {'lloyd ms':>9s} {'hamerly ms':>10s} "
+          f"{'speedup':>7s} {'dist ratio':>10s} {'same':>4s}")
+    for path in icon_paths(args.icons):
+        rgba = load_rgba(path)
+        index = PixelIndex.from_alpha(rgba)
+        values = index.gather(srgb_to_lab(rgba))
+        labels = slic.slic_sparse(values, index, n_segments=args.segments)
+        features = superpixel_features(values, labels, index)
+        points, weights = features.mean_lab, features.pixel_count.astype(np.float64)
+        for k in range(args.k_min, min(args.k_max, len(points)) + 1):
+            init = clustering.kmeans_plus_plus(points, k, weights)
+            results, best = {}, {}
+            for algorithm in ("lloyd", "hamerly"):
+                best[algorithm] = np.inf
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    results[algorithm] = clustering.kmeans(points, k, weights, init=init,
+                                                           algorithm=algorithm)
+                    best[algorithm] = min(best[algorithm], time.perf_counter() - start)
+            lloyd, hamerly = results["lloyd"], results["hamerly"]
+            ratio = hamerly.distance_evaluations / lloyd.distance_evaluations
+            same = np.array_equal(lloyd.labels, hamerly.labels)
+            print(f"{os.path.basename(path)[:40]:40s} {len(points):6d} {k:3d} "
+                  f"{best['lloyd'] * 1000:9.2f} {best['hamerly'] * 1000:10.2f} "
+                  f"{best['lloyd'] / best['hamerly']:7.2f} {ratio:10.2f} {str(same):>4s}")
+
+
+def bench_layers(args):
+    print(f"{'icon':40s} {'layers':>6s} {'extract ms':>10s} {'mode':>8s} "
+          f"{'encode ms':>9s} {'KiB':>8s}")
+    for path in icon_paths(args.icons):
+        rgba = load_rgba(path)
+        index = PixelIndex.from_alpha(rgba)
+        values = index.gather(srgb_to_lab(rgba))
+        labels = slic.slic_sparse(values, index, n_segments=args.segments)
+        clusters = clustering.cluster_superpixels(
+            superpixel_features(values, labels, index), args.clusters)
+        start = time.perf_counter()
+        extracted = layers.extract_layers(rgba, clusters.pixel_labels(labels), index)
+        extract_ms = (time.perf_counter() - start) * 1000.0
+        for mode in layers.OUTPUT_MODES:
+            start = time.perf_counter()
+            size = sum(len(layers.layer_png(layer, mode)) for layer in extracted)
+            encode_ms = (time.perf_counter() - start) * 1000.0
+            print(f"{os.path.basename(path)[:40]:40s} {len(extracted):6d} {extract_ms:10.1f} "
+                  f"{mode:>8s} {encode_ms:9.1f} {size / 1024:8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="stage", required=True)
+
+    p = sub.add_parser("slic", help="per-iteration SLIC timing")
+    p.add_argument("icons", nargs="*")
+    p.add_argument("--segments", type=int, default=1000)
+    p.add_argument("--compactness", type=float, default=10.0)
+    p.add_argument("--iterations", type=int, default=10)
+    p.add_argument("--mode", choices=slic.MODES, default="dense")
+    p.add_argument("--factor", type=int, choices=(2, 4), default=4,
+                   help="downsampling factor for --mode pyramid")
+    p.add_argument("--refine", type=int, default=2,
+                   help="full-resolution iterations for --mode pyramid")
+    p.add_argument("--workers", type=int, default=1,
+                   help="run the tiled multi-process executor with N workers")
+    p.add_argument("--sparse", action="store_true",
+                   help="segment only pixels above --alpha-threshold")
+    p.add_argument("--alpha-threshold", type=int, default=0)
+    p.set_defaults(func=bench_slic)
+
+    p = sub.add_parser("connectivity", help="connectivity enforcement on its own")
+    p.add_argument("icons", nargs="*")
+    p.add_argument("--segments", type=int, default=1000)
+    p.add_argument("--noise", type=int, default=0,
+                   help="add uniform RGB noise of this amplitude to create fragments")
+    p.set_defaults(func=bench_connectivity)
+
+    p = sub.add_parser("lab", help="exact vs lookup-table sRGB->LAB conversion")
+    p.add_argument("icons", nargs="*")
+    p.set_defaults(func=bench_lab)
+
+    p = sub.add_parser("kmeans", help="Lloyd vs Hamerly k-means on superpixel features")
+    p.add_argument("icons", nargs="*")
+    p.add_argument("--segments", type=int, default=1000)
+    p.add_argument("--k-min", type=int, default=2)
+    p.add_argument("--k-max", type=int, default=32)
+    p.add_argument("--repeat", type=int, default=3, help="keep the best of N runs")
+    p.set_defaults(func=bench_kmeans)
+
+    p = sub.add_parser("layers", help="layer extraction and full vs cropped PNG encoding")
+    p.add_argument("icons", nargs="*")
+    p.add_argument("--segments", type=int, default=1000)
+    p.add_argument("--clusters", type=int, default=8)
+    p.set_defaults(func=bench_layers)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""Disk-backed cache of processing results.
+
+Uploads are stored under a hex content hash (``uploads/cc070f57cb4db266.png``),
+so the same icon uploaded twice, by anyone, has the same name.  A result is
+keyed by that hash plus :func:`result_hash` of the canonical processing
+parameters and the layer output mode, and stored as a directory of layer
+PNGs and :data:`layers.METADATA_FILE`::
+
+    <root>/<upload hash>/<result hash>/layers.json
+                                      /layer_0.png ...
+
+Entries are written to a temporary directory and renamed into place, so
+readers never see a partial result.  The modification time of an entry
+directory records its last use; when the cache grows past ``max_bytes`` the
+least recently used entries are removed.  Since all state lives on disk,
+several server processes can share one cache directory.
+
+:class:`MemoryLRU` is the in-process counterpart for intermediates that are
+cheap to keep but slow to rebuild (decoded RGBA, LAB, superpixel labels), so
+a parameter tweak only recomputes the stages it affects.
+
+:class:`SingleFlight` coalesces concurrent requests for the same
+:func:`request_key`: the first caller computes, later callers arriving while
+it runs wait for and share its result instead of processing the icon again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+import layers as layers_module
+
+# Bump when a change to the pipeline alters results for the same parameters.
+CACHE_VERSION = 1
+
+
+def content_hash(data, length=16):
+    """Hex SHA-256 prefix of ``data`` (bytes), as used to name uploads."""
+    return hashlib.sha256(data).hexdigest()[:length]
+
+
+def canonical_params(params):
+    """Canonical JSON string of a parameter set.
+
+    ``params`` is a :class:`pipeline.ProcessingParams` or a plain dict.  Keys
+    are sorted and floats that hold integral values are written as integers,
+    so equivalent requests map to the same key.
+    """
+    if hasattr(params, "to_dict"):
+        params = params.to_dict()
+
+    def normalise(value):
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, (list, tuple)):
+            return [normalise(v) for v in value]
+        if isinstance(value, dict):
+            return {str(k): normalise(v) for k, v in value.items()}
+        return value
+
+    return json.dumps(normalise(dict(params)), sort_keys=True, separators=(",", ":"))
+
+
+def params_hash(params, length=16):
+    payload = f"v{CACHE_VERSION}:{canonical_params(params)}".encode()
+    return hashlib.sha256(payload).hexdigest()[:length]
+
+
+def result_hash(params, mode="cropped", length=16):
+    """Hash naming a stored result: the parameters plus the layer output
+    mode (:data:`layers.OUTPUT_MODES`), which changes the stored files."""
+    if mode not in layers_module.OUTPUT_MODES:
+        raise ValueError(f"unknown layer output mode {mode!r}; "
+                         f"expected one of {layers_module.OUTPUT_MODES}")
+    payload = f"v{CACHE_VERSION}:{mode}:{canonical_params(params)}".encode()
+    return hashlib.sha256(payload).hexdigest()[:length]
+
+
+def request_key(upload_hash, params, mode="cropped"):
+    """Canonical key of a processing request: upload and result hash."""
+    return (upload_hash, result_hash(params, mode))
+
+
+def _tree_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache:
+    """Layer results on disk, keyed by upload hash and parameters.
+
+    Args:
+        root: cache directory.
+        max_bytes: size budget; least recently used entries are evicted once
+            the cache exceeds it.
+    """
+
+    def __init__(self, root, max_bytes=2 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flights = SingleFlight()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, upload_hash, params, mode="cropped"):
+        """Directory of the entry for ``upload_hash``, ``params`` and ``mode``."""
+        return os.path.join(self.root, upload_hash, result_hash(params, mode))
+
+    def get(self, upload_hash, params, mode="cropped"):
+        """Metadata of a cached result in output ``mode``, or None.
+
+        The returned dict is the stored :data:`layers.METADATA_FILE` content
+        plus ``"path"``, the entry directory holding the layer files.
+        """
+        metadata = self._read(self.path(upload_hash, params, mode))
+        with self._lock:
+            if metadata is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return metadata
+
+    def _read(self, path):
+        try:
+            with open(os.path.join(path, layers_module.METADATA_FILE)) as f:
+                metadata = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        metadata["path"] = path
+        return metadata
+
+    def put(self, upload_hash, params, layers, mode="cropped"):
+        """Store ``layers`` (from :func:`layers.extract_layers`) and return
+        the metadata as :meth:`get` would."""
+        path = self.path(upload_hash, params, mode)
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+        try:
+            metadata = layers_module.save_layers(layers, tmp, mode)
+            metadata.update(upload=upload_hash, params=json.loads(canonical_params(params)))
+            with open(os.path.join(tmp, layers_module.METADATA_FILE), "w") as f:
+                json.dump(metadata, f, indent=2)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # Another process stored the same entry first; keep theirs.
+                shutil.rmtree(tmp, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        # The new entry is the most recently used, but on its own it may still
+        # exceed the budget; keep it so the returned path exists.
+        self.evict(keep=path)
+        metadata["path"] = path
+        return metadata
+
+    def get_or_compute(self, upload_hash, params, compute, mode="cropped"):
+        """Cached metadata, or store and return the layers of ``compute()``.
+
+        ``compute`` is called without arguments only on a miss and returns a
+        list of :class:`layers.Layer`.  Concurrent misses for the same entry
+        share one call through :attr:`flights`.
+        """
+        metadata = self.get(upload_hash, params, mode)
+        if metadata is None:
+            path = self.path(upload_hash, params, mode)
+            # Re-check inside the flight: an earlier flight may have stored
+            # the entry since the lookup above.
+            metadata, _ = self.flights.do(
+                request_key(upload_hash, params, mode),
+                lambda: self._read(path) or self.put(upload_hash, params, compute(), mode))
+        return metadata
+
+    def entries(self):
+        """``(last_used, size, path)`` of every entry, oldest first."""
+        found = []
+        for upload in os.listdir(self.root):
+            upload_dir = os.path.join(self.root, upload)
+            if not os.path.isdir(upload_dir):
+                continue
+            for name in os.listdir(upload_dir):
+                path = os.path.join(upload_dir, name)
+                if name.startswith(".tmp-") or not os.path.isdir(path):
+                    continue
+                try:
+                    found.append((os.stat(path).st_mtime, _tree_size(path), path))
+                except OSError:
+                    pass
+        return sorted(found)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until within ``max_bytes``,
+        never removing the entry directory ``keep``."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "bytes": self.size(), "max_bytes": self.max_bytes,
+                "flights": self.flights.stats()}
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time.
+
+    Callers that ask for a key while its computation is in flight wait for
+    it and get the same value (or exception).  Nothing is kept afterwards;
+    pair it with a cache for results that should outlive the flight.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.failures = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, compute):
+        """``(value, shared)``: the result of ``compute()`` for ``key`` and
+        whether it came from another caller's computation."""
+        with self._lock:
+            self.calls += 1
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(), True
+        try:
+            value = compute()
+        except BaseException as error:
+            with self._lock:
+                self.failures += 1
+                del self._flights[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            del self._flights[key]
+        future.set_result(value)
+        return value, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "executions": self.executions,
+                    "coalesced": self.coalesced, "failures": self.failures,
+                    "in_flight": len(self._flights)}
+
+
+def nbytes(value):
+    """Bytes held by the arrays in ``value`` (arrays, tuples/lists/dicts of
+    them, or objects with array attributes such as :class:`sparse.PixelIndex`)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    if hasattr(value, "__dict__"):
+        return sum(nbytes(v) for v in vars(value).values())
+    return 0
+
+
+class MemoryLRU:
+    """Thread-safe in-memory LRU mapping with a byte budget.
+
+    Args:
+        max_bytes: budget; least recently used entries are dropped to stay
+            within it.  A single value larger than the budget is not stored.
+    """
+
+    def __init__(self, max_bytes=512 << 20):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """Store ``value``; ``size`` defaults to :func:`nbytes` of it."""
+        size = nbytes(value) if size is None else size
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            if size > self.max_bytes:
+                return value
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self.current_bytes -= dropped
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+        return value
+
+    def discard(self, prefix):
+        """Drop every entry whose key is a tuple starting with ``prefix``."""
+        with self._lock:
+            for key in [k for k in self._entries
+                        if isinstance(k, tuple) and k[:len(prefix)] == prefix]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
@@ -0,0 +1,575 @@
+"""K-means clustering of superpixel features.
+
+Points are the superpixel feature rows (a few hundred of them), optionally
+weighted by superpixel pixel count.  Two Lloyd-equivalent algorithms are
+available: plain ``"lloyd"``, which evaluates every point-to-center distance
+in every iteration, and ``"hamerly"``, which keeps an upper bound on each
+point's distance to its center and a lower bound on the distance to every
+other center and skips points whose bounds prove the assignment unchanged.
+Both start from the same deterministic k-means++ seeding and converge to the
+same clustering.  Hamerly's bookkeeping costs a few vectorised passes per
+iteration, so it only pays off once ``n * k`` is large (thousands of points
+with ``k >= 16``); ``python benchmark.py kmeans`` compares the two.
+
+:func:`cluster_superpixels` is the pipeline's entry point: it clusters the
+:class:`superpixels.SuperpixelFeatures` of an icon, weighted by pixel count so
+that each superpixel counts as many times as it has pixels, and
+:meth:`SuperpixelClusters.pixel_labels` maps the result back through the
+superpixel label map.  K-means then runs on hundreds of points instead of
+millions of pixels.
+
+Besides that, this module supports warm-starting from an earlier result
+when only the cluster count changes: the previous centers are split or merged
+until there are ``k`` of them and Lloyd iterations continue from there.
+:class:`ClusterCache` keeps the features and the last result per upload so a
+change of K skips LAB conversion and SLIC entirely.
+
+:func:`select_k` picks K automatically in one call.  It clusters every K of a
+range, each run warm-started from the previous K, and scores the runs with a
+weighted silhouette or the inertia elbow.  The silhouette uses one pairwise
+distance matrix shared by all candidates.  The resulting :class:`KCurve` is
+kept by :class:`ClusterCache`, so a later request for any K in the range is a
+lookup.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class KMeansResult:
+    """Outcome of a k-means run.
+
+    Attributes:
+        centers: ``(k, d)`` cluster centers.
+        labels: ``(n,)`` cluster index of every point.
+        inertia: weighted sum of squared distances to the assigned centers.
+        n_iter: number of Lloyd iterations performed.
+        distance_evaluations: point-to-center distances computed, excluding
+            the final inertia pass; for comparing algorithms.
+    """
+
+    centers: np.ndarray
+    labels: np.ndarray
+    inertia: float
+    n_iter: int
+    distance_evaluations: int = 0
+
+    @property
+    def k(self):
+        return len(self.centers)
+
+
+def _prepare(points, weights):
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim == 1:
+        points = points[:, None]
+    if weights is None:
+        weights = np.ones(len(points))
+    else:
+        weights = np.asarray(weights, dtype=np.float64)
+    return points, weights
+
+
+def squared_distances(points, centers):
+    """``(n, k)`` squared Euclidean distances, clipped at zero."""
+    d = (np.einsum("ij,ij->i", points, points)[:, None]
+         - 2.0 * points @ centers.T
+         + np.einsum("ij,ij->i", centers, centers)[None, :])
+    return np.maximum(d, 0.0, out=d)
+
+
+def kmeans_plus_plus(points, k, weights=None, seed=0):
+    """Weighted greedy k-means++ seeding.
+
+    Each new center is the best of ``2 + ln(k)`` candidates sampled with
+    probability proportional to ``w * D^2`` (the variant scikit-learn uses),
+    which avoids most of the poor seedings of single-candidate k-means++.
+    """
+    points, weights = _prepare(points, weights)
+    rng = np.random.default_rng(seed)
+    n = len(points)
+    trials = 2 + int(np.log(k))
+    first = rng.choice(n, p=weights / weights.sum())
+    centers = [points[first]]
+    closest = ((points - points[first]) ** 2).sum(1)
+    for _ in range(1, k):
+        prob = weights * closest
+        total = prob.sum()
+        if total <= 0:
+            candidates = rng.integers(n, size=trials)
+        else:
+            candidates = rng.choice(n, size=trials, p=prob / total)
+        dist = np.minimum(closest[None, :],
+                          squared_distances(points[candidates], points))
+        best = int(np.argmin(dist @ weights))
+        centers.append(points[candidates[best]])
+        closest = dist[best]
+    return np.array(centers)
+
+
+def _weighted_means(points, weights, labels, k, previous):
+    wsum = np.bincount(labels, weights=weights, minlength=k)
+    sums = np.stack([np.bincount(labels, weights=weights * points[:, j], minlength=k)
+                     for j in range(points.shape[1])], axis=1)
+    centers = previous.copy()
+    nonempty = wsum > 0
+    centers[nonempty] = sums[nonempty] / wsum[nonempty, None]
+    return centers, nonempty
+
+
+def _reseed_empty(points, weights, centers, labels, nonempty, dist):
+    """Move empty clusters onto the points that contribute most to the inertia."""
+    empty = np.flatnonzero(~nonempty)
+    if empty.size:
+        cost = weights * dist[np.arange(len(points)), labels]
+        for c, idx in zip(empty, np.argsort(-cost)[:empty.size]):
+            centers[c] = points[idx]
+    return centers
+
+
+def lloyd(points, centers, weights=None, max_iter=100, tol=1e-4):
+    """Weighted Lloyd iterations from the given initial ``centers``."""
+    points, weights = _prepare(points, weights)
+    centers = np.array(centers, dtype=np.float64)
+    k = len(centers)
+    # Convergence threshold relative to the data spread, as in scikit-learn.
+    threshold = tol * np.mean(np.var(points, axis=0)) if len(points) > 1 else 0.0
+    n_iter = 0
+    for n_iter in range(1, max_iter + 1):
+        dist = squared_distances(points, centers)
+        labels = np.argmin(dist, axis=1)
+        new, nonempty = _weighted_means(points, weights, labels, k, centers)
+        new = _reseed_empty(points, weights, new, labels, nonempty, dist)
+        shift = ((new - centers) ** 2).sum()
+        centers = new
+        if shift <= threshold:
+            break
+    return _finish(points, weights, centers, n_iter, n_iter * len(points) * k)
+
+
+def _finish(points, weights, centers, n_iter, evaluations):
+    dist = squared_distances(points, centers)
+    labels = np.argmin(dist, axis=1)
+    inertia = float((weights * dist[np.arange(len(points)), labels]).sum())
+    return KMeansResult(centers, labels.astype(np.int32), inertia, n_iter, evaluations)
+
+
+def _two_nearest(points, centers):
+    """Index of, distance to, and second-smallest distance to the centers."""
+    d = np.sqrt(squared_distances(points, centers))
+    if centers.shape[0] == 1:
+        return np.zeros(len(points), dtype=np.intp), d[:, 0], np.full(len(points), np.inf)
+    part = np.argpartition(d, 1, axis=1)[:, :2]
+    rows = np.arange(len(points))
+    first = np.where(d[rows, part[:, 0]] <= d[rows, part[:, 1]], part[:, 0], part[:, 1])
+    second = np.where(first == part[:, 0], part[:, 1], part[:, 0])
+    return first, d[rows, first], d[rows, second]
+
+
+def hamerly(points, centers, weights=None, max_iter=100, tol=1e-4):
+    """Weighted Hamerly k-means from the given initial ``centers``.
+
+    Produces the same iterations as :func:`lloyd` but only evaluates the
+    distances of points whose bounds do not rule out a change of center.
+    """
+    points, weights = _prepare(points, weights)
+    centers = np.array(centers, dtype=np.float64)
+    n, k = len(points), len(centers)
+    threshold = tol * np.mean(np.var(points, axis=0)) if n > 1 else 0.0
+
+    labels, upper, lower = _two_nearest(points, centers)
+    evaluations = n * k
+    n_iter = 0
+    for n_iter in range(1, max_iter + 1):
+        if n_iter > 1:
+            # Half the distance from each center to its nearest other center:
+            # a point closer than that to its own center cannot switch.
+            if k > 1:
+                cc = np.sqrt(squared_distances(centers, centers))
+                np.fill_diagonal(cc, np.inf)
+                half = 0.5 * cc.min(axis=1)
+            else:
+                half = np.full(1, np.inf)
+            bound = np.maximum(half[labels], lower)
+            check = np.flatnonzero(upper > bound)
+            if check.size:
+                upper[check] = np.sqrt(((points[check] - centers[labels[check]]) ** 2).sum(1))
+                evaluations += check.size
+                check = check[upper[check] > bound[check]]
+            if check.size:
+                labels[check], upper[check], lower[check] = _two_nearest(points[check], centers)
+                evaluations += check.size * k
+
+        new, nonempty = _weighted_means(points, weights, labels, k, centers)
+        if not nonempty.all():
+            dist = squared_distances(points, centers)
+            evaluations += n * k
+            new = _reseed_empty(points, weights, new, labels, nonempty, dist)
+        moved = np.sqrt(((new - centers) ** 2).sum(1))
+        shift = (moved ** 2).sum()
+        centers = new
+
+        # Keep the bounds valid for the moved centers.
+        upper += moved[labels]
+        if k > 1:
+            order = np.argsort(moved)
+            largest, runner_up = order[-1], order[-2]
+            lower -= np.where(labels == largest, moved[runner_up], moved[largest])
+        if shift <= threshold:
+            break
+    return _finish(points, weights, centers, n_iter, evaluations)
+
+
+ALGORITHMS = {"lloyd": lloyd, "hamerly": hamerly}
+
+
+def kmeans(points, k, weights=None, init=None, max_iter=100, tol=1e-4, seed=0,
+           algorithm="lloyd"):
+    """Weighted k-means.
+
+    Args:
+        points: ``(n, d)`` feature rows.
+        k: number of clusters; clipped to the number of points.
+        weights: optional ``(n,)`` point weights (e.g. superpixel pixel counts).
+        init: optional ``(k, d)`` initial centers; k-means++ otherwise.
+        max_iter, tol: Lloyd stopping criteria.
+        seed: seed for k-means++, so results are deterministic.
+        algorithm: ``"lloyd"`` or ``"hamerly"``.
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"unknown k-means algorithm {algorithm!r}; "
+                         f"expected one of {sorted(ALGORITHMS)}")
+    points, weights = _prepare(points, weights)
+    k = max(1, min(int(k), len(points)))
+    if init is None:
+        init = kmeans_plus_plus(points, k, weights, seed)
+    return ALGORITHMS[algorithm](points, init, weights, max_iter, tol)
+
+
+def _split_cluster(points, weights, centers, labels, c):
+    """Replace center ``c`` by two centers along its principal axis."""
+    members = labels == c
+    pts, w = points[members], weights[members]
+    if len(pts) < 2:
+        return np.vstack([centers, centers[c]])
+    diff = pts - centers[c]
+    cov = (diff * w[:, None]).T @ diff / w.sum()
+    values, vectors = np.linalg.eigh(cov)
+    offset = vectors[:, -1] * np.sqrt(max(values[-1], 0.0))
+    centers = centers.copy()
+    centers[c] = centers[c] + offset
+    return np.vstack([centers, centers[c] - 2.0 * offset])
+
+
+def warm_start_centers(points, previous, k, weights=None):
+    """Grow or shrink ``previous`` (a :class:`KMeansResult`) to ``k`` centers.
+
+    Growing repeatedly bisects the cluster with the largest weighted squared
+    error along its principal axis.  Shrinking repeatedly merges the pair of
+    centers whose merge increases the error least (Ward's criterion), placing
+    the merged center at their weighted mean.
+    """
+    points, weights = _prepare(points, weights)
+    centers = previous.centers.copy()
+    labels = previous.labels
+    if len(centers) < k:
+        while len(centers) < k:
+            dist = squared_distances(points, centers)
+            labels = np.argmin(dist, axis=1)
+            sse = np.bincount(labels, weights=weights * dist[np.arange(len(points)), labels],
+                              minlength=len(centers))
+            centers = _split_cluster(points, weights, centers, labels, int(np.argmax(sse)))
+    elif len(centers) > k:
+        mass = np.bincount(labels, weights=weights, minlength=len(centers))
+        while len(centers) > k:
+            ward = (mass[:, None] * mass[None, :] / np.maximum(mass[:, None] + mass[None, :], 1e-12)
+                    * squared_distances(centers, centers))
+            np.fill_diagonal(ward, np.inf)
+            a, b = np.unravel_index(np.argmin(ward), ward.shape)
+            total = mass[a] + mass[b]
+            if total > 0:
+                centers[a] = (mass[a] * centers[a] + mass[b] * centers[b]) / total
+            mass[a] = total
+            centers = np.delete(centers, b, axis=0)
+            mass = np.delete(mass, b)
+    return centers
+
+
+CRITERIA = ("silhouette", "elbow")
+
+SILHOUETTE_MAX_POINTS = 2000
+
+
+@dataclass
+class KCurve:
+    """Clusterings and selection scores for a range of cluster counts.
+
+    Attributes:
+        results: ``{k: KMeansResult}`` for every evaluated K.
+        scores: ``{k: score}``; higher is better.
+        criterion: the criterion the scores were computed with.
+    """
+
+    results: dict
+    scores: dict
+    criterion: str
+
+    @property
+    def best_k(self):
+        return max(self.scores, key=lambda k: (self.scores[k], -k))
+
+    @property
+    def best(self):
+        return self.results[self.best_k]
+
+    def __contains__(self, k):
+        return k in self.results
+
+    def __getitem__(self, k):
+        return self.results[k]
+
+
+def pairwise_distances(points):
+    """``(n, n)`` Euclidean distances between the rows of ``points``."""
+    return np.sqrt(squared_distances(points, points))
+
+
+def silhouette(distances, labels, weights, k):
+    """Weighted mean silhouette of a clustering from precomputed distances.
+
+    Each point's mean intra- and nearest inter-cluster distances are weighted
+    by the other points' weights, which makes a superpixel count as its
+    pixels.  Points alone in their cluster score 0.
+    """
+    onehot = np.zeros((len(labels), k))
+    onehot[np.arange(len(labels)), labels] = weights
+    mass = onehot.sum(axis=0)
+    totals = distances @ onehot
+    rows = np.arange(len(labels))
+    own_mass = mass[labels] - weights
+    a = totals[rows, labels] / np.maximum(own_mass, 1e-12)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        others = totals / mass
+    others[rows, labels] = np.inf
+    others[:, mass == 0] = np.inf
+    b = others.min(axis=1)
+    s = np.where(own_mass > 0, (b - a) / np.maximum(np.maximum(a, b), 1e-12), 0.0)
+    return float((weights * s).sum() / weights.sum())
+
+
+def _elbow_scores(inertias):
+    # Distance of each point of the normalised inertia curve below the chord
+    # joining its end points; the knee is the farthest point.
+    ks = np.array(sorted(inertias), dtype=np.float64)
+    values = np.array([inertias[k] for k in sorted(inertias)])
+    if len(ks) < 3 or values[0] == values[-1]:
+        return {int(k): 0.0 for k in ks}
+    x = (ks - ks[0]) / (ks[-1] - ks[0])
+    y = (values - values[-1]) / (values[0] - values[-1])
+    return {int(k): float(score) for k, score in zip(ks, (1.0 - x) - y)}
+
+
+def select_k(points, weights=None, k_min=2, k_max=12, criterion="silhouette",
+             max_iter=100, tol=1e-4, seed=0, algorithm="lloyd"):
+    """Cluster for every K in ``[k_min, k_max]`` and score each clustering.
+
+    K = ``k_min`` is seeded with k-means++ and every following K is warm-started
+    from the previous result.  The silhouette criterion needs at least two
+    clusters and evaluates at most ``SILHOUETTE_MAX_POINTS`` points (the
+    heaviest ones), computing their pairwise distances once for all K.
+
+    Returns:
+        :class:`KCurve`; ``curve.best`` is the selected clustering.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"unknown K criterion {criterion!r}; expected one of {CRITERIA}")
+    points, weights = _prepare(points, weights)
+    k_max = max(1, min(int(k_max), len(points)))
+    k_min = max(2 if criterion == "silhouette" else 1, int(k_min))
+    k_min = min(k_min, k_max)
+
+    results = {}
+    previous = None
+    for k in range(k_min, k_max + 1):
+        init = None if previous is None else warm_start_centers(points, previous, k, weights)
+        previous = results[k] = kmeans(points, k, weights, init=init, max_iter=max_iter,
+                                       tol=tol, seed=seed, algorithm=algorithm)
+
+    if criterion == "elbow":
+        scores = _elbow_scores({k: r.inertia for k, r in results.items()})
+    elif k_max < 2:
+        scores = {k: 0.0 for k in results}
+    else:
+        sample = np.arange(len(points))
+        if len(points) > SILHOUETTE_MAX_POINTS:
+            sample = np.sort(np.argsort(-weights, kind="stable")[:SILHOUETTE_MAX_POINTS])
+        distances = pairwise_distances(points[sample])
+        scores = {k: silhouette(distances, r.labels[sample], weights[sample], k)
+                  for k, r in results.items()}
+    return KCurve(results, scores, criterion)
+
+
+@dataclass
+class SuperpixelClusters:
+    """Clustering of superpixels.
+
+    Attributes:
+        result: the :class:`KMeansResult` over the non-empty superpixels.
+        superpixel_cluster: ``(n_superpixels,)`` int32 cluster of every
+            superpixel; -1 for superpixels without pixels.
+        curve: the :class:`KCurve` when K was selected automatically.
+    """
+
+    result: KMeansResult
+    superpixel_cluster: np.ndarray
+    curve: KCurve = None
+
+    @property
+    def k(self):
+        return self.result.k
+
+    def pixel_labels(self, superpixel_labels):
+        """Per-pixel cluster labels for a superpixel label map.
+
+        Negative superpixel labels (transparent pixels) stay -1.
+        """
+        return map_clusters(self.superpixel_cluster, superpixel_labels)
+
+
+def map_clusters(superpixel_cluster, superpixel_labels):
+    """Look up the cluster of every pixel's superpixel, keeping -1 as -1."""
+    lut = np.append(np.asarray(superpixel_cluster, dtype=np.int32), np.int32(-1))
+    labels = np.asarray(superpixel_labels)
+    return lut[np.where(labels < 0, -1, labels)]
+
+
+def superpixel_points(features, spatial_weight=0.0):
+    """Clustering rows and weights of the non-empty superpixels.
+
+    Rows are the mean LAB colours, followed by the ``(y, x)`` centers scaled
+    by ``spatial_weight`` when it is non-zero.
+
+    Returns:
+        ``(points, weights, present)`` where ``present`` holds the indices of
+        the superpixels the rows belong to.
+    """
+    present = np.flatnonzero(features.pixel_count > 0)
+    points = features.mean_lab[present]
+    if spatial_weight:
+        points = np.hstack([points, spatial_weight * features.center[present]])
+    return points, features.pixel_count[present].astype(np.float64), present
+
+
+def cluster_superpixels(features, k, weighted=True, spatial_weight=0.0, init=None,
+                        max_iter=100, tol=1e-4, seed=0, algorithm="lloyd",
+                        k_range=(2, 12), criterion="silhouette"):
+    """Cluster superpixels into ``k`` colour clusters.
+
+    Args:
+        features: :class:`superpixels.SuperpixelFeatures` of the icon.
+        k: number of clusters, clipped to the number of non-empty
+            superpixels, or ``"auto"`` to pick it from ``k_range`` with
+            :func:`select_k` and ``criterion``.
+        weighted: weight superpixels by pixel count, so the centers equal the
+            pixel-level means of their clusters.
+        spatial_weight: scale of the superpixel centers appended to the LAB
+            features; 0 clusters on colour only.
+        init, max_iter, tol, seed, algorithm: passed to :func:`kmeans`.
+
+    Returns:
+        :class:`SuperpixelClusters`.
+    """
+    points, weights, present = superpixel_points(features, spatial_weight)
+    if not len(points):
+        raise ValueError("no superpixels with pixels to cluster")
+    weights = weights if weighted else None
+    curve = None
+    if k == "auto":
+        curve = select_k(points, weights, k_range[0], k_range[1], criterion,
+                         max_iter=max_iter, tol=tol, seed=seed, algorithm=algorithm)
+        result = curve.best
+    else:
+        result = kmeans(points, k, weights, init=init, max_iter=max_iter, tol=tol,
+                        seed=seed, algorithm=algorithm)
+    cluster = np.full(len(features), -1, dtype=np.int32)
+    cluster[present] = result.labels
+    return SuperpixelClusters(result, cluster, curve)
+
+
+class ClusterCache:
+    """Per-upload cache of clustering inputs and the latest result.
+
+    Stores the superpixel feature matrix (and weights) of each upload together
+    with the last :class:`KMeansResult`, so moving the cluster-count control
+    only re-runs k-means, warm-started from the previous centers.
+
+    Args:
+        max_entries: number of uploads kept; least recently used are dropped.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put_features(self, key, points, weights=None):
+        points, weights = _prepare(points, weights)
+        with self._lock:
+            self._entries[key] = {"points": points, "weights": weights, "result": None,
+                                  "curve": None, "curve_params": None}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def has_features(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def cluster(self, key, k, seed=0, max_iter=100, tol=1e-4, algorithm="lloyd"):
+        """Cluster the cached features of ``key`` into ``k`` clusters.
+
+        Served from the upload's :class:`KCurve` when :meth:`select_k` has
+        covered ``k``; otherwise warm-starts from the last result for this
+        upload when there is one, or seeds with k-means++.  Raises
+        ``KeyError`` for unknown keys.
+        """
+        with self._lock:
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+        points, weights, previous = entry["points"], entry["weights"], entry["result"]
+        k = max(1, min(int(k), len(points)))
+        if entry["curve"] is not None and k in entry["curve"]:
+            entry["result"] = entry["curve"][k]
+            return entry["result"]
+        if previous is not None and previous.k == k:
+            return previous
+        init = None
+        if previous is not None:
+            init = warm_start_centers(points, previous, k, weights)
+        result = kmeans(points, k, weights, init=init, max_iter=max_iter, tol=tol,
+                        seed=seed, algorithm=algorithm)
+        entry["result"] = result
+        return result
+
+    def select_k(self, key, k_min=2, k_max=12, criterion="silhouette", seed=0,
+                 max_iter=100, tol=1e-4, algorithm="lloyd"):
+        """Automatic K for ``key``; the whole :class:`KCurve` is cached.
+
+        Returns the cached curve when it was computed for the same range and
+        criterion.  Raises ``KeyError`` for unknown keys.
+        """
+        with self._lock:
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+        params = (k_min, k_max, criterion, seed)
+        if entry["curve"] is not None and entry["curve_params"] == params:
+            return entry["curve"]
+        curve = select_k(entry["points"], entry["weights"], k_min, k_max, criterion,
+                         max_iter=max_iter, tol=tol, seed=seed, algorithm=algorithm)
+        entry["curve"], entry["curve_params"] = curve, params
+        entry["result"] = curve.best
+        return curve
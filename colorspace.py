@@ -0,0 +1,181 @@
+"""sRGB -> CIELAB conversion used by the segmentation pipeline.
+
+All functions accept either an ``(H, W, 3)`` image or an ``(N, 3)`` array of
+pixels and return an array of the same leading shape.  Inputs may be ``uint8``
+(0-255) or floating point (0-1).
+
+Two backends are available through :func:`srgb_to_lab`:
+
+``"exact"``
+    The full sRGB -> linear -> XYZ -> LAB chain in float64.
+``"lut"``
+    A packed 24-bit table holding the float32 LAB value of every 8-bit sRGB
+    colour (192 MiB).  It is built once from the exact chain, saved to
+    ``$ICON_DECOMPOSER_CACHE`` (default ``~/.cache/icon-decomposer``) and
+    memory-mapped read-only, so every server worker on a host shares the same
+    physical pages.  Conversion is then a single gather per pixel.
+
+The pipeline's lightness weighting and green-axis scaling are applied
+afterwards by :func:`apply_lab_weights`, which keeps the cached table
+independent of those parameters.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+# D65 reference white, matching skimage.color.rgb2lab.
+D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+SRGB_TO_XYZ = np.array([
+    [0.412453, 0.357580, 0.180423],
+    [0.212671, 0.715160, 0.072169],
+    [0.019334, 0.119193, 0.950227],
+])
+
+_LAB_EPSILON = 216.0 / 24389.0
+_LAB_KAPPA = 24389.0 / 27.0
+
+BACKENDS = ("exact", "lut")
+
+CACHE_ENV = "ICON_DECOMPOSER_CACHE"
+LAB_TABLE_FILE = "srgb_lab_d65_v1.npy"
+
+_lab_table = None
+
+
+def _to_unit_float(rgb):
+    rgb = np.asarray(rgb)
+    if rgb.dtype == np.uint8:
+        return rgb.astype(np.float64) / 255.0
+    return rgb.astype(np.float64, copy=False)
+
+
+def _decode_gamma(c):
+    return np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+
+
+# Linear value of every 8-bit channel value.
+_LINEAR_U8 = _decode_gamma(np.arange(256) / 255.0)
+
+
+def srgb_to_linear(rgb):
+    """Undo the sRGB transfer curve.  ``rgb`` is uint8 or float in [0, 1]."""
+    rgb = np.asarray(rgb)
+    if rgb.dtype == np.uint8:
+        return _LINEAR_U8[rgb]
+    return _decode_gamma(_to_unit_float(rgb))
+
+
+def linear_to_lab(linear):
+    """Convert linear RGB (float, [0, 1]) to CIELAB."""
+    xyz = linear @ SRGB_TO_XYZ.T
+    xyz /= D65_WHITE
+    f = np.where(xyz > _LAB_EPSILON, np.cbrt(xyz), (_LAB_KAPPA * xyz + 16.0) / 116.0)
+    lab = np.empty_like(f)
+    lab[..., 0] = 116.0 * f[..., 1] - 16.0
+    lab[..., 1] = 500.0 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200.0 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+def srgb_to_lab(rgb, backend="exact", out=None):
+    """Convert sRGB pixels to CIELAB (L in [0, 100]).
+
+    Args:
+        rgb: ``(..., 3)`` or ``(..., 4)`` sRGB pixels; alpha is ignored.
+        backend: ``"exact"`` (float64 result) or ``"lut"`` (float32 result
+            from the shared lookup table).  Non-uint8 input always uses the
+            exact path.
+        out: optional preallocated ``(..., 3)`` array (e.g. a workspace
+            buffer) that receives the result.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown LAB backend {backend!r}; expected one of {BACKENDS}")
+    rgb = np.asarray(rgb)
+    if rgb.shape[-1] == 4:
+        rgb = rgb[..., :3]
+    if backend == "lut" and rgb.dtype == np.uint8:
+        if out is not None and out.dtype == np.float32:
+            return np.take(lab_table(), packed_rgb(rgb), axis=0, out=out)
+        lab = np.take(lab_table(), packed_rgb(rgb), axis=0)
+    else:
+        lab = linear_to_lab(srgb_to_linear(rgb))
+    if out is None:
+        return lab
+    out[...] = lab
+    return out
+
+
+def packed_rgb(rgb):
+    """Pack uint8 ``(..., 3)`` pixels into 24-bit ``0xRRGGBB`` table indices."""
+    rgb = rgb.astype(np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+def cache_dir():
+    return os.environ.get(CACHE_ENV) or os.path.join(
+        os.path.expanduser("~"), ".cache", "icon-decomposer")
+
+
+def build_lab_table(path):
+    """Compute the 24-bit sRGB -> LAB table and write it atomically to ``path``.
+
+    The table is written to a temporary file in the same directory and then
+    renamed, so concurrent builders never expose a partial file; whichever
+    rename lands last wins with identical contents.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".npy.tmp")
+    os.close(fd)
+    try:
+        table = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32,
+                                          shape=(1 << 24, 3))
+        gb = np.stack(np.meshgrid(np.arange(256), np.arange(256), indexing="ij"),
+                      axis=-1).reshape(-1, 2).astype(np.uint8)
+        rgb = np.empty((gb.shape[0], 3), dtype=np.uint8)
+        rgb[:, 1:] = gb
+        for r in range(256):
+            rgb[:, 0] = r
+            table[r << 16:(r + 1) << 16] = linear_to_lab(_LINEAR_U8[rgb])
+        table.flush()
+        del table
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def lab_table(directory=None):
+    """Return the memory-mapped ``(2**24, 3)`` float32 LAB table.
+
+    The table is loaded once per process and built on first use if the cache
+    file does not exist yet.
+    """
+    global _lab_table
+    if _lab_table is None or directory is not None:
+        path = os.path.join(directory or cache_dir(), LAB_TABLE_FILE)
+        if not os.path.exists(path):
+            build_lab_table(path)
+        table = np.load(path, mmap_mode="r")
+        if directory is not None:
+            return table
+        _lab_table = table
+    return _lab_table
+
+
+def apply_lab_weights(lab, lightness_weight=1.0, green_axis_scale=1.0):
+    """Apply the pipeline's LAB weighting as a cheap in-place post-pass.
+
+    ``L`` is multiplied by ``lightness_weight`` and negative (green) ``a``
+    values by ``green_axis_scale``.  Returns ``lab``.
+    """
+    if lightness_weight != 1.0:
+        lab[..., 0] *= lightness_weight
+    if green_axis_scale != 1.0:
+        a = lab[..., 1]
+        a[a < 0] *= green_axis_scale
+    return lab
@@ -0,0 +1,124 @@
+"""Streaming ZIP export of an icon's layers.
+
+:func:`stream_zip` produces a ZIP archive as a generator of byte chunks that
+a server hands to the response as a chunked body, so the download starts
+with the first layer and memory stays bounded by one entry (or, for files,
+one chunk) whatever the number of layers.  The archive is written by
+:mod:`zipfile` to a sink that cannot seek, so every entry carries a data
+descriptor after its contents instead of sizes patched into its header.
+
+PNG data is already deflate-compressed, so entries are ``ZIP_STORED``.
+Entry timestamps are fixed, which makes the archive for a given result
+byte-for-byte reproducible.
+
+The entries come either from layers as they are extracted
+(:func:`layer_entries`, encoding each PNG on the way) or from a
+:class:`cache.ResultCache` entry directory (:func:`cached_entries`, copying
+the stored PNGs without re-encoding).  A handler answers with
+:func:`zip_headers` and streams::
+
+    stream_zip(cached_entries(metadata))
+"""
+
+import json
+import os
+import zipfile
+
+from layers import METADATA_FILE, layer_metadata, layer_png
+
+CHUNK_SIZE = 64 << 10
+
+# Earliest time a ZIP header can hold.
+ZIP_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+
+class _Sink:
+    """Write-only file object collecting what :mod:`zipfile` writes."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _zip_info(name, size):
+    info = zipfile.ZipInfo(name, ZIP_TIMESTAMP)
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    info.file_size = size
+    return info
+
+
+def stream_zip(entries, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP archive of ``entries`` as byte chunks.
+
+    Args:
+        entries: iterable of ``(name, data)`` where ``data`` is bytes or the
+            path of a file, which is copied ``chunk_size`` bytes at a time.
+            It is consumed lazily, so entries can be produced on demand.
+        chunk_size: file read size.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+        for name, data in entries:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                with archive.open(_zip_info(name, len(data)), "w") as out:
+                    out.write(data)
+            else:
+                with open(data, "rb") as src, \
+                        archive.open(_zip_info(name, os.path.getsize(data)), "w") as out:
+                    for block in iter(lambda: src.read(chunk_size), b""):
+                        out.write(block)
+                        yield sink.drain()
+            yield sink.drain()
+    # Closing the archive writes the central directory.
+    tail = sink.drain()
+    if tail:
+        yield tail
+
+
+def layer_entries(layers, mode="cropped", prefix="layer", compress_level=6):
+    """``(name, png)`` entries for ``layers`` followed by the metadata JSON.
+
+    ``layers`` may be a generator such as :func:`layers.iter_layers`; each
+    layer is encoded only when the archive reaches it.  Names and metadata
+    match :func:`layers.save_layers`.
+    """
+    entries = []
+    canvas = (0, 0)
+    for layer in layers:
+        filename = f"{prefix}_{layer.label}.png"
+        yield filename, layer_png(layer, mode, compress_level)
+        entries.append(layer_metadata(layer, mode, filename))
+        canvas = layer.canvas
+    metadata = {"mode": mode, "canvas": {"width": canvas[1], "height": canvas[0]},
+                "layers": entries}
+    yield METADATA_FILE, json.dumps(metadata, indent=2).encode()
+
+
+def cached_entries(metadata):
+    """Entries for a stored result: its layer files and metadata file.
+
+    ``metadata`` is what :meth:`cache.ResultCache.get` returns.
+    """
+    path = metadata["path"]
+    for layer in metadata["layers"]:
+        yield layer["filename"], os.path.join(path, layer["filename"])
+    yield METADATA_FILE, os.path.join(path, METADATA_FILE)
+
+
+def zip_headers(filename):
+    """Response headers for a ZIP download; no ``Content-Length``, so the
+    body is sent chunked."""
+    return {"Content-Type": "application/zip",
+            "Content-Disposition": f'attachment; filename="{filename}"'}
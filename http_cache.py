@@ -0,0 +1,160 @@
+"""HTTP caching of uploads and layer files.
+
+Uploads are stored under the hash of their bytes, and a stored layer never
+changes: its :class:`cache.ResultCache` entry is named by the upload hash and
+:func:`cache.result_hash` of the canonical parameters and output mode (which
+includes :data:`cache.CACHE_VERSION`).  URLs therefore mirror that layout::
+
+    /uploads/<upload hash>.png
+    /layers/<upload hash>/<result hash>/layer_3.png
+
+and responses for them carry a strong ``ETag`` computed from those hashes and
+the file name, with ``Cache-Control: public, max-age=31536000, immutable``.
+Browsers and the CDN reuse them without revalidating; a client that still
+asks with a matching ``If-None-Match`` gets a ``304 Not Modified`` that is
+decided from the URL alone, without touching the disk.
+
+:func:`upload_response` and :func:`layer_response` are the whole handlers,
+independent of the web framework.  A 404 for a layer means the entry was
+evicted from the result cache; the client recovers by requesting the result
+again for the same upload, parameters and mode.
+"""
+
+import mimetypes
+import os
+import re
+
+from cache import content_hash, result_hash
+from layers import METADATA_FILE
+
+LAYER_URL_PREFIX = "/layers"
+UPLOAD_URL_PREFIX = "/uploads"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+_HASH = re.compile(r"[0-9a-f]{16}")
+_FILENAME = re.compile(r"[A-Za-z0-9_-]+_\d+\.png|" + re.escape(METADATA_FILE))
+_UPLOAD = re.compile(r"([0-9a-f]{16})\.(png|jpg|jpeg|webp)")
+
+
+def upload_url(upload_hash, extension="png", prefix=UPLOAD_URL_PREFIX):
+    """Content-addressed URL of a stored upload."""
+    return f"{prefix}/{upload_hash}.{extension}"
+
+
+def layer_url(upload_hash, params, filename, mode="cropped", prefix=LAYER_URL_PREFIX):
+    """Content-addressed URL of a stored layer file.
+
+    ``params`` is a :class:`pipeline.ProcessingParams` or a dict, combined
+    with the output ``mode``, or an already computed
+    :func:`cache.result_hash` (``mode`` is then ignored).
+    """
+    if not isinstance(params, str):
+        params = result_hash(params, mode)
+    return f"{prefix}/{upload_hash}/{params}/{filename}"
+
+
+def add_layer_urls(metadata, prefix=LAYER_URL_PREFIX):
+    """Set a ``"url"`` on every layer of :meth:`cache.ResultCache.get`
+    metadata, for the frontend to load; returns ``metadata``."""
+    path = metadata["path"]
+    upload, params = os.path.basename(os.path.dirname(path)), os.path.basename(path)
+    for layer in metadata["layers"]:
+        layer["url"] = layer_url(upload, params, layer["filename"], prefix=prefix)
+    return metadata
+
+
+def parse_layer_url(path, prefix=LAYER_URL_PREFIX):
+    """``(upload_hash, result_hash, filename)`` of a :func:`layer_url` path.
+
+    Raises ``ValueError`` for anything else, which also keeps request paths
+    from reaching outside the cache directory.
+    """
+    if not path.startswith(prefix + "/"):
+        raise ValueError(f"not a layer URL: {path!r}")
+    parts = path[len(prefix) + 1:].split("/")
+    if (len(parts) != 3 or not _HASH.fullmatch(parts[0]) or not _HASH.fullmatch(parts[1])
+            or not _FILENAME.fullmatch(parts[2])):
+        raise ValueError(f"not a layer URL: {path!r}")
+    return tuple(parts)
+
+
+def etag(upload_hash, result_hash=None, filename=None):
+    """Strong ETag (quoted) of a stored layer file, or of the upload itself
+    when only ``upload_hash`` is given."""
+    if result_hash is None:
+        return f'"{upload_hash}"'
+    return '"' + content_hash(f"{upload_hash}/{result_hash}/{filename}".encode()) + '"'
+
+
+def _header(headers, name):
+    value = headers.get(name)
+    if value is None:
+        value = headers.get(name.lower())
+    return value
+
+
+def if_none_match(header, tag):
+    """Whether an ``If-None-Match`` header value matches ``tag``.
+
+    Uses the weak comparison RFC 9110 prescribes for this header, so a
+    ``W/`` prefix added by an intermediary still matches.
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in header.split(","))
+
+
+def _file_response(file_path, tag, request_headers, entry=None):
+    headers = {"ETag": tag, "Cache-Control": IMMUTABLE}
+    if if_none_match(_header(request_headers, "If-None-Match"), tag):
+        return 304, headers, None
+    if not os.path.isfile(file_path):
+        return 404, {}, None
+    if entry is not None:
+        try:
+            # Count the request as a use for the cache's LRU eviction.
+            os.utime(entry)
+        except OSError:
+            pass
+    content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    headers["Content-Type"] = content_type
+    headers["Content-Length"] = str(os.path.getsize(file_path))
+    return 200, headers, file_path
+
+
+def upload_response(directory, path, request_headers, prefix=UPLOAD_URL_PREFIX):
+    """Answer a request for an :func:`upload_url` from the uploads ``directory``.
+
+    Returns ``(status, headers, body)`` as :func:`layer_response`.
+    """
+    if not path.startswith(prefix + "/"):
+        return 404, {}, None
+    match = _UPLOAD.fullmatch(path[len(prefix) + 1:])
+    if match is None:
+        return 404, {}, None
+    return _file_response(os.path.join(directory, match.group(0)), etag(match.group(1)),
+                          request_headers)
+
+
+def layer_response(results, path, request_headers, prefix=LAYER_URL_PREFIX):
+    """Answer a request for a layer URL.
+
+    Args:
+        results: the :class:`cache.ResultCache` holding the layers.
+        path: request path.
+        request_headers: mapping of request headers.
+
+    Returns:
+        ``(status, headers, body)``: 200 with the file path to send as the
+        body, 304 without a body, or 404.
+    """
+    try:
+        upload, result, filename = parse_layer_url(path, prefix)
+    except ValueError:
+        return 404, {}, None
+    entry = os.path.join(results.root, upload, result)
+    return _file_response(os.path.join(entry, filename), etag(upload, result, filename),
+                          request_headers, entry)
@@ -0,0 +1,331 @@
+"""Background processing jobs.
+
+Processing an upload inside a request handler ties up a server thread for as
+long as the icon takes and runs into proxy timeouts.  A :class:`JobManager`
+instead queues the work and returns a job id immediately.  At most
+``max_concurrent`` jobs run at a time, each in a worker process of a bounded
+pool whose workers keep their LAB table and workspace between jobs, and
+clients poll :meth:`JobManager.status` / :meth:`JobManager.result`.
+
+The manager is independent of the web framework: handlers map a submit
+request to :meth:`JobManager.submit` and the status and result endpoints to
+the corresponding methods, whose return values are JSON-serialisable (except
+for the processing result itself).
+
+With an ``events`` queue the manager also reports progress: status changes
+are put on it as ``(job_id, status, status_dict)`` and the task is called
+with an ``emit=`` :class:`progress.Emitter` for its own events (the task
+then defaults to :func:`progress.process_with_progress`), ready for
+:meth:`progress.ProgressBroker.relay`.
+
+Jobs submitted with a ``key`` (:func:`cache.request_key` of the upload and
+parameters) are coalesced: while a job with that key is queued or running,
+submitting it again returns the existing job id instead of processing the
+icon twice.
+
+Results are held in the server process until polled, so their total size is
+bounded by ``max_result_bytes`` (arrays counted with :func:`cache.nbytes`);
+the oldest are dropped first.  A full :class:`pipeline.ProcessingResult`
+holds two canvas-sized label maps and every layer's pixels, so a server
+that stores layers in a :class:`cache.ResultCache` should rather use a task
+returning the entry's metadata, which costs next to nothing to keep.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
+
+import pipeline
+import progress
+from cache import nbytes
+
+STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+
+class JobQueueFull(RuntimeError):
+    """Raised by :meth:`JobManager.submit` when ``max_queued`` jobs are waiting."""
+
+
+@dataclass
+class Job:
+    """State of one job.
+
+    Attributes:
+        id: hex job id.
+        status: one of :data:`STATUSES`.
+        submitted, started, finished: ``time.time()`` stamps, None until reached.
+        result: the task's return value once done; None again once it was
+            dropped to stay within ``max_result_bytes``.
+        error: ``"ExceptionType: message"`` if the task failed.
+        key: coalescing key given to :meth:`JobManager.submit`, if any.
+    """
+
+    id: str
+    args: tuple
+    status: str = "queued"
+    submitted: float = None
+    started: float = None
+    finished: float = None
+    result: object = None
+    error: str = None
+    key: object = None
+
+    def to_dict(self):
+        return {"id": self.id, "status": self.status, "submitted": self.submitted,
+                "started": self.started, "finished": self.finished, "error": self.error}
+
+
+class JobManager:
+    """Queue of jobs run on a bounded process pool.
+
+    Args:
+        max_concurrent: jobs running at once; also the pool size.
+        max_queued: jobs allowed to wait; :meth:`submit` raises
+            :class:`JobQueueFull` beyond it.  None for no limit.
+        max_finished: finished jobs kept for polling; older ones are forgotten.
+        task: function run in the workers with the arguments given to
+            :meth:`submit`; :func:`pipeline.process` by default, or
+            :func:`progress.process_with_progress` with ``events``.  With
+            ``events`` it must accept an ``emit`` keyword argument.
+        executor: an existing executor to use instead of a private pool.
+        lab_backends: LAB backends whose tables the private pool's workers
+            load at start.
+        events: optional queue receiving progress events (see above); it
+            must be picklable to the workers, e.g. from
+            ``multiprocessing.Manager().Queue()``.
+        max_result_bytes: budget for the results of finished jobs; the oldest
+            are dropped to stay within it, and a result larger than the
+            budget is not kept at all.
+    """
+
+    def __init__(self, max_concurrent=2, max_queued=64, max_finished=256,
+                 task=None, executor=None, lab_backends=("lut",), events=None,
+                 max_result_bytes=256 << 20):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self.max_result_bytes = max_result_bytes
+        if task is None:
+            task = pipeline.process if events is None else progress.process_with_progress
+        self.task = task
+        self.events = events
+        self._lab_backends = set(lab_backends)
+        self._own_executor = executor is None
+        self._executor = executor or self._new_pool()
+        self._jobs = {}
+        self._queue = deque()
+        self._running = 0
+        self._active = {}
+        self._finished = OrderedDict()
+        self._results = OrderedDict()
+        self._result_bytes = 0
+        self.submitted = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, *args, key=None):
+        """Queue ``task(*args)`` and return its job id.
+
+        With a hashable ``key``, a queued or running job with the same key
+        is reused and its id returned.
+        """
+        with self._lock:
+            self.submitted += 1
+            if key is not None and key in self._active:
+                self.coalesced += 1
+                return self._active[key].id
+            if self.max_queued is not None and len(self._queue) >= self.max_queued:
+                raise JobQueueFull(f"{len(self._queue)} jobs already queued")
+            job = Job(uuid.uuid4().hex, args, submitted=time.time(), key=key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._active[key] = job
+            self._queue.append(job)
+            self._report(job)
+            started = self._dispatch()
+        self._watch(started)
+        return job.id
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.max_concurrent,
+                                   initializer=pipeline._init_worker,
+                                   initargs=(self._lab_backends,))
+
+    def _submit(self, job):
+        if self.events is None:
+            return self._executor.submit(self.task, *job.args)
+        return self._executor.submit(self.task, *job.args,
+                                     emit=progress.Emitter(self.events, job.id))
+
+    def _dispatch(self):
+        # Called with the lock held.  Returns the started ``(job, future)``
+        # pairs, which the caller passes to _watch once it released the lock.
+        started = []
+        while self._queue and self._running < self.max_concurrent:
+            job = self._queue.popleft()
+            job.status, job.started = "running", time.time()
+            self._running += 1
+            self._report(job)
+            try:
+                try:
+                    future = self._submit(job)
+                except BrokenExecutor:
+                    if not self._own_executor:
+                        raise
+                    # A worker died (e.g. killed for using too much memory),
+                    # which breaks the whole pool; continue on a fresh one.
+                    self._executor.shutdown(wait=False)
+                    self._executor = self._new_pool()
+                    future = self._submit(job)
+            except Exception as error:
+                self._running -= 1
+                self._finish(job, error=error)
+                continue
+            started.append((job, future))
+        return started
+
+    def _watch(self, started):
+        # Called without the lock.  Futures that are already done are
+        # completed in this loop, so a run of fast jobs neither re-enters the
+        # lock nor recurses through add_done_callback.
+        while started:
+            job, future = started.pop()
+            if future.done():
+                started.extend(self._complete(job, future))
+            else:
+                future.add_done_callback(lambda f, job=job: self._watch([(job, f)]))
+
+    def _complete(self, job, future):
+        with self._lock:
+            self._running -= 1
+            error = future.exception()
+            if error is None:
+                self._finish(job, result=future.result())
+            else:
+                self._finish(job, error=error)
+            return self._dispatch()
+
+    def _finish(self, job, result=None, error=None):
+        # Called with the lock held.
+        job.finished = time.time()
+        if error is None:
+            job.status = "done"
+            self._keep_result(job, result)
+        else:
+            job.status, job.error = "failed", f"{type(error).__name__}: {error}"
+        job.args = ()
+        self._report(job)
+        self._retire(job)
+        self._changed.notify_all()
+
+    def _keep_result(self, job, result):
+        # Called with the lock held.
+        size = nbytes(result)
+        if size > self.max_result_bytes:
+            return
+        while self._results and self._result_bytes + size > self.max_result_bytes:
+            self._drop_result(next(iter(self._results)))
+        job.result = result
+        self._results[job.id] = size
+        self._result_bytes += size
+
+    def _drop_result(self, job_id):
+        self._result_bytes -= self._results.pop(job_id)
+        self._jobs[job_id].result = None
+
+    def _report(self, job):
+        if self.events is not None:
+            self.events.put((job.id, job.status, job.to_dict()))
+
+    def _retire(self, job):
+        if job.key is not None:
+            self._active.pop(job.key, None)
+        self._finished[job.id] = job
+        while len(self._finished) > self.max_finished:
+            old, _ = self._finished.popitem(last=False)
+            if old in self._results:
+                self._drop_result(old)
+            del self._jobs[old]
+
+    def _job(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"unknown job {job_id!r}")
+        return job
+
+    def status(self, job_id):
+        """Status dict of a job (see :meth:`Job.to_dict`), plus its queue position.
+
+        Raises ``KeyError`` for unknown or forgotten jobs.
+        """
+        with self._lock:
+            job = self._job(job_id)
+            info = job.to_dict()
+            if job.status == "queued":
+                info["position"] = self._queue.index(job)
+            return info
+
+    def result(self, job_id):
+        """The task's result if the job is done, else None.
+
+        Raises ``KeyError`` for unknown jobs and for results dropped to stay
+        within ``max_result_bytes`` (submit the job again), and
+        ``RuntimeError`` (with the worker's error message) for failed or
+        cancelled ones.
+        """
+        with self._lock:
+            job = self._job(job_id)
+            if job.status in ("failed", "cancelled"):
+                raise RuntimeError(f"job {job_id} {job.status}: {job.error}")
+            if job.status != "done":
+                return None
+            if job_id not in self._results:
+                raise KeyError(f"result of job {job_id!r} was dropped")
+            return job.result
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job has finished; returns its status dict."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            job = self._job(job_id)
+            while job.status in ("queued", "running"):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+        return self.status(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued job; returns False if it already started."""
+        with self._lock:
+            job = self._job(job_id)
+            if job.status != "queued":
+                return False
+            self._queue.remove(job)
+            job.status, job.finished, job.args = "cancelled", time.time(), ()
+            self._report(job)
+            self._retire(job)
+            self._changed.notify_all()
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {"queued": len(self._queue), "running": self._running,
+                    "max_concurrent": self.max_concurrent, "jobs": len(self._jobs),
+                    "submitted": self.submitted, "coalesced": self.coalesced,
+                    "results": len(self._results), "result_bytes": self._result_bytes}
+
+    def shutdown(self, wait=True):
+        """Cancel queued jobs and stop the pool (if the manager owns it)."""
+        with self._lock:
+            for job in list(self._queue):
+                job.status, job.finished = "cancelled", time.time()
+                self._report(job)
+                self._retire(job)
+            self._queue.clear()
+        if self._own_executor:
+            self._executor.shutdown(wait=wait)
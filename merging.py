@@ -0,0 +1,307 @@
+"""Merging of similar colour clusters (``autoMerge``).
+
+After k-means, clusters whose mean LAB colours are closer than a threshold
+are merged.  Instead of comparing every pair of clusters after every merge,
+the candidate pairs are kept in a priority queue keyed on LAB distance:
+
+* With ``adjacent_only`` the candidates are the edges of the region adjacency
+  graph, extracted from the label map with one vectorised pass over
+  horizontally and vertically neighbouring pixels.  Only regions that touch
+  can merge.
+* Otherwise every pair of clusters is a candidate.
+
+The closest pair is merged (union-find), its pixel-weighted mean colour
+recomputed, and the distances from the merged region to its neighbours pushed
+back onto the queue; entries that refer to an already merged region are
+skipped when popped.  This is O(E log E) for E candidate pairs.
+
+Merging always takes the globally closest pair, so the merges performed for a
+threshold are exactly the leading merges of the full history, up to the first
+one whose distance exceeds it.  :func:`merge_regions` records that history,
+and :class:`MergeTree` keeps the complete history (the dendrogram over the
+clusters) so that any threshold or target layer count is answered by replaying
+a prefix of it, without touching the image.
+"""
+
+import heapq
+import os
+import tempfile
+from dataclasses import dataclass
+
+import numpy as np
+
+# File name of a saved MergeTree inside an upload's directory.
+MERGE_TREE_FILE = "merge_tree.npz"
+
+
+def adjacency_edges(labels):
+    """Region adjacency graph of a label map.
+
+    Args:
+        labels: ``(H, W)`` integer labels; negative labels (transparent
+            pixels) separate regions rather than connecting them.
+
+    Returns:
+        ``(a, b, length)`` arrays with ``a < b`` for every pair of regions that
+        share at least one 4-connected pixel boundary, and the number of
+        boundary pixel pairs between them.
+    """
+    labels = np.asarray(labels)
+    a = np.concatenate([labels[:, :-1].ravel(), labels[:-1].ravel()])
+    b = np.concatenate([labels[:, 1:].ravel(), labels[1:].ravel()])
+    keep = (a != b) & (a >= 0) & (b >= 0)
+    a, b = a[keep].astype(np.int64), b[keep].astype(np.int64)
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+    n = int(hi.max()) + 1 if hi.size else 1
+    keys, length = np.unique(lo * n + hi, return_counts=True)
+    return keys // n, keys % n, length
+
+
+class DisjointSet:
+    """Union-find over ``n`` elements with path halving."""
+
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, root, other):
+        """Attach the root ``other`` under the root ``root``."""
+        self.parent[other] = root
+
+    def roots(self):
+        """Root of every element."""
+        return np.array([self.find(i) for i in range(len(self.parent))])
+
+
+@dataclass
+class MergeResult:
+    """Outcome of merging ``n`` regions.
+
+    Attributes:
+        mapping: ``(n,)`` int32 merged label of every input region, numbered
+            ``0..m-1`` in the order of the regions that represent them; -1
+            for empty regions.
+        colors: ``(m, 3)`` pixel-weighted mean LAB colour of each merged label.
+        pixel_count: ``(m,)`` pixels of each merged label.
+        merges: ``(a, b, distance)`` of every merge performed, in order; ``a``
+            and ``b`` are the input region ids that represented the two sides
+            and ``a`` represents the result afterwards.
+    """
+
+    mapping: np.ndarray
+    colors: np.ndarray
+    pixel_count: np.ndarray
+    merges: list
+
+    def __len__(self):
+        return len(self.pixel_count)
+
+    def apply(self, labels):
+        """Relabel a region label map, keeping negative labels at -1."""
+        lut = np.append(self.mapping, np.int32(-1))
+        labels = np.asarray(labels)
+        return lut[np.where(labels < 0, -1, labels)]
+
+
+def merge_regions(colors, pixel_count, threshold=np.inf, edges=None, max_merges=None):
+    """Greedily merge the closest pair of regions while it is within ``threshold``.
+
+    Args:
+        colors: ``(n, 3)`` mean LAB colour of each region.
+        pixel_count: ``(n,)`` pixels of each region; regions without pixels
+            take no part in merging.
+        threshold: largest LAB distance at which two regions are merged; the
+            default merges until no candidate pairs remain.
+        edges: optional ``(a, b)`` candidate pairs (e.g. from
+            :func:`adjacency_edges`); every pair of regions otherwise.
+        max_merges: optional limit on the number of merges.
+
+    Returns:
+        :class:`MergeResult`.
+    """
+    colors = np.array(colors, dtype=np.float64)
+    mass = np.asarray(pixel_count, dtype=np.float64).copy()
+    n = len(mass)
+    present = mass > 0
+    if edges is None:
+        alive = np.flatnonzero(present)
+        neighbours = {int(i): set(alive.tolist()) - {int(i)} for i in alive}
+    else:
+        neighbours = {int(i): set() for i in np.flatnonzero(present)}
+        for a, b in zip(*(np.asarray(e).tolist() for e in edges[:2])):
+            if a != b and a in neighbours and b in neighbours:
+                neighbours[a].add(b)
+                neighbours[b].add(a)
+
+    heap = [(float(np.linalg.norm(colors[a] - colors[b])), a, b, 0, 0)
+            for a, nbs in neighbours.items() for b in nbs if a < b]
+    heapq.heapify(heap)
+    version = np.zeros(n, dtype=np.int64)
+    sets = DisjointSet(n)
+    merges = []
+    limit = n if max_merges is None else max_merges
+    while heap and len(merges) < limit:
+        dist, a, b, va, vb = heapq.heappop(heap)
+        if va != version[a] or vb != version[b] or a not in neighbours or b not in neighbours:
+            continue
+        if dist > threshold:
+            break
+        # The larger region keeps its id so fewer labels change.
+        if mass[b] > mass[a]:
+            a, b = b, a
+        total = mass[a] + mass[b]
+        colors[a] = (mass[a] * colors[a] + mass[b] * colors[b]) / total
+        mass[a], mass[b] = total, 0.0
+        sets.union(a, b)
+        merges.append((a, b, dist))
+        version[a] += 1
+
+        joined = (neighbours.pop(b) | neighbours[a]) - {a, b}
+        neighbours[a] = joined
+        for c in joined:
+            neighbours[c].discard(b)
+            neighbours[c].add(a)
+            lo, hi = min(a, c), max(a, c)
+            heapq.heappush(heap, (float(np.linalg.norm(colors[a] - colors[c])),
+                                  lo, hi, version[lo], version[hi]))
+
+    mapping, order = _sequential(sets.roots(), present)
+    return MergeResult(mapping, colors[order], mass[order], merges)
+
+
+def _sequential(roots, present):
+    # Number the surviving roots 0..m-1; empty regions map to -1.
+    n = len(roots)
+    order = np.flatnonzero(present & (roots == np.arange(n)))
+    new_id = np.full(n, -1, dtype=np.int32)
+    new_id[order] = np.arange(len(order), dtype=np.int32)
+    return np.where(present, new_id[roots], -1).astype(np.int32), order
+
+
+def auto_merge(labels, colors, pixel_count, threshold, adjacent_only=False):
+    """Merge clusters of a label map whose colours are within ``threshold``.
+
+    Args:
+        labels: ``(H, W)`` cluster labels; -1 for transparent pixels.
+        colors, pixel_count: per-cluster mean LAB colour and pixel count, e.g.
+            ``superpixels.superpixel_features(lab, labels)``.
+        threshold: LAB distance below which clusters are merged.
+        adjacent_only: only merge clusters that touch in the image.
+
+    Returns:
+        ``(merged_labels, result)``: the relabelled map and the
+        :class:`MergeResult`.
+    """
+    edges = adjacency_edges(labels)[:2] if adjacent_only else None
+    result = merge_regions(colors, pixel_count, threshold, edges)
+    return result.apply(labels), result
+
+
+class MergeTree:
+    """Complete merge history of a clustering, cut on demand.
+
+    Args:
+        colors: ``(n, 3)`` mean LAB colour of each region.
+        pixel_count: ``(n,)`` pixels of each region.
+        a, b, distance: the merges of the full history, as recorded in
+            :attr:`MergeResult.merges`.
+    """
+
+    def __init__(self, colors, pixel_count, a, b, distance):
+        self.colors = np.asarray(colors, dtype=np.float64)
+        self.pixel_count = np.asarray(pixel_count, dtype=np.float64)
+        self.a = np.asarray(a, dtype=np.int32)
+        self.b = np.asarray(b, dtype=np.int32)
+        self.distance = np.asarray(distance, dtype=np.float64)
+
+    @classmethod
+    def build(cls, colors, pixel_count, edges=None):
+        """Merge everything with :func:`merge_regions` and keep the history."""
+        result = merge_regions(colors, pixel_count, edges=edges)
+        a, b, distance = (np.array(column) for column in zip(*result.merges)) \
+            if result.merges else (np.empty(0),) * 3
+        return cls(colors, pixel_count, a, b, distance)
+
+    @property
+    def n_regions(self):
+        """Number of non-empty input regions."""
+        return int(np.count_nonzero(self.pixel_count > 0))
+
+    @property
+    def min_layers(self):
+        """Fewest layers reachable (more than one if regions never touch)."""
+        return self.n_regions - len(self.distance)
+
+    def merges_for_threshold(self, threshold):
+        """Number of merges :func:`merge_regions` performs at ``threshold``."""
+        above = np.flatnonzero(self.distance > threshold)
+        return int(above[0]) if above.size else len(self.distance)
+
+    def cut(self, threshold=None, n_layers=None):
+        """Merge state after a threshold or for a target number of layers.
+
+        Exactly one of ``threshold`` (LAB distance, as for
+        :func:`merge_regions`) or ``n_layers`` must be given; ``n_layers`` is
+        clipped to ``[min_layers, n_regions]``.
+
+        Returns:
+            :class:`MergeResult`, identical to merging with that threshold.
+        """
+        if (threshold is None) == (n_layers is None):
+            raise ValueError("give exactly one of threshold or n_layers")
+        if threshold is not None:
+            m = self.merges_for_threshold(threshold)
+        else:
+            m = self.n_regions - min(max(int(n_layers), self.min_layers), self.n_regions)
+        # Replaying the merges backwards resolves every region to its final
+        # root in one pass: when b joins a, the root of a is already known.
+        roots = np.arange(len(self.pixel_count))
+        for i in range(m - 1, -1, -1):
+            roots[self.b[i]] = roots[self.a[i]]
+        present = self.pixel_count > 0
+        mapping, order = _sequential(roots, present)
+        mass = np.bincount(mapping[present], weights=self.pixel_count[present],
+                           minlength=len(order))
+        colors = np.stack([np.bincount(mapping[present],
+                                       weights=self.pixel_count[present] * self.colors[present, c],
+                                       minlength=len(order))
+                           for c in range(self.colors.shape[1])], axis=1) / mass[:, None]
+        merges = list(zip(self.a[:m].tolist(), self.b[:m].tolist(), self.distance[:m].tolist()))
+        return MergeResult(mapping, colors, mass, merges)
+
+    def save(self, path):
+        """Write the tree to ``path`` (``.npz``) atomically.
+
+        The server keeps it next to the upload as :data:`MERGE_TREE_FILE`, so
+        layer-count slider changes are answered by :meth:`cut` alone.
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".npz.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, colors=self.colors, pixel_count=self.pixel_count,
+                         a=self.a, b=self.b, distance=self.distance)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["colors"], data["pixel_count"], data["a"], data["b"],
+                       data["distance"])
+
+
+def merge_tree(labels, colors, pixel_count, adjacent_only=False):
+    """:class:`MergeTree` for the clusters of a label map (see :func:`auto_merge`)."""
+    edges = adjacency_edges(labels)[:2] if adjacent_only else None
+    return MergeTree.build(colors, pixel_count, edges)
@@ -0,0 +1,282 @@
+"""Out-of-core processing of very large images.
+
+The in-memory pipeline holds several full-resolution arrays at once, which is
+fine for 1024 px icons but not for 4096 px and larger artwork.  Here the LAB
+image, the superpixel label map, the SLIC distance buffer, the cluster label
+map and every layer live in ``np.memmap`` files in a :class:`Scratch`
+directory, and each stage walks over horizontal bands of ``band_rows`` rows.
+Resident memory is then bounded by the band size (plus whatever pages the OS
+chooses to cache) instead of by the image size.
+
+SLIC runs band by band with the same ``row_offset`` band routines that
+:mod:`slic_tiled` uses, so its superpixels match :func:`slic.slic` with
+``enforce=False``.  Connectivity enforcement needs the whole pixel graph in
+memory and is not applied in this mode.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import clustering
+import colorspace
+import merging
+import slic
+from layers import Layer, iter_layers
+from pipeline import ProcessingParams, ProcessingResult
+from slic_tiled import centers_for_strip
+from superpixels import SuperpixelFeatures
+
+DEFAULT_BAND_ROWS = 256
+
+
+class Scratch:
+    """Directory of memory-mapped scratch arrays, removed on :meth:`close`.
+
+    Args:
+        directory: parent directory for the scratch files; the system
+            temporary directory by default.
+
+    Arrays returned by :meth:`array` (and results built from them) are only
+    valid until the scratch space is closed.  Use it as a context manager.
+    """
+
+    def __init__(self, directory=None):
+        self.path = tempfile.mkdtemp(prefix="icon-decomposer-", dir=directory)
+
+    def array(self, name, shape, dtype=np.float32):
+        """A new zero-filled ``np.memmap`` of ``shape``/``dtype``."""
+        return np.memmap(os.path.join(self.path, name + ".dat"), mode="w+",
+                         dtype=dtype, shape=tuple(shape))
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def bands(height, band_rows):
+    """``(start, stop)`` row ranges of at most ``band_rows`` rows."""
+    return [(r0, min(r0 + band_rows, height)) for r0 in range(0, height, band_rows)]
+
+
+def lab_bands(rgba, out, backend="lut", lightness_weight=1.0, green_axis_scale=1.0,
+              band_rows=DEFAULT_BAND_ROWS):
+    """Convert ``rgba`` to weighted LAB into the ``(H, W, 3)`` array ``out``."""
+    for r0, r1 in bands(rgba.shape[0], band_rows):
+        lab = colorspace.srgb_to_lab(rgba[r0:r1], backend=backend)
+        out[r0:r1] = colorspace.apply_lab_weights(lab, lightness_weight, green_axis_scale)
+    return out
+
+
+def slic_bands(lab, labels, distances, n_segments=100, compactness=10.0, max_iter=10,
+               band_rows=DEFAULT_BAND_ROWS, callback=None):
+    """Banded SLIC over a (memory-mapped) LAB image.
+
+    Args:
+        lab: ``(H, W, 3)`` LAB image.
+        labels: ``(H * W,)`` int32 output label buffer.
+        distances: ``(H * W,)`` float32 distance buffer.
+        band_rows: rows assigned at a time.
+        callback: optional ``callback(iteration, seconds)``.
+
+    Returns:
+        ``labels``, holding sequential superpixel labels.
+    """
+    h, w = lab.shape[:2]
+    centers, step = slic.initial_centers(lab, n_segments)
+    for i in range(max_iter):
+        start = time.perf_counter()
+        sums = np.zeros((len(centers), 5))
+        counts = np.zeros(len(centers))
+        changed = False
+        for r0, r1 in bands(h, band_rows):
+            index = centers_for_strip(centers, step, r0, r1)
+            band = np.asarray(lab[r0:r1])
+            local, _ = slic.assign_labels(band, centers[index], step, compactness,
+                                          distances=distances[r0 * w:r1 * w], row_offset=r0)
+            part_sums, part_counts = slic.center_sums(band, local, len(index), row_offset=r0)
+            sums[index] += part_sums
+            counts[index] += part_counts
+            global_labels = np.where(local >= 0, index[np.maximum(local, 0)], -1)
+            out = labels[r0 * w:r1 * w]
+            changed |= not np.array_equal(out, global_labels)
+            out[:] = global_labels
+        centers = slic.centers_from_sums(sums, counts, centers)
+        if callback is not None:
+            callback(i, time.perf_counter() - start)
+        if not changed:
+            break
+    slic.assign_leftovers(lab, labels, centers, step, compactness)
+    return relabel_bands(labels, len(centers), band_rows * w)
+
+
+def relabel_bands(labels, n_labels, chunk):
+    """Renumber the labels of a flat label buffer to ``0..m-1`` in place.
+
+    Labels are numbered in order of first appearance, as by
+    :func:`slic.relabel_sequential`; negative labels are left alone.
+    """
+    first = np.full(n_labels, labels.size, dtype=np.int64)
+    for start in range(0, labels.size, chunk):
+        part = np.asarray(labels[start:start + chunk])
+        keep = np.flatnonzero(part >= 0)
+        seen, position = np.unique(part[keep], return_index=True)
+        np.minimum.at(first, seen, keep[position] + start)
+    used = np.flatnonzero(first < labels.size)
+    lut = np.full(n_labels, -1, dtype=np.int32)
+    lut[used[np.argsort(first[used], kind="stable")]] = np.arange(len(used), dtype=np.int32)
+    for start in range(0, labels.size, chunk):
+        part = labels[start:start + chunk]
+        part[:] = np.where(part >= 0, lut[np.maximum(part, 0)], part)
+    return labels
+
+
+def features_bands(lab, labels, n_labels, band_rows=DEFAULT_BAND_ROWS):
+    """:class:`superpixels.SuperpixelFeatures` accumulated band by band.
+
+    ``labels`` is ``(H, W)``; negative labels are ignored.
+    """
+    h, w = labels.shape
+    counts = np.zeros(n_labels)
+    sums = np.zeros((n_labels, 5))
+    for r0, r1 in bands(h, band_rows):
+        band_labels = np.asarray(labels[r0:r1]).ravel()
+        band_sums, band_counts = slic.center_sums(np.asarray(lab[r0:r1]), band_labels,
+                                                  n_labels, row_offset=r0)
+        sums += band_sums
+        counts += band_counts
+    safe = np.maximum(counts, 1)[:, None]
+    return SuperpixelFeatures(sums[:, :3] / safe, counts.astype(np.int64), sums[:, 3:] / safe)
+
+
+def adjacency_bands(labels, band_rows=DEFAULT_BAND_ROWS):
+    """``(a, b)`` region adjacency edges of an ``(H, W)`` label map, by bands.
+
+    Bands overlap by one row so pairs across band seams are seen.
+    """
+    pairs = []
+    h = labels.shape[0]
+    for r0, r1 in bands(h, band_rows):
+        a, b, _ = merging.adjacency_edges(np.asarray(labels[r0:min(r1 + 1, h)]))
+        pairs.append(np.stack([a, b], axis=1))
+    edges = np.unique(np.concatenate(pairs), axis=0) if pairs else np.empty((0, 2), int)
+    return edges[:, 0], edges[:, 1]
+
+
+def layers_bands(rgba, labels, n_layers, scratch, band_rows=DEFAULT_BAND_ROWS):
+    """Cropped layers written band by band into memory-mapped buffers.
+
+    Returns:
+        list of :class:`layers.Layer` whose ``rgba`` arrays are memmaps in
+        ``scratch``.
+    """
+    h, w = labels.shape
+    y0 = np.full(n_layers, h)
+    x0 = np.full(n_layers, w)
+    y1 = np.zeros(n_layers, dtype=np.int64)
+    x1 = np.zeros(n_layers, dtype=np.int64)
+    counts = np.zeros(n_layers, dtype=np.int64)
+    for r0, r1 in bands(h, band_rows):
+        band = np.asarray(labels[r0:r1]).ravel()
+        index = np.flatnonzero(band >= 0)
+        lbl = band[index]
+        ys, xs = np.divmod(index, w)
+        np.minimum.at(y0, lbl, ys + r0)
+        np.maximum.at(y1, lbl, ys + r0 + 1)
+        np.minimum.at(x0, lbl, xs)
+        np.maximum.at(x1, lbl, xs + 1)
+        counts += np.bincount(lbl, minlength=n_layers)
+
+    out = {}
+    for label in np.flatnonzero(counts):
+        out[label] = scratch.array(f"layer_{label}", (y1[label] - y0[label],
+                                                      x1[label] - x0[label], 4), np.uint8)
+    for r0, r1 in bands(h, band_rows):
+        for part in iter_layers(rgba[r0:r1], labels[r0:r1], n_layers=n_layers):
+            # Bands never share rows, so each band's crop can be copied whole.
+            py, px = r0 + part.y - y0[part.label], part.x - x0[part.label]
+            ph, pw = part.rgba.shape[:2]
+            out[part.label][py:py + ph, px:px + pw] = part.rgba
+    return [Layer(int(label), out[label], int(y0[label]), int(x0[label]),
+                  int(counts[label]), (h, w)) for label in sorted(out)]
+
+
+def process_out_of_core(rgba, scratch, params=None, band_rows=DEFAULT_BAND_ROWS):
+    """Decompose a large image with memory-mapped intermediates.
+
+    Args:
+        rgba: ``(H, W, 4)`` uint8 image; may itself be a memmap.
+        scratch: an open :class:`Scratch`; the returned arrays live in it.
+        params: :class:`pipeline.ProcessingParams` (``slic_mode`` is ignored).
+        band_rows: rows processed at a time; bounds resident memory.
+
+    Returns:
+        :class:`pipeline.ProcessingResult` whose label maps and layers are
+        memmaps in ``scratch``.
+    """
+    params = params or ProcessingParams()
+    h, w = rgba.shape[:2]
+    timings = {}
+    start = time.perf_counter()
+
+    lab = lab_bands(rgba, scratch.array("lab", (h, w, 3)), params.lab_backend,
+                    params.lightness_weight, params.green_axis_scale, band_rows)
+    now = time.perf_counter()
+    timings["lab"], start = now - start, now
+
+    sp_flat = scratch.array("superpixels", (h * w,), np.int32)
+    slic_bands(lab, sp_flat, scratch.array("distances", (h * w,)), params.n_segments,
+               params.compactness, params.slic_iterations, band_rows)
+    sp_labels = sp_flat.reshape(h, w)
+    if rgba.shape[2] == 4:
+        for r0, r1 in bands(h, band_rows):
+            band = sp_labels[r0:r1]
+            band[rgba[r0:r1, :, 3] <= params.alpha_threshold] = -1
+    now = time.perf_counter()
+    timings["superpixels"], start = now - start, now
+
+    n_superpixels = 0
+    for r0, r1 in bands(h, band_rows):
+        n_superpixels = max(n_superpixels, int(np.asarray(sp_labels[r0:r1]).max()) + 1)
+    features = features_bands(lab, sp_labels, n_superpixels, band_rows)
+    now = time.perf_counter()
+    timings["features"], start = now - start, now
+    if n_superpixels == 0:
+        # Fully transparent: every label map stays -1 and there are no layers.
+        labels = scratch.array("labels", (h, w), np.int32)
+        labels[:] = -1
+        return ProcessingResult([], labels, sp_labels, None, None, params, timings)
+
+    clusters = clustering.cluster_superpixels(
+        features, params.n_clusters, spatial_weight=params.spatial_weight,
+        seed=params.seed, k_range=params.k_range)
+    labels = scratch.array("labels", (h, w), np.int32)
+    for r0, r1 in bands(h, band_rows):
+        labels[r0:r1] = clusters.pixel_labels(sp_labels[r0:r1])
+    n_layers = clusters.k
+    now = time.perf_counter()
+    timings["clusters"], start = now - start, now
+
+    merge = None
+    if params.merge_threshold is not None:
+        stats = features_bands(lab, labels, clusters.k, band_rows)
+        edges = adjacency_bands(labels, band_rows) if params.adjacent_only else None
+        merge = merging.merge_regions(stats.mean_lab, stats.pixel_count,
+                                      params.merge_threshold, edges)
+        for r0, r1 in bands(h, band_rows):
+            labels[r0:r1] = merge.apply(labels[r0:r1])
+        n_layers = len(merge)
+        now = time.perf_counter()
+        timings["merge"], start = now - start, now
+
+    layers = layers_bands(rgba, labels, n_layers, scratch, band_rows)
+    timings["layers"] = time.perf_counter() - start
+    return ProcessingResult(layers, labels, sp_labels, clusters, merge, params, timings)
@@ -0,0 +1,387 @@
+"""End-to-end icon decomposition built from the stage modules.
+
+:func:`process` runs one icon through the stages:
+
+1. visible-pixel index from alpha (:mod:`sparse`),
+2. sRGB -> LAB with the pipeline's weighting (:mod:`colorspace`),
+3. SLIC superpixels (:mod:`slic`), sparse when the icon has transparency,
+4. superpixel features and weighted k-means (:mod:`superpixels`,
+   :mod:`clustering`),
+5. optional merging of similar clusters (:mod:`merging`),
+6. cropped layer extraction (:mod:`layers`).
+
+:func:`process_stages` is the same pipeline as a generator that yields each
+intermediate (LAB values, superpixels, features, clusters, merged clusters,
+then every layer) as soon as it is ready, so a server can stream early
+results and callers can stop after the stage they need;
+:func:`aprocess_stages` is its async-iterator form.
+
+:func:`process_many` spreads a batch of icons over a process pool.  Each
+worker process keeps its memory-mapped LAB table and its
+:class:`workspace.Workspace` buffers between icons, and results are yielded as
+they complete.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+from PIL import Image
+
+import clustering
+import colorspace
+import merging
+import slic
+from layers import iter_layers
+from sparse import PixelIndex
+from superpixels import superpixel_features
+from workspace import Workspace, default_workspace
+
+# Icons whose visible pixels cover more than this fraction of the canvas are
+# segmented densely; the sparse path only pays off with real transparency.
+SPARSE_MAX_COVERAGE = 0.9
+
+
+@dataclass(frozen=True)
+class ProcessingParams:
+    """Parameters of one decomposition.
+
+    Attributes:
+        n_segments, compactness, slic_iterations: SLIC settings.
+        slic_mode: :data:`slic.MODES` entry for dense segmentation.
+        n_clusters: number of colour clusters, or ``"auto"`` to select it
+            from ``k_range`` with :func:`clustering.select_k`.
+        k_range: ``(k_min, k_max)`` for ``n_clusters="auto"``.
+        spatial_weight: weight of superpixel position in clustering.
+        merge_threshold: LAB distance below which clusters are merged; None
+            disables merging.
+        adjacent_only: only merge clusters that touch.
+        lab_backend: :data:`colorspace.BACKENDS` entry.
+        lightness_weight, green_axis_scale: see :func:`colorspace.apply_lab_weights`.
+        alpha_threshold: pixels with alpha at or below this are transparent.
+        seed: k-means seed.
+    """
+
+    n_segments: int = 1000
+    compactness: float = 10.0
+    slic_iterations: int = 10
+    slic_mode: str = "dense"
+    n_clusters: object = 8
+    k_range: tuple = (2, 12)
+    spatial_weight: float = 0.0
+    merge_threshold: float = None
+    adjacent_only: bool = False
+    lab_backend: str = "lut"
+    lightness_weight: float = 1.0
+    green_axis_scale: float = 1.0
+    alpha_threshold: int = 0
+    seed: int = 0
+
+    def to_dict(self):
+        params = asdict(self)
+        params["k_range"] = list(self.k_range)
+        return params
+
+
+@dataclass
+class ProcessingResult:
+    """Output of :func:`process`.
+
+    Attributes:
+        layers: list of :class:`layers.Layer`, one per final cluster.
+        labels: ``(H, W)`` int32 final cluster of every pixel; -1 where
+            transparent.
+        superpixel_labels: ``(H, W)`` int32 superpixel labels; -1 where
+            transparent.
+        clusters: the :class:`clustering.SuperpixelClusters`, or None when
+            no pixel is visible (there are then no layers either).
+        merge: the :class:`merging.MergeResult`, or None without merging.
+        params: the :class:`ProcessingParams` used.
+        timings: seconds spent per stage.
+    """
+
+    layers: list
+    labels: np.ndarray
+    superpixel_labels: np.ndarray
+    clusters: clustering.SuperpixelClusters
+    merge: merging.MergeResult
+    params: ProcessingParams
+    timings: dict = field(default_factory=dict)
+
+
+def load_image(image):
+    """``(H, W, 4)`` uint8 RGBA from an array or an image file path."""
+    if isinstance(image, (str, os.PathLike)):
+        with Image.open(image) as im:
+            return np.asarray(im.convert("RGBA"))
+    image = np.asarray(image)
+    if image.ndim == 3 and image.shape[2] == 3:
+        alpha = np.full(image.shape[:2] + (1,), 255, dtype=image.dtype)
+        image = np.concatenate([image, alpha], axis=2)
+    return image
+
+
+@dataclass
+class Stage:
+    """One intermediate result of :func:`process_stages`.
+
+    Attributes:
+        name: one of :data:`STAGES`.
+        value: the stage's output (see :func:`process_stages`).
+        seconds: time spent producing it.
+    """
+
+    name: str
+    value: object
+    seconds: float
+
+
+STAGES = ("lab", "superpixels", "features", "clusters", "merge", "layer", "result")
+
+
+def process_stages(image, params=None, workspace=None, memo=None, key=None, callback=None):
+    """Decompose one icon, yielding every intermediate as soon as it is ready.
+
+    Yields :class:`Stage` objects in this order:
+
+    ``"lab"``
+        ``(N, 3)`` weighted LAB values of the visible pixels, in
+        :class:`sparse.PixelIndex` order.
+    ``"superpixels"``
+        ``(H, W)`` int32 superpixel labels; -1 where transparent.
+    ``"features"``
+        :class:`superpixels.SuperpixelFeatures`.
+    ``"clusters"``
+        :class:`clustering.SuperpixelClusters`; this and the later stages up
+        to ``"result"`` are skipped when no pixel is visible.
+    ``"merge"``
+        :class:`merging.MergeResult`; only when ``params.merge_threshold`` is set.
+    ``"layer"``
+        one :class:`layers.Layer` per stage, in label order.
+    ``"result"``
+        the :class:`ProcessingResult`, as :func:`process` returns it.
+
+    Closing the generator stops the work after the current stage, so callers
+    that only need e.g. the superpixels pay for nothing more.
+
+    With a ``memo`` (:class:`cache.MemoryLRU`) and the upload's ``key``, the
+    decoded image, its LAB conversion and its superpixel labels are looked up
+    there first, keyed by the parameters each depends on, so a parameter
+    change only recomputes the stages it affects.  Memoised arrays are
+    read-only.
+
+    ``callback(iteration, seconds)`` is passed on to SLIC and called after
+    each superpixel iteration (not when the superpixels come from ``memo``).
+    """
+    params = params or ProcessingParams()
+    workspace = workspace or default_workspace()
+    timings = {}
+    start = time.perf_counter()
+
+    if isinstance(image, (str, os.PathLike)):
+        rgba = _memo(memo, (key, "rgba"), lambda: load_image(image))
+    else:
+        rgba = load_image(image)
+    lab_key = (key, "lab", params.lab_backend, params.lightness_weight,
+               params.green_axis_scale, params.alpha_threshold)
+    index, lab, sparse = _memo(memo, lab_key, lambda: _lab_stage(rgba, params))
+    values = lab if sparse else index.gather(lab)
+    yield _stage(timings, "lab", values, start)
+    start = time.perf_counter()
+
+    sp_key = lab_key + ("superpixels", params.n_segments, params.compactness,
+                        params.slic_iterations, params.slic_mode)
+    sp_labels = _memo(memo, sp_key, lambda: _superpixel_stage(index, lab, sparse, params,
+                                                               workspace, callback))
+    yield _stage(timings, "superpixels", index.scatter(sp_labels, fill=-1), start)
+    start = time.perf_counter()
+
+    features = superpixel_features(values, sp_labels, index)
+    yield _stage(timings, "features", features, start)
+    start = time.perf_counter()
+
+    if index.size == 0:
+        # A fully transparent icon has nothing to cluster and no layers.
+        empty = index.scatter(sp_labels, fill=-1)
+        yield Stage("result", ProcessingResult([], empty, empty.copy(), None, None, params,
+                                               timings), 0.0)
+        return
+
+    clusters = clustering.cluster_superpixels(
+        features, params.n_clusters, spatial_weight=params.spatial_weight,
+        seed=params.seed, k_range=params.k_range)
+    labels = clusters.pixel_labels(sp_labels)
+    yield _stage(timings, "clusters", clusters, start)
+    start = time.perf_counter()
+
+    merge = None
+    if params.merge_threshold is not None:
+        stats = superpixel_features(values, labels, index)
+        merged, merge = merging.auto_merge(index.scatter(labels, fill=-1), stats.mean_lab,
+                                           stats.pixel_count, params.merge_threshold,
+                                           params.adjacent_only)
+        labels = index.gather(merged)
+        yield _stage(timings, "merge", merge, start)
+        start = time.perf_counter()
+
+    layers = []
+    timings["layers"] = 0.0
+    for layer in iter_layers(rgba, labels, index):
+        seconds = time.perf_counter() - start
+        timings["layers"] += seconds
+        layers.append(layer)
+        yield Stage("layer", layer, seconds)
+        start = time.perf_counter()
+
+    result = ProcessingResult(layers, index.scatter(labels, fill=-1),
+                              index.scatter(sp_labels, fill=-1), clusters, merge,
+                              params, timings)
+    yield Stage("result", result, 0.0)
+
+
+def process(image, params=None, workspace=None, memo=None, key=None):
+    """Decompose one icon into colour layers.
+
+    Args:
+        image: RGBA/RGB array or image file path.
+        params: :class:`ProcessingParams`; defaults apply when omitted.
+        workspace: scratch buffer pool; the calling thread's by default.
+        memo, key: optional intermediate cache and upload key; see
+            :func:`process_stages`.
+
+    Returns:
+        :class:`ProcessingResult`.
+    """
+    for stage in process_stages(image, params, workspace, memo, key):
+        if stage.name == "result":
+            return stage.value
+
+
+async def aprocess_stages(image, params=None):
+    """Async iterator over :func:`process_stages`.
+
+    Each stage is computed in a worker thread so the event loop stays
+    responsive; breaking out of the loop stops the remaining stages.  The
+    stages of one stream may run on different threads, so every stream has
+    its own :class:`workspace.Workspace` rather than a thread's default one.
+    """
+    stages = process_stages(image, params, Workspace())
+    done = object()
+    pending = None
+    try:
+        while True:
+            # Shielded so that cancelling the consumer does not abandon a
+            # stage that is still running in its thread.
+            pending = asyncio.ensure_future(asyncio.to_thread(next, stages, done))
+            stage = await asyncio.shield(pending)
+            if stage is done:
+                return
+            yield stage
+    finally:
+        if pending is not None and not pending.done():
+            # The generator is executing; close it once the stage returns.
+            pending.add_done_callback(lambda f: (f.cancelled() or f.exception(),
+                                                 stages.close()))
+        else:
+            stages.close()
+
+
+def _lab_stage(rgba, params):
+    index = PixelIndex.from_alpha(rgba, params.alpha_threshold)
+    sparse = index.coverage <= SPARSE_MAX_COVERAGE
+    pixels = index.gather(rgba) if sparse else rgba
+    lab = colorspace.srgb_to_lab(pixels, backend=params.lab_backend)
+    colorspace.apply_lab_weights(lab, params.lightness_weight, params.green_axis_scale)
+    return index, lab, sparse
+
+
+def _superpixel_stage(index, lab, sparse, params, workspace, callback=None):
+    if sparse:
+        canvas = slic.slic_sparse(lab, index, n_segments=params.n_segments,
+                                  compactness=params.compactness,
+                                  max_iter=params.slic_iterations, callback=callback,
+                                  workspace=workspace)
+    else:
+        canvas = slic.slic(lab, n_segments=params.n_segments, compactness=params.compactness,
+                           max_iter=params.slic_iterations, callback=callback,
+                           mode=params.slic_mode, workspace=workspace)
+    return index.gather(canvas)
+
+
+def _memo(memo, key, compute):
+    # Without a memo or an upload key every stage is computed afresh.
+    if memo is None or key[0] is None:
+        return compute()
+    value = memo.get(key)
+    if value is None:
+        value = compute()
+        for array in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+        memo.put(key, value)
+    return value
+
+
+def _stage(timings, name, value, start):
+    timings[name] = time.perf_counter() - start
+    return Stage(name, value, timings[name])
+
+
+def _init_worker(backends):
+    # Map the LAB table and create the workspace before the first task so
+    # no icon pays for them.
+    if "lut" in backends:
+        colorspace.lab_table()
+    default_workspace()
+
+
+def _process_task(image, params):
+    return process(image, params)
+
+
+def process_many(images, params=None, workers=None, executor=None):
+    """Process a batch of icons in parallel, yielding results as they finish.
+
+    Args:
+        images: sequence of RGBA arrays or image file paths (paths are read
+            in the workers, which avoids pickling pixel data).
+        params: one :class:`ProcessingParams` for every image, or a sequence
+            with one per image.
+        workers: pool size when ``executor`` is omitted; defaults to the
+            number of CPUs.
+        executor: an existing ``ProcessPoolExecutor`` to reuse; worker state
+            (LAB table, workspace) then warms up on each worker's first task.
+
+    Yields:
+        ``(position, ProcessingResult)`` in completion order, where
+        ``position`` indexes ``images``.  A failed image raises its exception
+        from the generator; closing the generator cancels pending work.
+    """
+    images = list(images)
+    if params is None or isinstance(params, ProcessingParams):
+        params = [params or ProcessingParams()] * len(images)
+    params = list(params)
+    if len(params) != len(images):
+        raise ValueError(f"got {len(params)} parameter sets for {len(images)} images")
+
+    own_executor = executor is None
+    if own_executor:
+        backends = {p.lab_backend for p in params}
+        executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                       initializer=_init_worker, initargs=(backends,))
+    futures = {executor.submit(_process_task, image, p): i
+               for i, (image, p) in enumerate(zip(images, params))}
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield futures[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,263 @@
+"""Live progress of processing jobs as server-sent events.
+
+A job run by :func:`process_with_progress` reports every pipeline stage
+(decode, LAB, each SLIC iteration, superpixels, clustering, merging, each
+extracted layer) through an ``emit(event, data)`` callable as soon as it
+completes, with its timing and, where there is something to look at, a small
+PNG preview as a ``data:`` URL: the icon in its cluster colours after
+clustering and merging, and a thumbnail of every layer.  The frontend can
+draw those while the remaining layers are being extracted.
+
+Jobs run in worker processes, so :class:`Emitter` puts the events on a queue
+(``multiprocessing.Manager().Queue()`` across processes) and
+:meth:`ProgressBroker.relay` moves them into the server's
+:class:`ProgressBroker`, which keeps a bounded history per job and serves it
+to any number of subscribers.  An SSE handler answers with
+:data:`SSE_HEADERS` and streams::
+
+    broker.stream(job_id, last_event_id=request.headers.get("Last-Event-ID"))
+
+Event ids increase per job, so a reconnecting ``EventSource`` resumes after
+the last event it saw.  The stream ends after one of :data:`FINAL_EVENTS`,
+which :class:`jobs.JobManager` publishes when the job finishes.
+"""
+
+import base64
+import io
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+from PIL import Image
+
+import pipeline
+from layers import layer_metadata
+
+PREVIEW_SIZE = 128
+THUMBNAIL_SIZE = 64
+
+FINAL_EVENTS = ("done", "failed", "cancelled")
+
+SSE_HEADERS = {
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-cache",
+    # Stop nginx from buffering the stream.
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_sse(data, event=None, event_id=None):
+    """One SSE message; ``data`` is a string or a JSON-serialisable value."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    if not isinstance(data, str):
+        data = json.dumps(data, separators=(",", ":"))
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+def png_data_url(rgba, max_size=PREVIEW_SIZE):
+    """``data:`` URL of ``rgba`` scaled down to fit ``max_size`` pixels."""
+    image = Image.fromarray(np.ascontiguousarray(rgba), "RGBA")
+    image.thumbnail((max_size, max_size), Image.NEAREST)
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", compress_level=1)
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def cluster_preview(rgba, labels, max_size=PREVIEW_SIZE):
+    """``rgba`` subsampled to about ``max_size`` pixels with every visible
+    pixel painted in the mean colour of its cluster (``labels``, -1 where
+    transparent)."""
+    step = max(1, max(labels.shape) // max_size)
+    rgba, labels = rgba[::step, ::step], labels[::step, ::step]
+    visible = labels >= 0
+    lbl = labels[visible]
+    n = int(lbl.max()) + 1 if lbl.size else 0
+    counts = np.maximum(np.bincount(lbl, minlength=n), 1)
+    pixels = rgba[visible]
+    means = np.stack([np.bincount(lbl, pixels[:, c], n) / counts for c in range(3)], axis=1)
+    out = np.zeros_like(rgba)
+    out[visible] = np.concatenate([np.rint(means[lbl]), pixels[:, 3:]], axis=1)
+    return out
+
+
+def process_with_progress(image, params=None, emit=None):
+    """:func:`pipeline.process` reporting its progress through ``emit``.
+
+    ``emit(event, data)`` receives ``"stage"`` events whose data holds the
+    ``stage`` name (``"decode"``, ``"slic_iteration"`` or a
+    :data:`pipeline.STAGES` entry), its ``seconds`` and stage-specific
+    fields, then one ``"timings"`` event with the result's timings.
+
+    Returns:
+        :class:`pipeline.ProcessingResult`; its timings include ``"decode"``.
+    """
+    emit = emit or (lambda event, data: None)
+    start = time.perf_counter()
+    rgba = pipeline.load_image(image)
+    decode = time.perf_counter() - start
+    emit("stage", {"stage": "decode", "seconds": decode,
+                   "width": rgba.shape[1], "height": rgba.shape[0]})
+
+    def iteration(i, seconds):
+        emit("stage", {"stage": "slic_iteration", "iteration": i + 1, "seconds": seconds})
+
+    sp_labels = labels = None
+    for stage in pipeline.process_stages(rgba, params, callback=iteration):
+        data = {"stage": stage.name, "seconds": stage.seconds}
+        if stage.name == "superpixels":
+            sp_labels = stage.value
+            data["count"] = int(sp_labels.max()) + 1
+        elif stage.name == "clusters":
+            labels = stage.value.pixel_labels(sp_labels)
+            data.update(k=stage.value.k, preview=png_data_url(cluster_preview(rgba, labels)))
+        elif stage.name == "merge":
+            labels = stage.value.apply(labels)
+            data.update(layers=len(stage.value),
+                        preview=png_data_url(cluster_preview(rgba, labels)))
+        elif stage.name == "layer":
+            data.update(layer_metadata(stage.value),
+                        preview=png_data_url(stage.value.rgba, THUMBNAIL_SIZE))
+        elif stage.name == "result":
+            result = stage.value
+            result.timings = {"decode": decode, **result.timings}
+            emit("timings", result.timings)
+            return result
+        emit("stage", data)
+
+
+class Emitter:
+    """Picklable ``emit(event, data)`` putting ``(job_id, event, data)`` on a queue."""
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def __call__(self, event, data):
+        self.queue.put((self.job_id, event, data))
+
+
+class _Channel:
+    def __init__(self, max_events):
+        self.events = deque(maxlen=max_events)
+        self.next_id = 1
+        self.closed = False
+
+
+class ProgressBroker:
+    """Per-job event history fanned out to SSE subscribers.
+
+    Args:
+        max_events: events kept per job; a subscriber that falls further
+            behind misses the oldest ones.
+        max_jobs: jobs whose events are kept; the oldest finished ones are
+            forgotten first.
+    """
+
+    def __init__(self, max_events=1000, max_jobs=256):
+        self.max_events = max_events
+        self.max_jobs = max_jobs
+        self._channels = OrderedDict()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _channel(self, job_id):
+        # Called with the lock held.
+        channel = self._channels.get(job_id)
+        if channel is None:
+            channel = self._channels[job_id] = _Channel(self.max_events)
+            if len(self._channels) > self.max_jobs:
+                for old in [j for j, c in self._channels.items() if c.closed]:
+                    if len(self._channels) <= self.max_jobs:
+                        break
+                    del self._channels[old]
+        return channel
+
+    def publish(self, job_id, event, data):
+        """Record an event and wake the job's subscribers; returns its id."""
+        with self._lock:
+            channel = self._channel(job_id)
+            event_id = channel.next_id
+            channel.next_id += 1
+            channel.events.append((event_id, event, data))
+            if event in FINAL_EVENTS:
+                channel.closed = True
+            self._changed.notify_all()
+        return event_id
+
+    def __contains__(self, job_id):
+        with self._lock:
+            return job_id in self._channels
+
+    def events(self, job_id, last_event_id=None, keepalive=None, start_timeout=5.0):
+        """Yield ``(id, event, data)`` for the job, waiting for new ones.
+
+        Starts after ``last_event_id`` (the SSE ``Last-Event-ID`` header) and
+        ends after a final event.  With ``keepalive`` seconds, None is yielded
+        whenever no event arrived for that long.
+
+        Reading never creates state for a job: for an id without events
+        (unknown, forgotten, or not yet relayed) the iterator waits up to
+        ``start_timeout`` seconds for its first event and then ends.
+        """
+        last = int(last_event_id or 0)
+        deadline = time.monotonic() + start_timeout
+        while True:
+            with self._lock:
+                channel = self._channels.get(job_id)
+                if channel is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    self._changed.wait(remaining)
+                    continue
+                pending = [e for e in channel.events if e[0] > last]
+                if not pending and not channel.closed:
+                    self._changed.wait(keepalive)
+                    pending = [e for e in channel.events if e[0] > last]
+                closed = channel.closed
+            if not pending and closed:
+                return
+            if not pending:
+                if keepalive is not None:
+                    yield None
+                continue
+            for item in pending:
+                yield item
+                last = item[0]
+                if item[1] in FINAL_EVENTS:
+                    return
+
+    def stream(self, job_id, last_event_id=None, keepalive=15.0, start_timeout=5.0):
+        """SSE text chunks for the job, with comment lines while idle.
+
+        Handlers should answer 404 instead for ids the job manager does not
+        know; see :meth:`events` for ids without events yet.
+        """
+        for item in self.events(job_id, last_event_id, keepalive, start_timeout):
+            if item is None:
+                yield ": keep-alive\n\n"
+            else:
+                event_id, event, data = item
+                yield format_sse(data, event, event_id)
+
+    def relay(self, queue):
+        """Publish ``(job_id, event, data)`` tuples from ``queue`` in a daemon
+        thread until a None arrives; returns the thread."""
+        def run():
+            for item in iter(queue.get, None):
+                self.publish(*item)
+
+        thread = threading.Thread(target=run, name="progress-relay", daemon=True)
+        thread.start()
+        return thread
+
+    def forget(self, job_id):
+        with self._lock:
+            self._channels.pop(job_id, None)
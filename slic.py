@@ -0,0 +1,612 @@
+"""Vectorized SLIC superpixel segmentation.
+
+Each assignment iteration is expressed as batched array operations over the
+2S x 2S search window of every cluster center: window coordinates for a block
+of centers are generated at once, the combined colour/spatial distance is
+computed for every (center, pixel) pair, and the per-pixel minimum is resolved
+with a scatter-min.  The only Python-level loop inside an iteration is over
+fixed-size blocks of centers, which bounds peak memory.
+
+The distance measure follows skimage.segmentation.slic::
+
+    D = d_lab^2 + (compactness / S)^2 * d_xy^2
+
+where ``S = sqrt(H * W / n_segments)`` is the grid interval, so ``n_segments``
+and ``compactness`` keep the meaning they have in the existing pipeline.
+
+``mode="pyramid"`` converges the centers on a 1/2 or 1/4 block-averaged copy
+of the image and then runs only ``refine_iter`` iterations at full
+resolution.  Flat icon regions converge just as well at low resolution, so
+most of the iteration cost is avoided.
+
+:func:`slic_sparse` runs the same algorithm over a :class:`sparse.PixelIndex`
+of the visible pixels only.  Centers are seeded on visible pixels, windows are
+filtered to visible positions before any distance work, and all per-pixel
+arrays have one entry per visible pixel, so time and memory scale with the
+visible area rather than the canvas size.
+
+After the iterations, :func:`enforce_connectivity` splits every label into its
+connected fragments and hands the orphan fragments to their largest neighbour.
+It runs in linear time regardless of how many fragments a noisy icon produces.
+"""
+
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# Upper bound on (center, pixel) pairs evaluated per block; ~4M pairs keeps
+# the temporaries of one block around 100 MB.
+PAIR_BUDGET = 1 << 22
+
+# Column layout of the centers array.
+L, A, B, Y, X = range(5)
+
+
+def grid_step(shape, n_segments):
+    """Return the grid interval S for an image of ``shape`` and ``n_segments``."""
+    h, w = shape[:2]
+    return max(np.sqrt(h * w / max(int(n_segments), 1)), 1.0)
+
+
+def initial_centers(lab, n_segments):
+    """Place centers on a regular grid with spacing of roughly S pixels.
+
+    Returns ``(centers, step)`` where ``centers`` is a ``(K, 5)`` float64
+    array of ``[L, a, b, y, x]`` rows.
+    """
+    h, w = lab.shape[:2]
+    step = grid_step(lab.shape, n_segments)
+    rows = max(int(round(h / step)), 1)
+    cols = max(int(round(w / step)), 1)
+    ys = (np.arange(rows) + 0.5) * (h / rows)
+    xs = (np.arange(cols) + 0.5) * (w / cols)
+    gy, gx = np.meshgrid(ys, xs, indexing="ij")
+    gy = gy.ravel()
+    gx = gx.ravel()
+
+    centers = np.empty((gy.size, 5))
+    iy = np.minimum(gy.astype(np.intp), h - 1)
+    ix = np.minimum(gx.astype(np.intp), w - 1)
+    centers[:, L:B + 1] = lab[iy, ix]
+    centers[:, Y] = gy
+    centers[:, X] = gx
+    return centers, step
+
+
+def _window_block(c, offsets, h, w, row_offset=0):
+    """Window geometry for a block of centers.
+
+    Returns ``(pix, spatial, valid)``: flat pixel indices ``(k, n, n)`` into
+    the ``h x w`` band (clipped), squared spatial distances and the mask of
+    window positions that lie inside the band.
+    """
+    cy = c[:, Y]
+    cx = c[:, X]
+    # Round in the frame of the full image so a band sees the same windows
+    # as the whole image would (rint rounds halves to even).
+    ys = np.rint(cy).astype(np.intp)[:, None] + offsets
+    xs = np.rint(cx).astype(np.intp)[:, None] + offsets
+    dy2 = ((ys - cy[:, None]) ** 2).astype(np.float32)
+    ys -= row_offset
+    valid = ((ys >= 0) & (ys < h))[:, :, None] & ((xs >= 0) & (xs < w))[:, None, :]
+    dx2 = ((xs - cx[:, None]) ** 2).astype(np.float32)
+    np.clip(ys, 0, h - 1, out=ys)
+    np.clip(xs, 0, w - 1, out=xs)
+    pix = ys[:, :, None] * w + xs[:, None, :]
+    return pix, dy2[:, :, None] + dx2[:, None, :], valid
+
+
+def assign_labels(lab, centers, step, compactness, labels=None, distances=None,
+                  row_offset=0):
+    """Assign every pixel to the nearest center within its 2S x 2S window.
+
+    Args:
+        lab: ``(H, W, 3)`` LAB image (any float dtype; float32 is fastest).
+        centers: ``(K, 5)`` array of ``[L, a, b, y, x]`` rows.  ``y`` is in
+            the coordinate frame of the full image.
+        step: grid interval S.
+        compactness: SLIC compactness ``m``.
+        labels, distances: optional preallocated ``(H * W,)`` int32/float32
+            output buffers.
+        row_offset: row of the full image that ``lab[0]`` corresponds to.  This
+            lets the same routine run over a horizontal band of a larger image.
+
+    Returns:
+        ``(labels, distances)`` as flat arrays; pixels not covered by any
+        window keep label -1 and distance ``inf``.
+    """
+    h, w = lab.shape[:2]
+    n = h * w
+    flat = lab.reshape(n, 3)
+    if labels is None:
+        labels = np.empty(n, dtype=np.int32)
+    if distances is None:
+        distances = np.empty(n, dtype=np.float32)
+    labels.fill(-1)
+    distances.fill(np.inf)
+
+    radius = int(np.ceil(step))
+    offsets = np.arange(-radius, radius + 1)
+    window = offsets.size
+    spatial_weight = np.float32((compactness / step) ** 2)
+    block = max(PAIR_BUDGET // (window * window), 1)
+
+    for start in range(0, len(centers), block):
+        c = centers[start:start + block]
+        pix, spatial, valid = _window_block(c, offsets, h, w, row_offset)
+        diff = np.take(flat, pix, axis=0)
+        diff -= c[:, None, None, L:B + 1].astype(np.float32)
+        dist = np.einsum("kijc,kijc->kij", diff, diff)
+        dist += spatial_weight * spatial
+        dist[~valid] = np.inf
+
+        pix = pix.ravel()
+        dist = dist.ravel()
+        np.minimum.at(distances, pix, dist)
+        winners = (dist <= distances[pix]) & (dist < np.inf)
+        owner = np.repeat(np.arange(start, start + len(c), dtype=np.int32),
+                          window * window)
+        labels[pix[winners]] = owner[winners]
+
+    return labels, distances
+
+
+def update_centers(lab, labels, centers, row_offset=0):
+    """Move each center to the mean colour/position of its pixels.
+
+    Centers that own no pixels keep their previous position.  Returns the
+    new ``(K, 5)`` array.
+    """
+    sums, counts = center_sums(lab, labels, len(centers), row_offset)
+    return centers_from_sums(sums, counts, centers)
+
+
+def center_sums(lab, labels, k, row_offset=0):
+    """Per-center feature sums and pixel counts, ignoring unassigned pixels.
+
+    Returning raw sums (rather than means) lets partial results from several
+    image bands be added together before dividing.
+    """
+    w = lab.shape[1]
+    flat = lab.reshape(-1, 3)
+    index = np.flatnonzero(labels >= 0)
+    lbl = labels[index]
+    ys, xs = np.divmod(index, w)
+
+    counts = np.bincount(lbl, minlength=k).astype(np.float64)
+    sums = np.empty((k, 5))
+    for ch in range(3):
+        sums[:, ch] = np.bincount(lbl, weights=flat[index, ch], minlength=k)
+    sums[:, Y] = np.bincount(lbl, weights=ys, minlength=k) + row_offset * counts
+    sums[:, X] = np.bincount(lbl, weights=xs, minlength=k)
+    return sums, counts
+
+
+def centers_from_sums(sums, counts, previous):
+    centers = previous.copy()
+    nonempty = counts > 0
+    centers[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return centers
+
+
+def nearest_centers(values, ys, xs, centers, step, compactness):
+    """Globally nearest center for each ``(value, y, x)`` pixel, without windows."""
+    spatial_weight = (compactness / step) ** 2
+    block = max(PAIR_BUDGET // len(centers), 1)
+    out = np.empty(len(values), dtype=np.int32)
+    for start in range(0, len(values), block):
+        v = values[start:start + block]
+        py = ys[start:start + block, None]
+        px = xs[start:start + block, None]
+        dc = ((v[:, None, :] - centers[None, :, L:B + 1]) ** 2).sum(-1)
+        ds = (py - centers[None, :, Y]) ** 2 + (px - centers[None, :, X]) ** 2
+        out[start:start + block] = np.argmin(dc + spatial_weight * ds, axis=1)
+    return out
+
+
+def assign_leftovers(lab, labels, centers, step, compactness):
+    """Give pixels outside every search window their globally nearest center."""
+    missing = np.flatnonzero(labels < 0)
+    if missing.size == 0:
+        return labels
+    py, px = np.divmod(missing, lab.shape[1])
+    labels[missing] = nearest_centers(lab.reshape(-1, 3)[missing], py, px,
+                                      centers, step, compactness)
+    return labels
+
+
+def _scratch(workspace, name, n, dtype):
+    if workspace is None:
+        return np.empty(n, dtype=dtype)
+    return workspace.get(name, n, dtype)
+
+
+def iterate(lab, centers, step, compactness, max_iter, callback=None,
+            workspace=None, name="slic"):
+    """Run up to ``max_iter`` assignment/update rounds from ``centers``.
+
+    Stops early once an assignment leaves every label unchanged.  Returns
+    ``(labels, centers)`` with ``labels`` flat.  With a ``workspace`` the
+    label and distance buffers are taken from it under ``name``, so the
+    returned labels are only valid until the next call.
+    """
+    n = lab.shape[0] * lab.shape[1]
+    labels = _scratch(workspace, name + ".labels", n, np.int32)
+    previous = _scratch(workspace, name + ".previous", n, np.int32)
+    distances = _scratch(workspace, name + ".distances", n, np.float32)
+    for i in range(max_iter):
+        start = time.perf_counter()
+        assign_labels(lab, centers, step, compactness, labels, distances)
+        centers = update_centers(lab, labels, centers)
+        if callback is not None:
+            callback(i, time.perf_counter() - start)
+        if i and np.array_equal(labels, previous):
+            break
+        labels, previous = previous, labels
+    else:
+        labels, previous = previous, labels
+    return labels, centers
+
+
+def downsample(lab, factor):
+    """Block-average ``lab`` by an integer ``factor``, edge-padding as needed."""
+    h, w = lab.shape[:2]
+    ph, pw = -h % factor, -w % factor
+    if ph or pw:
+        lab = np.pad(lab, ((0, ph), (0, pw), (0, 0)), mode="edge")
+    hh, ww = lab.shape[0] // factor, lab.shape[1] // factor
+    blocks = lab.reshape(hh, factor, ww, factor, 3)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def pyramid_centers(lab, n_segments, compactness, factor, max_iter, callback=None,
+                    workspace=None):
+    """Converge centers on a downsampled image and map them to full scale.
+
+    Returns ``(centers, step)`` in full-resolution coordinates.  ``factor`` is
+    halved until the coarse grid interval is at least two pixels.
+    """
+    step = grid_step(lab.shape, n_segments)
+    while factor > 1 and step / factor < 2.0:
+        factor //= 2
+    if factor <= 1:
+        return initial_centers(lab, n_segments)
+
+    small = downsample(lab, factor)
+    centers, small_step = initial_centers(small, n_segments)
+    _, centers = iterate(small, centers, small_step, compactness, max_iter, callback,
+                         workspace, name="slic.coarse")
+    centers[:, [Y, X]] = (centers[:, [Y, X]] + 0.5) * factor - 0.5
+    return centers, step
+
+
+def sparse_initial_centers(values, index, step):
+    """One center per grid cell of side ``step`` that contains visible pixels.
+
+    Each center starts at the mean colour and position of the visible pixels
+    in its cell, so no center is placed on a transparent area.
+    """
+    cols = int(index.shape[1] // step) + 1
+    cell = (index.ys // step).astype(np.int64) * cols + (index.xs // step).astype(np.int64)
+    _, cell = np.unique(cell, return_inverse=True)
+    cell = cell.ravel()
+    k = int(cell.max()) + 1
+    counts = np.bincount(cell, minlength=k)
+    centers = np.empty((k, 5))
+    for ch in range(3):
+        centers[:, ch] = np.bincount(cell, weights=values[:, ch], minlength=k)
+    centers[:, Y] = np.bincount(cell, weights=index.ys, minlength=k)
+    centers[:, X] = np.bincount(cell, weights=index.xs, minlength=k)
+    centers /= counts[:, None]
+    return centers
+
+
+def position_map(index, workspace=None):
+    """Canvas-sized int32 map from pixel to its position in ``index`` (or -1)."""
+    n = index.shape[0] * index.shape[1]
+    if workspace is None:
+        positions = np.full(n, -1, dtype=np.int32)
+    else:
+        positions = workspace.get("sparse.positions", n, np.int32, fill=-1)
+    positions[index.flat] = np.arange(index.size, dtype=np.int32)
+    return positions
+
+
+def assign_sparse(values, index, centers, step, compactness, positions=None,
+                  labels=None, distances=None):
+    """Sparse counterpart of :func:`assign_labels` over indexed pixels.
+
+    Windows are generated as in the dense engine but every window position is
+    first mapped through ``positions`` (see :func:`position_map`) and only
+    visible pixels reach the distance computation and scatter-min.
+
+    Returns ``(labels, distances)`` of length N; pixels outside every window
+    get -1 / ``inf``.
+    """
+    h, w = index.shape
+    n = len(values)
+    if positions is None:
+        positions = position_map(index)
+    if labels is None:
+        labels = np.empty(n, dtype=np.int32)
+    if distances is None:
+        distances = np.empty(n, dtype=np.float32)
+    labels.fill(-1)
+    distances.fill(np.inf)
+
+    radius = int(np.ceil(step))
+    offsets = np.arange(-radius, radius + 1)
+    window = offsets.size * offsets.size
+    spatial_weight = np.float32((compactness / step) ** 2)
+    block = max(PAIR_BUDGET // window, 1)
+
+    for start in range(0, len(centers), block):
+        c = centers[start:start + block]
+        pix, spatial, valid = _window_block(c, offsets, h, w)
+        pos = positions[pix]
+        keep = (valid & (pos >= 0)).ravel()
+        pos = pos.ravel()[keep]
+        owner = np.repeat(np.arange(len(c), dtype=np.int32), window)[keep]
+
+        diff = np.take(values, pos, axis=0)
+        diff -= np.take(c[:, L:B + 1].astype(np.float32), owner, axis=0)
+        dist = np.einsum("pc,pc->p", diff, diff)
+        dist += spatial_weight * spatial.ravel()[keep]
+
+        np.minimum.at(distances, pos, dist)
+        winners = dist <= distances[pos]
+        labels[pos[winners]] = owner[winners] + start
+    return labels, distances
+
+
+def sparse_center_sums(values, index, labels, k):
+    """:func:`center_sums` for indexed pixels."""
+    keep = labels >= 0
+    lbl = labels[keep]
+    counts = np.bincount(lbl, minlength=k).astype(np.float64)
+    sums = np.empty((k, 5))
+    for ch in range(3):
+        sums[:, ch] = np.bincount(lbl, weights=values[keep, ch], minlength=k)
+    sums[:, Y] = np.bincount(lbl, weights=index.ys[keep], minlength=k)
+    sums[:, X] = np.bincount(lbl, weights=index.xs[keep], minlength=k)
+    return sums, counts
+
+
+def slic_sparse(values, index, n_segments=100, compactness=10.0, max_iter=10,
+                callback=None, enforce=True, min_size_factor=0.5, timings=None,
+                workspace=None):
+    """SLIC over the visible pixels listed by ``index`` only.
+
+    Args:
+        values: ``(N, 3)`` LAB values of the indexed pixels, e.g.
+            ``srgb_to_lab(index.gather(rgba))``.
+        index: :class:`sparse.PixelIndex` of the visible pixels.
+        n_segments: approximate number of superpixels over the *visible*
+            area; the grid interval is ``sqrt(N / n_segments)``.
+        compactness, max_iter, callback, enforce, min_size_factor, timings,
+        workspace: as for :func:`slic`.
+
+    Returns:
+        ``(H, W)`` int32 label map with labels ``0..n-1`` on visible pixels
+        and -1 elsewhere.
+    """
+    if max_iter < 1:
+        raise ValueError("max_iter must be at least 1")
+    if index.size == 0:
+        return np.full(index.shape, -1, dtype=np.int32)
+    values = as_float32(values, workspace, "sparse.values").reshape(-1, 3)
+    start = time.perf_counter()
+    step = max(np.sqrt(index.size / max(int(n_segments), 1)), 1.0)
+    centers = sparse_initial_centers(values, index, step)
+    positions = position_map(index, workspace)
+
+    labels = _scratch(workspace, "sparse.labels", index.size, np.int32)
+    previous = _scratch(workspace, "sparse.previous", index.size, np.int32)
+    previous.fill(-2)
+    distances = _scratch(workspace, "sparse.distances", index.size, np.float32)
+    for i in range(max_iter):
+        iter_start = time.perf_counter()
+        assign_sparse(values, index, centers, step, compactness, positions,
+                      labels, distances)
+        sums, counts = sparse_center_sums(values, index, labels, len(centers))
+        centers = centers_from_sums(sums, counts, centers)
+        if callback is not None:
+            callback(i, time.perf_counter() - iter_start)
+        if np.array_equal(labels, previous):
+            break
+        labels, previous = previous, labels
+    else:
+        labels, previous = previous, labels
+
+    missing = np.flatnonzero(labels < 0)
+    if missing.size:
+        labels[missing] = nearest_centers(values[missing], index.ys[missing],
+                                          index.xs[missing], centers, step,
+                                          compactness)
+    if timings is not None:
+        timings["iterations"] = time.perf_counter() - start
+    full = index.scatter(labels, fill=-1)
+    return finish_labels(full, n_segments, enforce, min_size_factor, timings,
+                         area=index.size)
+
+
+def _neighbour_pairs(labels):
+    """Flat indices of 4-connected pixel pairs, split by equal/different label.
+
+    Pairs touching a negative (background) label are left out of both sets.
+    """
+    h, w = labels.shape
+    idx = np.arange(h * w).reshape(h, w)
+    right = labels[:, :-1] == labels[:, 1:]
+    down = labels[:-1] == labels[1:]
+    a_right, b_right = idx[:, :-1], idx[:, 1:]
+    a_down, b_down = idx[:-1], idx[1:]
+    fg_right = (labels[:, :-1] >= 0) & (labels[:, 1:] >= 0)
+    fg_down = (labels[:-1] >= 0) & (labels[1:] >= 0)
+    same_right, same_down = right & fg_right, down & fg_down
+    diff_right, diff_down = ~right & fg_right, ~down & fg_down
+    same = (np.concatenate([a_right[same_right], a_down[same_down]]),
+            np.concatenate([b_right[same_right], b_down[same_down]]))
+    different = (np.concatenate([a_right[diff_right], a_down[diff_down]]),
+                 np.concatenate([b_right[diff_right], b_down[diff_down]]))
+    return same, different
+
+
+def enforce_connectivity(labels, min_size=0):
+    """Make every superpixel a single 4-connected region.
+
+    Every connected fragment with at least ``min_size`` pixels becomes a
+    superpixel of its own, as in skimage's connectivity step.  Smaller
+    fragments are orphans and are merged into the neighbouring kept region
+    with the most pixels.  Orphans that only touch other orphans are
+    resolved in the following sweep, so in practice one or two vectorized
+    sweeps cover the whole image.  Orphans with no path to a kept region,
+    such as a small island surrounded by background, stay superpixels of
+    their own.  Negative labels mark background (e.g. transparent pixels)
+    and are preserved as -1.
+
+    Returns a new ``(H, W)`` int32 label map with labels ``0..n-1``.
+    """
+    h, w = labels.shape
+    n = h * w
+    (same_a, same_b), (diff_a, diff_b) = _neighbour_pairs(labels)
+
+    graph = coo_matrix((np.ones(same_a.size, dtype=np.int8), (same_a, same_b)),
+                       shape=(n, n))
+    n_comp, comp = connected_components(graph, directed=False)
+    background = labels.ravel() < 0
+    sizes = np.bincount(comp, minlength=n_comp)
+    sizes[comp[background]] = 0
+    kept = sizes >= max(min_size, 1)
+    if not kept.any():
+        if not sizes.any():
+            return np.full((h, w), -1, dtype=np.int32)
+        kept[np.argmax(sizes)] = True
+
+    # Component adjacency across label boundaries, in both directions.
+    src = np.concatenate([comp[diff_a], comp[diff_b]])
+    dst = np.concatenate([comp[diff_b], comp[diff_a]])
+    root = np.where(kept, np.arange(n_comp), -1)
+    while True:
+        pending = root[src] < 0
+        usable = pending & (root[dst] >= 0)
+        if not usable.any():
+            break
+        s_, d_ = src[usable], root[dst[usable]]
+        order = np.lexsort((-sizes[d_], s_))
+        first = np.r_[True, s_[order][1:] != s_[order][:-1]]
+        root[s_[order][first]] = d_[order][first]
+        src, dst = src[pending], dst[pending]
+    # Orphans cut off from every kept region by background keep their own
+    # component instead of vanishing into it.
+    unresolved = np.flatnonzero(root < 0)
+    root[unresolved] = unresolved
+
+    result = root[comp]
+    result[background] = -1
+    return relabel_sequential(result.reshape(h, w))
+
+
+def relabel_sequential(labels):
+    """Map labels to ``0..n-1`` preserving their order of first appearance.
+
+    Negative labels are left at -1.
+    """
+    flat = labels.ravel()
+    out = np.full(flat.shape, -1, dtype=np.int32)
+    keep = flat >= 0
+    if keep.all():
+        keep = slice(None)
+    _, first, inverse = np.unique(flat[keep], return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    out[keep] = order[inverse.ravel()]
+    return out.reshape(labels.shape)
+
+
+MODES = ("dense", "pyramid")
+
+
+def as_float32(array, workspace=None, name="lab"):
+    """C-contiguous float32 view or copy of ``array``, copied into the workspace."""
+    array = np.asarray(array)
+    if array.dtype == np.float32 and array.flags.c_contiguous:
+        return array
+    if workspace is None:
+        return np.ascontiguousarray(array, dtype=np.float32)
+    out = workspace.get(name, array.shape, np.float32)
+    np.copyto(out, array, casting="same_kind")
+    return out
+
+
+def finish_labels(labels, n_segments, enforce=True, min_size_factor=0.5,
+                  timings=None, area=None):
+    """Final clean-up shared by the SLIC front ends.
+
+    Applies :func:`enforce_connectivity` (recording its duration in
+    ``timings["connectivity"]`` when a dict is given) or just relabels.
+    ``area`` is the number of segmented pixels (defaults to the canvas).
+    """
+    if not enforce:
+        return relabel_sequential(labels)
+    start = time.perf_counter()
+    area = labels.size if area is None else area
+    min_size = int(min_size_factor * area / max(int(n_segments), 1))
+    labels = enforce_connectivity(labels, min_size)
+    if timings is not None:
+        timings["connectivity"] = time.perf_counter() - start
+    return labels
+
+
+def slic(lab, n_segments=100, compactness=10.0, max_iter=10, callback=None,
+         mode="dense", pyramid_factor=4, refine_iter=2, enforce=True,
+         min_size_factor=0.5, timings=None, workspace=None):
+    """Segment a LAB image into superpixels.
+
+    Args:
+        lab: ``(H, W, 3)`` LAB image.
+        n_segments: approximate number of superpixels.
+        compactness: trade-off between colour similarity and spatial
+            proximity; higher values give more regular superpixels.
+        max_iter: maximum number of assignment/update iterations.
+        callback: optional ``callback(iteration, seconds)`` called after each
+            iteration, e.g. for benchmarking or progress reporting.
+        mode: ``"dense"`` iterates at full resolution; ``"pyramid"`` runs
+            ``max_iter`` iterations on an image downsampled by
+            ``pyramid_factor`` (2 or 4) followed by ``refine_iter``
+            iterations at full resolution.
+        enforce: run :func:`enforce_connectivity` on the result.
+        min_size_factor: fragments smaller than this fraction of the
+            average superpixel size are merged into a neighbour.
+        timings: optional dict that receives the duration in seconds of the
+            ``"iterations"`` and ``"connectivity"`` stages.
+        workspace: optional :class:`workspace.Workspace` providing the
+            float32/int32 scratch buffers.
+
+    Returns:
+        ``(H, W)`` int32 label map with labels ``0..n-1``.
+    """
+    if max_iter < 1:
+        raise ValueError("max_iter must be at least 1")
+    if mode not in MODES:
+        raise ValueError(f"unknown SLIC mode {mode!r}; expected one of {MODES}")
+    lab = as_float32(lab, workspace, "slic.lab")
+    h, w = lab.shape[:2]
+    start = time.perf_counter()
+    if mode == "pyramid":
+        if pyramid_factor not in (2, 4):
+            raise ValueError("pyramid_factor must be 2 or 4")
+        centers, step = pyramid_centers(lab, n_segments, compactness,
+                                        pyramid_factor, max_iter, callback,
+                                        workspace)
+        max_iter = max(int(refine_iter), 1)
+    else:
+        centers, step = initial_centers(lab, n_segments)
+    labels, centers = iterate(lab, centers, step, compactness, max_iter, callback,
+                              workspace)
+    assign_leftovers(lab, labels, centers, step, compactness)
+    if timings is not None:
+        timings["iterations"] = time.perf_counter() - start
+    return finish_labels(labels.reshape(h, w), n_segments, enforce,
+                         min_size_factor, timings)
@@ -0,0 +1,167 @@
+"""Multi-core SLIC over horizontal strips of one image.
+
+The LAB image and the label map live in ``multiprocessing.shared_memory``
+segments so worker processes read and write them without copying.  Every
+iteration the parent sends each worker the current centers that can reach its
+strip: the strip's own centers plus a halo of neighbouring centers whose 2S
+search windows cross the seam.  Each worker assigns the pixels of its strip,
+writes them into the shared label map and returns partial center sums, which
+the parent reduces into the new centers.
+
+Because a pixel only ever compares against centers within S rows of it, the
+halo makes every seam pixel see exactly the candidates it would see in
+single-process SLIC.  Seams therefore need no separate reconciliation pass,
+and the result matches :func:`slic.slic` up to floating point summation order.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import slic
+
+# Strips thinner than this spend more time on per-task overhead than on work.
+MIN_STRIP_ROWS = 64
+
+# Shared-memory segments attached in this worker process, by name.
+_attached = {}
+
+
+def _retain(names):
+    """Detach from every segment not in ``names`` (i.e. from earlier images)."""
+    for old in [name for name in _attached if name not in names]:
+        old_shm, old_views = _attached.pop(old)
+        old_views.clear()
+        old_shm.close()
+
+
+def _attach(name, shape, dtype):
+    """Return a NumPy view of shared segment ``name``, attaching on first use."""
+    entry = _attached.get(name)
+    if entry is None:
+        # Pool workers share the parent's resource tracker, so attaching here
+        # does not register a second owner; the parent unlinks the segment.
+        shm = shared_memory.SharedMemory(name=name)
+        entry = _attached[name] = (shm, {})
+    shm, views = entry
+    key = (shape, dtype)
+    if key not in views:
+        views[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return views[key]
+
+
+def _strip_step(task):
+    """Assign one strip and return its partial center sums."""
+    (lab_name, labels_name, shape, r0, r1, centers, index, step,
+     compactness) = task
+    h, w = shape
+    _retain((lab_name, labels_name))
+    lab = _attach(lab_name, (h, w, 3), np.float32)
+    labels = _attach(labels_name, (h * w,), np.int32)
+
+    band = lab[r0:r1]
+    local, _ = slic.assign_labels(band, centers, step, compactness, row_offset=r0)
+    sums, counts = slic.center_sums(band, local, len(centers), row_offset=r0)
+
+    global_labels = np.where(local >= 0, index[np.maximum(local, 0)], -1)
+    out = labels[r0 * w:r1 * w]
+    changed = not np.array_equal(out, global_labels)
+    out[:] = global_labels
+    return index, sums, counts, changed
+
+
+def strip_bounds(height, strips):
+    """Split ``height`` rows into ``strips`` contiguous ``(start, stop)`` bands."""
+    edges = np.linspace(0, height, strips + 1).round().astype(int)
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+
+def centers_for_strip(centers, step, r0, r1):
+    """Indices of centers whose search window overlaps rows ``[r0, r1)``."""
+    radius = int(np.ceil(step))
+    cy = np.rint(centers[:, slic.Y])
+    return np.flatnonzero((cy + radius >= r0) & (cy - radius < r1))
+
+
+def tiled_slic(lab, n_segments=100, compactness=10.0, max_iter=10, callback=None,
+               executor=None, workers=None, strips=None, enforce=True,
+               min_size_factor=0.5, timings=None):
+    """Run SLIC with the assignment/update step spread over a process pool.
+
+    Args:
+        lab, n_segments, compactness, max_iter, callback, enforce,
+        min_size_factor, timings: as for :func:`slic.slic`.
+        executor: an existing ``ProcessPoolExecutor`` to reuse (recommended
+            for long-lived server workers).  A private pool is created and
+            shut down when omitted.
+        workers: pool size when ``executor`` is omitted; defaults to
+            ``os.cpu_count()``.
+        strips: number of horizontal strips; defaults to the pool size.
+
+    Returns:
+        ``(H, W)`` int32 label map, as :func:`slic.slic`.
+    """
+    if max_iter < 1:
+        raise ValueError("max_iter must be at least 1")
+    workers = workers or getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+    strips = strips or workers
+    h, w = lab.shape[:2]
+    strips = max(min(strips, h // MIN_STRIP_ROWS), 1)
+    if strips == 1:
+        return slic.slic(lab, n_segments, compactness, max_iter, callback,
+                         enforce=enforce, min_size_factor=min_size_factor,
+                         timings=timings)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    lab_shm = shared_memory.SharedMemory(create=True, size=h * w * 3 * 4)
+    labels_shm = shared_memory.SharedMemory(create=True, size=h * w * 4)
+    try:
+        shared_lab = np.ndarray((h, w, 3), dtype=np.float32, buffer=lab_shm.buf)
+        shared_lab[:] = lab
+        labels = np.ndarray((h * w,), dtype=np.int32, buffer=labels_shm.buf)
+        labels.fill(-1)
+
+        started = time.perf_counter()
+        centers, step = slic.initial_centers(shared_lab, n_segments)
+        bounds = strip_bounds(h, strips)
+        for i in range(max_iter):
+            start = time.perf_counter()
+            tasks = []
+            for r0, r1 in bounds:
+                index = centers_for_strip(centers, step, r0, r1)
+                tasks.append((lab_shm.name, labels_shm.name, (h, w), r0, r1,
+                              centers[index], index, step, compactness))
+
+            sums = np.zeros((len(centers), 5))
+            counts = np.zeros(len(centers))
+            changed = False
+            for index, part_sums, part_counts, part_changed in executor.map(_strip_step, tasks):
+                sums[index] += part_sums
+                counts[index] += part_counts
+                changed |= part_changed
+            centers = slic.centers_from_sums(sums, counts, centers)
+            if callback is not None:
+                callback(i, time.perf_counter() - start)
+            if not changed:
+                break
+
+        result = labels.copy()
+        slic.assign_leftovers(shared_lab, result, centers, step, compactness)
+        if timings is not None:
+            timings["iterations"] = time.perf_counter() - started
+    finally:
+        # Views must be released before the segments can be closed.
+        shared_lab = labels = None
+        lab_shm.close()
+        lab_shm.unlink()
+        labels_shm.close()
+        labels_shm.unlink()
+        if own_executor:
+            executor.shutdown()
+    return slic.finish_labels(result.reshape(h, w), n_segments, enforce,
+                              min_size_factor, timings)
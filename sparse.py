@@ -0,0 +1,69 @@
+"""Compact indexing of the visible pixels of an icon.
+
+App icons often have large fully transparent areas (rounded corners,
+padding).  A :class:`PixelIndex` lists the pixels whose alpha is above a
+threshold once, so the later stages -- LAB conversion, SLIC, feature
+accumulation and layer extraction -- can work on ``(N, C)`` arrays of visible
+pixels instead of on the whole canvas.
+"""
+
+import numpy as np
+
+
+class PixelIndex:
+    """Flat indices and coordinates of the visible pixels of an image.
+
+    Attributes:
+        flat: ``(N,)`` int64 row-major indices into the ``H * W`` canvas.
+        ys, xs: ``(N,)`` int32 pixel coordinates.
+        shape: ``(H, W)`` of the canvas.
+    """
+
+    def __init__(self, flat, shape):
+        self.flat = np.asarray(flat, dtype=np.int64)
+        self.shape = tuple(shape[:2])
+        ys, xs = np.divmod(self.flat, self.shape[1])
+        self.ys = ys.astype(np.int32)
+        self.xs = xs.astype(np.int32)
+
+    @classmethod
+    def from_alpha(cls, rgba, threshold=0):
+        """Index the pixels of ``rgba`` whose alpha is greater than ``threshold``."""
+        rgba = np.asarray(rgba)
+        if rgba.ndim != 3 or rgba.shape[2] != 4:
+            return cls.full(rgba.shape)
+        return cls(np.flatnonzero(rgba[..., 3] > threshold), rgba.shape)
+
+    @classmethod
+    def full(cls, shape):
+        """Index every pixel of a ``shape`` canvas."""
+        return cls(np.arange(shape[0] * shape[1]), shape)
+
+    @property
+    def size(self):
+        return self.flat.size
+
+    @property
+    def coverage(self):
+        """Fraction of the canvas that is visible."""
+        return self.size / float(self.shape[0] * self.shape[1])
+
+    def bbox(self):
+        """``(y0, x0, y1, x1)`` of the visible pixels (exclusive end), or None."""
+        if not self.size:
+            return None
+        return (int(self.ys.min()), int(self.xs.min()),
+                int(self.ys.max()) + 1, int(self.xs.max()) + 1)
+
+    def gather(self, image):
+        """Return the ``(N, ...)`` values of ``image`` at the visible pixels."""
+        image = np.asarray(image)
+        return image.reshape((-1,) + image.shape[2:])[self.flat]
+
+    def scatter(self, values, fill=0):
+        """Place ``(N, ...)`` values back on a canvas filled with ``fill``."""
+        values = np.asarray(values)
+        out = np.full((self.shape[0] * self.shape[1],) + values.shape[1:], fill,
+                      dtype=values.dtype)
+        out[self.flat] = values
+        return out.reshape(self.shape + values.shape[1:])
@@ -0,0 +1,68 @@
+"""Per-superpixel feature accumulation.
+
+Mirrors ``SuperpixelProcessor.extractSuperpixelFeatures`` in the Swift port:
+each superpixel is reduced to its mean LAB colour, pixel count and center
+position.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class SuperpixelFeatures:
+    """Features of ``n`` superpixels, indexed by superpixel label.
+
+    Attributes:
+        mean_lab: ``(n, 3)`` mean LAB colour.
+        pixel_count: ``(n,)`` number of pixels.
+        center: ``(n, 2)`` mean ``(y, x)`` position.
+    """
+
+    mean_lab: np.ndarray
+    pixel_count: np.ndarray
+    center: np.ndarray
+
+    def __len__(self):
+        return len(self.pixel_count)
+
+
+def superpixel_features(lab, labels, index=None):
+    """Accumulate :class:`SuperpixelFeatures` for a label map.
+
+    Args:
+        lab: ``(H, W, 3)`` LAB image, or ``(N, 3)`` LAB values of the pixels
+            listed by ``index``.
+        labels: superpixel labels; ``(H, W)`` for a dense image, or either
+            ``(N,)`` or ``(H, W)`` in sparse mode.  Negative labels (e.g.
+            transparent pixels) are ignored.
+        index: optional :class:`sparse.PixelIndex`; when given only the
+            indexed pixels are visited.
+
+    Superpixels with no pixels get a zero count and zero colour/position.
+    """
+    if index is None:
+        h, w = labels.shape
+        values = np.asarray(lab).reshape(-1, 3)
+        lbl = np.asarray(labels).ravel()
+        ys, xs = np.divmod(np.arange(h * w), w)
+    else:
+        values = np.asarray(lab).reshape(-1, 3)
+        lbl = np.asarray(labels)
+        if lbl.ndim == 2:
+            lbl = index.gather(lbl)
+        ys, xs = index.ys, index.xs
+
+    keep = lbl >= 0
+    if not keep.all():
+        values, lbl, ys, xs = values[keep], lbl[keep], ys[keep], xs[keep]
+    n = int(lbl.max()) + 1 if lbl.size else 0
+
+    counts = np.bincount(lbl, minlength=n)
+    safe = np.maximum(counts, 1)[:, None]
+    mean_lab = np.stack([np.bincount(lbl, weights=values[:, c], minlength=n)
+                         for c in range(3)], axis=1) / safe
+    center = np.stack([np.bincount(lbl, weights=ys, minlength=n),
+                       np.bincount(lbl, weights=xs, minlength=n)], axis=1) / safe
+    return SuperpixelFeatures(mean_lab, counts, center)
@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import cache
+import pipeline
+from testutil import make_icon_layers, make_rounded_icon
+
+PARAMS = pipeline.ProcessingParams(n_segments=100, n_clusters=3, lab_backend="exact")
+
+
+def test_canonical_params_ignore_key_order_and_integral_floats():
+    a = cache.canonical_params({"n_clusters": 8, "compactness": 10.0})
+    b = cache.canonical_params({"compactness": 10, "n_clusters": 8.0})
+    assert a == b
+    assert cache.params_hash(PARAMS) == cache.params_hash(PARAMS.to_dict())
+    assert cache.params_hash(PARAMS) != cache.params_hash({**PARAMS.to_dict(), "seed": 1})
+
+
+def test_put_then_get(tmp_path):
+    results = cache.ResultCache(str(tmp_path))
+    upload = cache.content_hash(b"icon bytes")
+    assert len(upload) == 16
+    assert results.get(upload, PARAMS) is None
+    stored = results.put(upload, PARAMS, make_icon_layers())
+    hit = results.get(upload, PARAMS)
+    assert hit["layers"] == stored["layers"]
+    assert hit["upload"] == upload and hit["params"]["n_clusters"] == 3
+    for entry in hit["layers"]:
+        assert os.path.exists(os.path.join(hit["path"], entry["filename"]))
+    assert results.stats()["hits"] == 1 and results.stats()["misses"] == 1
+    assert not [p for p in os.listdir(tmp_path / upload) if p.startswith(".tmp-")]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    results = cache.ResultCache(str(tmp_path))
+    for i, upload in enumerate(["a" * 16, "b" * 16, "c" * 16]):
+        results.put(upload, PARAMS, make_icon_layers())
+        os.utime(results.path(upload, PARAMS), (1000 + i, 1000 + i))
+    entry_size = results.entries()[0][1]
+    results.get("a" * 16, PARAMS)          # a becomes the most recently used
+    results.max_bytes = 2 * entry_size
+    results.evict()
+    assert results.get("b" * 16, PARAMS) is None
+    assert results.get("a" * 16, PARAMS) is not None
+    assert results.get("c" * 16, PARAMS) is not None
+    assert results.stats()["evictions"] == 1
+    assert not (tmp_path / ("b" * 16)).exists()
+
+
+def test_entry_larger_than_the_budget_is_kept_until_the_next_put(tmp_path):
+    results = cache.ResultCache(str(tmp_path), max_bytes=100)
+    first = results.put("a" * 16, PARAMS, make_icon_layers())
+    for entry in first["layers"]:
+        assert os.path.exists(os.path.join(first["path"], entry["filename"]))
+    second = results.get_or_compute("b" * 16, PARAMS, make_icon_layers)
+    assert os.path.exists(second["path"])
+    assert not os.path.exists(first["path"])
+    assert results.stats()["evictions"] == 1
+
+
+def test_second_writer_keeps_first_entry(tmp_path):
+    results = cache.ResultCache(str(tmp_path))
+    first = results.put("d" * 16, PARAMS, make_icon_layers())
+    second = results.put("d" * 16, PARAMS, make_icon_layers())
+    assert first["path"] == second["path"]
+    assert len(results.entries()) == 1
+
+
+def test_get_or_compute_runs_the_pipeline_once(tmp_path):
+    results = cache.ResultCache(str(tmp_path))
+    rgba = make_rounded_icon(64)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return pipeline.process(rgba, PARAMS).layers
+
+    first = results.get_or_compute("e" * 16, PARAMS, compute)
+    second = results.get_or_compute("e" * 16, PARAMS, compute)
+    assert len(calls) == 1
+    assert first["layers"] == second["layers"]
+
+
+def test_output_modes_are_separate_entries(tmp_path):
+    results = cache.ResultCache(str(tmp_path))
+    full = results.put("f" * 16, PARAMS, make_icon_layers(), mode="full")
+    assert results.get("f" * 16, PARAMS) is None
+    cropped = results.get_or_compute("f" * 16, PARAMS, make_icon_layers, mode="cropped")
+    assert (full["mode"], cropped["mode"]) == ("full", "cropped")
+    assert results.get("f" * 16, PARAMS, mode="full")["path"] == full["path"] != cropped["path"]
+    with pytest.raises(ValueError):
+        cache.result_hash(PARAMS, mode="thumbnail")
+
+
+def test_memory_lru_byte_budget():
+    memo = cache.MemoryLRU(max_bytes=100)
+    memo.put("a", np.zeros(40, dtype=np.uint8))
+    memo.put("b", np.zeros(40, dtype=np.uint8))
+    memo.get("a")
+    memo.put("c", np.zeros(40, dtype=np.uint8))
+    assert "a" in memo and "c" in memo and "b" not in memo
+    memo.put("huge", np.zeros(200, dtype=np.uint8))
+    assert "huge" not in memo
+    assert memo.stats()["bytes"] == 80
+    memo.put(("u", "lab"), np.zeros(10, dtype=np.uint8))
+    memo.discard(("u",))
+    assert ("u", "lab") not in memo
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = cache.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "layers"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("key", compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do("key", compute)))
+                 for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flights.stats()["coalesced"] < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+    assert len(calls) == 1
+    assert sorted(results) == [("layers", False)] + [("layers", True)] * 3
+    assert flights.stats() == {"calls": 4, "executions": 1, "coalesced": 3,
+                               "failures": 0, "in_flight": 0}
+
+
+def test_single_flight_does_not_keep_failures():
+    flights = cache.SingleFlight()
+    with pytest.raises(ValueError):
+        flights.do("key", lambda: int("x"))
+    assert flights.do("key", lambda: 1) == (1, False)
+    assert flights.stats()["failures"] == 1
@@ -0,0 +1,182 @@
+import numpy as np
+import pytest
+
+import clustering
+import slic
+from colorspace import srgb_to_lab
+from sparse import PixelIndex
+from superpixels import superpixel_features
+from testutil import make_icon, make_rounded_icon, same_partition
+
+
+def blobs(n_blobs=6, per_blob=50, spread=3.0, seed=0):
+    rng = np.random.default_rng(seed)
+    means = rng.random((n_blobs, 3)) * 100
+    points = np.concatenate([m + rng.normal(0, spread, (per_blob, 3)) for m in means])
+    weights = rng.integers(20, 400, len(points)).astype(float)
+    truth = np.repeat(np.arange(n_blobs), per_blob)
+    return points, weights, truth
+
+
+def test_kmeans_recovers_separated_blobs():
+    points, weights, truth = blobs()
+    result = clustering.kmeans(points, 6, weights)
+    assert result.k == 6
+    assert same_partition(result.labels, truth)
+
+
+def test_kmeans_is_deterministic_for_a_seed():
+    points, weights, _ = blobs(spread=15.0)
+    a = clustering.kmeans(points, 5, weights, seed=7)
+    b = clustering.kmeans(points, 5, weights, seed=7)
+    assert np.array_equal(a.labels, b.labels)
+    assert np.allclose(a.centers, b.centers)
+
+
+@pytest.mark.parametrize("k", [1, 2, 8, 32])
+def test_hamerly_matches_lloyd(k):
+    points, weights, _ = blobs(n_blobs=10, spread=12.0)
+    lloyd = clustering.kmeans(points, k, weights)
+    hamerly = clustering.kmeans(points, k, weights, algorithm="hamerly")
+    assert np.array_equal(lloyd.labels, hamerly.labels)
+    assert lloyd.n_iter == hamerly.n_iter
+    assert hamerly.inertia == pytest.approx(lloyd.inertia)
+    assert lloyd.distance_evaluations == lloyd.n_iter * len(points) * k
+    if k > 1:
+        assert hamerly.distance_evaluations < lloyd.distance_evaluations
+
+
+def test_hamerly_handles_empty_clusters():
+    points = np.array([[0.0], [0.0], [0.0], [10.0]])
+    init = np.array([[0.0], [10.0], [100.0]])
+    lloyd = clustering.kmeans(points, 3, init=init)
+    hamerly = clustering.kmeans(points, 3, init=init, algorithm="hamerly")
+    assert np.array_equal(lloyd.labels, hamerly.labels)
+
+
+def test_unknown_algorithm_is_rejected():
+    with pytest.raises(ValueError):
+        clustering.kmeans(np.zeros((4, 2)), 2, algorithm="elkan")
+
+
+def test_weights_pull_centers():
+    points = np.array([[0.0], [10.0]])
+    result = clustering.kmeans(points, 1, weights=[3.0, 1.0])
+    assert np.allclose(result.centers, [[2.5]])
+
+
+def test_k_is_clipped_to_number_of_points():
+    assert clustering.kmeans(np.zeros((3, 2)) + np.arange(3)[:, None], 10).k == 3
+
+
+@pytest.mark.parametrize("k", [3, 5, 7, 9])
+def test_warm_start_reaches_fresh_quality(k):
+    points, weights, _ = blobs(n_blobs=7)
+    previous = clustering.kmeans(points, 6, weights)
+    init = clustering.warm_start_centers(points, previous, k, weights)
+    assert init.shape == (k, 3)
+    warm = clustering.kmeans(points, k, weights, init=init)
+    fresh = clustering.kmeans(points, k, weights)
+    assert warm.inertia <= fresh.inertia * 1.05
+
+
+def test_cluster_cache_warm_starts_on_k_change():
+    points, weights, truth = blobs(n_blobs=5)
+    cache = clustering.ClusterCache(max_entries=2)
+    cache.put_features("upload", points, weights)
+    first = cache.cluster("upload", 4)
+    assert cache.cluster("upload", 4) is first
+    second = cache.cluster("upload", 5)
+    assert second.k == 5
+    assert same_partition(second.labels, truth)
+
+
+def test_cluster_cache_evicts_and_rejects_unknown():
+    cache = clustering.ClusterCache(max_entries=1)
+    cache.put_features("a", np.arange(4.0))
+    cache.put_features("b", np.arange(4.0))
+    assert not cache.has_features("a")
+    with pytest.raises(KeyError):
+        cache.cluster("a", 2)
+
+
+def test_superpixel_clustering_matches_pixel_clustering():
+    lab = srgb_to_lab(make_icon(96))
+    labels = slic.slic(lab, n_segments=150)
+    features = superpixel_features(lab, labels)
+    clusters = clustering.cluster_superpixels(features, 3)
+    pixel_level = clustering.kmeans(lab.reshape(-1, 3), 3)
+    assert same_partition(clusters.pixel_labels(labels).ravel(), pixel_level.labels)
+    assert np.allclose(np.sort(clusters.result.centers[:, 0]),
+                       np.sort(pixel_level.centers[:, 0]), atol=0.5)
+
+
+def test_superpixel_clustering_keeps_transparent_pixels_unlabelled():
+    rgba = make_rounded_icon(96)
+    index = PixelIndex.from_alpha(rgba)
+    values = index.gather(srgb_to_lab(rgba))
+    labels = slic.slic_sparse(values, index, n_segments=100)
+    clusters = clustering.cluster_superpixels(superpixel_features(values, labels, index), 3)
+    pixels = clusters.pixel_labels(labels)
+    assert np.array_equal(pixels < 0, labels < 0)
+    assert set(np.unique(pixels[pixels >= 0])) == {0, 1, 2}
+
+
+def test_empty_superpixels_map_to_minus_one():
+    values = np.repeat([[10.0, 0, 0], [90.0, 0, 0]], 2, axis=0)
+    features = superpixel_features(values, np.array([0, 0, 2, 2]),
+                                   PixelIndex(np.arange(4), (2, 2)))
+    clusters = clustering.cluster_superpixels(features, 3)
+    assert clusters.k == 2
+    assert clusters.superpixel_cluster[1] == -1
+    assert np.array_equal(clusters.pixel_labels(np.array([[0, 2], [-1, 1]])) < 0,
+                          [[False, False], [True, True]])
+
+
+def naive_silhouette(points, labels):
+    scores = []
+    for i, p in enumerate(points):
+        d = np.sqrt(((points - p) ** 2).sum(1))
+        own = (labels == labels[i]) & (np.arange(len(points)) != i)
+        if not own.any():
+            scores.append(0.0)
+            continue
+        a = d[own].mean()
+        b = min(d[labels == c].mean() for c in set(labels.tolist()) if c != labels[i])
+        scores.append((b - a) / max(a, b))
+    return np.mean(scores)
+
+
+def test_silhouette_matches_definition():
+    points, _, _ = blobs(n_blobs=4, per_blob=20, spread=20.0)
+    labels = clustering.kmeans(points, 4).labels
+    score = clustering.silhouette(clustering.pairwise_distances(points), labels,
+                                  np.ones(len(points)), 4)
+    assert score == pytest.approx(naive_silhouette(points, labels))
+
+
+@pytest.mark.parametrize("criterion", clustering.CRITERIA)
+def test_select_k_finds_blob_count(criterion):
+    points, weights, truth = blobs(n_blobs=5)
+    curve = clustering.select_k(points, weights, 2, 10, criterion=criterion)
+    assert sorted(curve.results) == list(range(2, 11))
+    assert curve.best_k == 5
+    assert same_partition(curve.best.labels, truth)
+
+
+def test_cluster_cache_serves_any_k_from_the_curve():
+    points, weights, _ = blobs(n_blobs=5)
+    cache = clustering.ClusterCache()
+    cache.put_features("upload", points, weights)
+    curve = cache.select_k("upload", 2, 8)
+    assert cache.select_k("upload", 2, 8) is curve
+    assert cache.cluster("upload", 7) is curve[7]
+    assert cache.cluster("upload", curve.best_k) is curve.best
+
+
+def test_cluster_superpixels_auto_k():
+    lab = srgb_to_lab(make_icon(96))
+    labels = slic.slic(lab, n_segments=150)
+    clusters = clustering.cluster_superpixels(superpixel_features(lab, labels), "auto")
+    assert clusters.k == 3
+    assert clusters.curve.best is clusters.result
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+import colorspace
+
+
+@pytest.fixture(scope="module")
+def lab_cache(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("lab-cache")
+    colorspace.lab_table(directory=str(directory))
+    return str(directory)
+
+
+def test_known_colours():
+    lab = colorspace.srgb_to_lab(np.array([[255, 255, 255], [0, 0, 0], [255, 0, 0]],
+                                          dtype=np.uint8))
+    assert np.allclose(lab[0], [100.0, 0.0, 0.0], atol=0.01)
+    assert np.allclose(lab[1], [0.0, 0.0, 0.0], atol=0.01)
+    assert np.allclose(lab[2], [53.24, 80.09, 67.20], atol=0.05)
+
+
+def test_uint8_and_float_inputs_agree():
+    rgb = np.random.default_rng(0).integers(0, 256, (32, 32, 3)).astype(np.uint8)
+    assert np.allclose(colorspace.srgb_to_lab(rgb),
+                       colorspace.srgb_to_lab(rgb / 255.0))
+
+
+def test_lut_matches_exact(lab_cache, monkeypatch):
+    monkeypatch.setenv(colorspace.CACHE_ENV, lab_cache)
+    monkeypatch.setattr(colorspace, "_lab_table", None)
+    rgba = np.random.default_rng(1).integers(0, 256, (40, 50, 4)).astype(np.uint8)
+    lut = colorspace.srgb_to_lab(rgba, backend="lut")
+    assert lut.dtype == np.float32
+    assert lut.shape == (40, 50, 3)
+    assert np.abs(lut - colorspace.srgb_to_lab(rgba)).max() < 1e-3
+
+
+def test_lab_table_is_built_once_and_memory_mapped(lab_cache):
+    path = os.path.join(lab_cache, colorspace.LAB_TABLE_FILE)
+    mtime = os.path.getmtime(path)
+    table = colorspace.lab_table(directory=lab_cache)
+    assert isinstance(table, np.memmap)
+    assert not table.flags.writeable
+    assert table.shape == (1 << 24, 3)
+    assert os.path.getmtime(path) == mtime
+    assert [p for p in os.listdir(lab_cache) if p.endswith(".tmp")] == []
+
+
+def test_apply_lab_weights_post_pass():
+    lab = np.array([[50.0, -20.0, 10.0], [60.0, 30.0, -5.0]])
+    colorspace.apply_lab_weights(lab, lightness_weight=0.5, green_axis_scale=2.0)
+    assert np.allclose(lab, [[25.0, -40.0, 10.0], [30.0, 30.0, -5.0]])
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        colorspace.srgb_to_lab(np.zeros((1, 3), dtype=np.uint8), backend="gpu")
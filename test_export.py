@@ -0,0 +1,45 @@
+import io
+import json
+import zipfile
+
+import cache
+import export
+import layers
+from testutil import make_icon_layers
+
+
+def test_layer_archive_matches_save_layers(tmp_path):
+    expected = make_icon_layers()
+    chunks = list(export.stream_zip(export.layer_entries(iter(expected))))
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert archive.testzip() is None
+    names = [f"layer_{layer.label}.png" for layer in expected]
+    assert archive.namelist() == names + [layers.METADATA_FILE]
+    assert all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist())
+    for layer, name in zip(expected, names):
+        assert archive.read(name) == layers.layer_png(layer)
+    saved = layers.save_layers(expected, str(tmp_path))
+    assert json.loads(archive.read(layers.METADATA_FILE)) == saved
+
+
+def test_archive_streams_entry_by_entry():
+    expected = make_icon_layers()
+    stream = export.stream_zip(export.layer_entries(iter(expected)))
+    first = next(stream)
+    assert first.startswith(b"PK\x03\x04")
+    assert layers.layer_png(expected[0]) in first
+    assert layers.layer_png(expected[1]) not in first
+    assert b"".join(export.stream_zip(export.layer_entries(iter(expected)))) == \
+        first + b"".join(stream)
+
+
+def test_cached_result_is_copied_in_chunks(tmp_path):
+    results = cache.ResultCache(str(tmp_path))
+    metadata = results.put("a" * 16, {"n_clusters": 3}, make_icon_layers(256))
+    chunks = list(export.stream_zip(export.cached_entries(metadata), chunk_size=1024))
+    assert max(len(chunk) for chunk in chunks) < 2048
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    for entry in metadata["layers"]:
+        with open(f"{metadata['path']}/{entry['filename']}", "rb") as f:
+            assert archive.read(entry["filename"]) == f.read()
+    assert json.loads(archive.read(layers.METADATA_FILE))["layers"] == metadata["layers"]
@@ -0,0 +1,77 @@
+import numpy as np
+
+import cache
+import http_cache
+import layers
+from testutil import make_icon_layers, make_rounded_icon
+
+PARAMS = {"n_clusters": 3}
+
+
+def stored(tmp_path):
+    results = cache.ResultCache(str(tmp_path))
+    metadata = results.put("a" * 16, PARAMS, make_icon_layers())
+    return results, http_cache.add_layer_urls(metadata)
+
+
+def test_layer_urls_are_content_addressed(tmp_path):
+    _, metadata = stored(tmp_path)
+    url = metadata["layers"][0]["url"]
+    assert url == f"/layers/{'a' * 16}/{cache.result_hash(PARAMS)}/layer_0.png"
+    assert http_cache.layer_url("a" * 16, PARAMS, "layer_0.png") == url
+    assert http_cache.parse_layer_url(url) == ("a" * 16, cache.result_hash(PARAMS),
+                                               "layer_0.png")
+    for bad in ["/layers/../../etc/passwd", f"/layers/{'a' * 16}/x/layer_0.png",
+                f"/layers/{'a' * 16}/{'b' * 16}/../layer_0.png", "/static/app.js"]:
+        assert http_cache.layer_response(None, bad, {})[0] == 404
+
+
+def test_layer_response_and_revalidation(tmp_path):
+    results, metadata = stored(tmp_path)
+    url = metadata["layers"][1]["url"]
+    status, headers, body = http_cache.layer_response(results, url, {})
+    assert status == 200
+    assert headers["Cache-Control"] == http_cache.IMMUTABLE
+    assert headers["ETag"].startswith('"') and headers["ETag"].endswith('"')
+    with open(body, "rb") as f:
+        assert f.read().startswith(b"\x89PNG")
+
+    tag = headers["ETag"]
+    assert http_cache.layer_response(results, url, {"If-None-Match": tag}) == (
+        304, {"ETag": tag, "Cache-Control": http_cache.IMMUTABLE}, None)
+    assert http_cache.layer_response(results, url, {"if-none-match": f'"x", W/{tag}'})[0] == 304
+    assert http_cache.layer_response(results, url, {"If-None-Match": '"other"'})[0] == 200
+    other = metadata["layers"][2]["url"]
+    assert http_cache.layer_response(results, other, {})[1]["ETag"] != tag
+    missing = http_cache.layer_url("b" * 16, PARAMS, "layer_0.png")
+    assert http_cache.layer_response(results, missing, {})[0] == 404
+
+
+def test_output_modes_get_distinct_urls_and_etags(tmp_path):
+    results, cropped = stored(tmp_path)
+    rgba = make_rounded_icon(64)
+    labels = np.where(rgba[..., 3] > 0, 0, -1)
+    full = http_cache.add_layer_urls(
+        results.put("a" * 16, PARAMS, layers.extract_layers(rgba, labels), mode="full"))
+    assert full["layers"][0]["url"] == http_cache.layer_url("a" * 16, PARAMS, "layer_0.png",
+                                                            mode="full")
+    assert full["layers"][0]["url"] != cropped["layers"][0]["url"]
+    tags = {http_cache.layer_response(results, meta["layers"][0]["url"], {})[1]["ETag"]
+            for meta in (full, cropped)}
+    assert len(tags) == 2
+
+
+def test_upload_response(tmp_path):
+    data = b"\x89PNG upload bytes"
+    upload = cache.content_hash(data)
+    (tmp_path / f"{upload}.png").write_bytes(data)
+    url = http_cache.upload_url(upload)
+    status, headers, body = http_cache.upload_response(str(tmp_path), url, {})
+    assert status == 200 and body == str(tmp_path / f"{upload}.png")
+    assert headers["ETag"] == f'"{upload}"'
+    assert headers["Cache-Control"] == http_cache.IMMUTABLE
+    assert headers["Content-Type"] == "image/png"
+    assert http_cache.upload_response(str(tmp_path), url, {"If-None-Match": f'"{upload}"'})[0] == 304
+    for bad in ["/uploads/../secret.png", f"/uploads/{upload}.exe", f"/layers/{upload}.png",
+                "/uploads/" + "b" * 16 + ".png"]:
+        assert http_cache.upload_response(str(tmp_path), bad, {})[0] == 404
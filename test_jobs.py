@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import jobs
+import pipeline
+from testutil import make_icon
+
+PARAMS = pipeline.ProcessingParams(n_segments=100, n_clusters=3, lab_backend="exact")
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def die():
+    os._exit(1)
+
+
+@pytest.fixture
+def manager():
+    manager = jobs.JobManager(max_concurrent=1, max_queued=2, lab_backends=())
+    yield manager
+    manager.shutdown()
+
+
+def test_job_runs_the_pipeline(manager):
+    job_id = manager.submit(make_icon(64), PARAMS)
+    assert manager.status(job_id)["status"] in ("running", "done")
+    assert manager.wait(job_id, timeout=60)["status"] == "done"
+    result = manager.result(job_id)
+    assert np.array_equal(result.labels, pipeline.process(make_icon(64), PARAMS).labels)
+
+
+def test_concurrency_limit_queues_jobs(manager):
+    manager.task = time.sleep
+    first = manager.submit(0.5)
+    second = manager.submit(0.01)
+    assert manager.status(first)["status"] == "running"
+    assert manager.status(second) | {"submitted": None} == {
+        "id": second, "status": "queued", "submitted": None, "started": None,
+        "finished": None, "error": None, "position": 0}
+    assert manager.stats()["running"] == 1
+    manager.wait(second, timeout=10)
+    assert manager.status(first)["finished"] <= manager.status(second)["started"]
+
+
+def test_queue_limit_and_cancel(manager):
+    manager.task = time.sleep
+    manager.submit(0.5)
+    queued = manager.submit(0.01)
+    manager.submit(0.01)
+    with pytest.raises(jobs.JobQueueFull):
+        manager.submit(0.01)
+    assert manager.cancel(queued)
+    assert manager.status(queued)["status"] == "cancelled"
+    with pytest.raises(RuntimeError):
+        manager.result(queued)
+
+
+def test_failures_are_reported(manager):
+    manager.task = fail
+    job_id = manager.submit("broken icon")
+    status = manager.wait(job_id, timeout=10)
+    assert status["status"] == "failed"
+    assert status["error"] == "ValueError: broken icon"
+    with pytest.raises(KeyError):
+        manager.status("no-such-job")
+
+
+def test_same_key_shares_a_job(manager):
+    manager.task = time.sleep
+    first = manager.submit(0.3, key=("upload", "params"))
+    assert manager.submit(0.3, key=("upload", "params")) == first
+    other = manager.submit(0.01, key=("upload", "other"))
+    assert other != first
+    assert manager.stats()["coalesced"] == 1
+    manager.wait(other, timeout=10)
+    assert manager.submit(0.01, key=("upload", "params")) != first
+
+
+def test_results_are_kept_within_a_byte_budget():
+    executor = ThreadPoolExecutor(1)
+    manager = jobs.JobManager(task=np.zeros, executor=executor, max_result_bytes=1000)
+    first, second, large = manager.submit(100), manager.submit(100), manager.submit(200)
+    for job_id in (first, second, large):
+        assert manager.wait(job_id, timeout=10)["status"] == "done"
+    with pytest.raises(KeyError):
+        manager.result(first)
+    with pytest.raises(KeyError):
+        manager.result(large)
+    assert manager.result(second).nbytes == 800
+    assert manager.stats()["results"] == 1 and manager.stats()["result_bytes"] == 800
+    manager.shutdown()
+    executor.shutdown()
+
+
+def test_many_fast_jobs_do_not_deadlock():
+    executor = ThreadPoolExecutor(4)
+    manager = jobs.JobManager(max_concurrent=4, max_queued=None, max_finished=2000,
+                              task=int, executor=executor)
+    ids = []
+    thread = threading.Thread(target=lambda: ids.extend(manager.submit("1")
+                                                        for _ in range(2000)))
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive()
+    assert all(manager.wait(job_id, timeout=10)["status"] == "done" for job_id in ids)
+    assert manager.stats()["running"] == 0
+    manager.shutdown()
+    executor.shutdown()
+
+
+def test_dead_worker_fails_its_job_and_the_pool_recovers(manager):
+    manager.task = die
+    crashed = manager.submit()
+    queued = manager.submit()
+    assert manager.wait(crashed, timeout=30)["status"] == "failed"
+    assert "BrokenProcessPool" in manager.status(crashed)["error"]
+    manager.wait(queued, timeout=30)
+    manager.task = time.sleep
+    job_id = manager.submit(0.01)
+    assert manager.wait(job_id, timeout=30)["status"] == "done"
+    assert manager.stats()["running"] == 0
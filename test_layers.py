@@ -0,0 +1,93 @@
+import io
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import layers
+from sparse import PixelIndex
+from testutil import make_icon, make_rounded_icon
+
+
+def naive_layers(rgba, labels):
+    out = {}
+    for label in np.unique(labels[labels >= 0]):
+        full = np.zeros_like(rgba)
+        mask = labels == label
+        full[mask] = rgba[mask]
+        out[int(label)] = full
+    return out
+
+
+def test_layers_match_full_canvas_masks():
+    rgba = make_rounded_icon(96)
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 6, rgba.shape[:2])
+    labels[rgba[..., 3] == 0] = -1
+    labels[labels == 4] = 2
+    expected = naive_layers(rgba, labels)
+    result = layers.extract_layers(rgba, labels)
+    assert [layer.label for layer in result] == sorted(expected)
+    for layer in result:
+        assert np.array_equal(layer.full(), expected[layer.label])
+        assert layer.pixel_count == np.count_nonzero(labels == layer.label)
+
+
+def test_layers_are_cropped_to_their_bounding_box():
+    rgb = make_icon(64)
+    labels = np.zeros((64, 64), dtype=np.int32)
+    labels[10:20, 30:35] = 1
+    labels[40, 50] = 2
+    result = layers.extract_layers(rgb, labels)
+    assert result[0].bbox == (0, 0, 64, 64)
+    assert result[1].bbox == (10, 30, 20, 35)
+    for mode in layers.OUTPUT_MODES:
+        assert layers.layer_metadata(result[1], mode)["content_rect"] == [30, 10, 5, 10]
+    assert result[2].rgba.shape == (1, 1, 4)
+    assert np.array_equal(result[2].rgba[0, 0], list(rgb[40, 50]) + [255])
+
+
+def test_sparse_extraction_matches_dense():
+    rgba = make_rounded_icon(96)
+    index = PixelIndex.from_alpha(rgba)
+    dense = np.full(rgba.shape[:2], -1)
+    dense[rgba[..., 3] > 0] = (index.ys // 20 + index.xs // 30) % 5
+    sparse_labels = index.gather(dense)
+    for a, b in zip(layers.extract_layers(rgba, dense),
+                    layers.extract_layers(rgba, sparse_labels, index)):
+        assert a.label == b.label and a.bbox == b.bbox
+        assert np.array_equal(a.rgba, b.rgba)
+
+
+@pytest.mark.parametrize("mode", layers.OUTPUT_MODES)
+def test_saved_layers_recompose_the_icon(tmp_path, mode):
+    rgba = make_rounded_icon(64)
+    labels = np.where(rgba[..., 3] > 0, (np.arange(64)[:, None] // 16) + np.zeros(64, int), -1)
+    metadata = layers.save_layers(layers.extract_layers(rgba, labels), str(tmp_path), mode)
+    assert json.loads((tmp_path / layers.METADATA_FILE).read_text()) == metadata
+    assert metadata["canvas"] == {"width": 64, "height": 64}
+    canvas = np.zeros_like(rgba)
+    for entry in metadata["layers"]:
+        with Image.open(tmp_path / entry["filename"]) as im:
+            pixels = np.asarray(im)
+        assert pixels.shape == (entry["height"], entry["width"], 4)
+        region = canvas[entry["y"]:entry["y"] + entry["height"],
+                        entry["x"]:entry["x"] + entry["width"]]
+        region[pixels[..., 3] > 0] = pixels[pixels[..., 3] > 0]
+    visible = rgba[..., 3] > 0
+    assert np.array_equal(canvas[visible], rgba[visible])
+    assert not canvas[~visible].any()
+
+
+def test_cropped_png_is_smaller():
+    rgba = make_rounded_icon(256)
+    labels = np.zeros(rgba.shape[:2], dtype=int)
+    labels[100:120, 100:140] = 1
+    layer = layers.extract_layers(rgba, labels)[1]
+    cropped = layers.layer_png(layer, "cropped")
+    with Image.open(io.BytesIO(cropped)) as im:
+        assert im.size == (40, 20)
+    assert len(cropped) < len(layers.layer_png(layer, "full"))
+    with pytest.raises(ValueError):
+        layers.layer_png(layer, "tiles")
@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+import merging
+from testutil import same_partition
+
+
+def naive_merge(colors, counts, threshold):
+    """All-pairs rescan after every merge."""
+    groups = [[i] for i in range(len(colors))]
+    colors = [np.asarray(c, dtype=float) for c in colors]
+    counts = [float(c) for c in counts]
+    distances = []
+    while len(groups) > 1:
+        best = None
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                d = np.linalg.norm(colors[i] - colors[j])
+                if best is None or d < best[0]:
+                    best = (d, i, j)
+        d, i, j = best
+        if d > threshold:
+            break
+        distances.append(d)
+        total = counts[i] + counts[j]
+        colors[i] = (counts[i] * colors[i] + counts[j] * colors[j]) / total
+        counts[i] = total
+        groups[i] += groups.pop(j)
+        colors.pop(j)
+        counts.pop(j)
+    return groups, distances
+
+
+def test_adjacency_edges():
+    labels = np.array([[0, 0, 1],
+                       [2, -1, 1],
+                       [2, 2, 3]])
+    a, b, length = merging.adjacency_edges(labels)
+    assert list(zip(a.tolist(), b.tolist(), length.tolist())) == [
+        (0, 1, 1), (0, 2, 1), (1, 3, 1), (2, 3, 1)]
+
+
+@pytest.mark.parametrize("threshold", [5.0, 20.0, np.inf])
+def test_merge_matches_all_pairs_rescan(threshold):
+    rng = np.random.default_rng(3)
+    colors = rng.random((25, 3)) * 60
+    counts = rng.integers(1, 500, 25)
+    result = merging.merge_regions(colors, counts, threshold)
+    groups, distances = naive_merge(colors, counts, threshold)
+    assert np.allclose([d for _, _, d in result.merges], distances)
+    truth = np.empty(25, dtype=int)
+    for g, members in enumerate(groups):
+        truth[members] = g
+    assert same_partition(result.mapping, truth)
+    assert result.pixel_count.sum() == counts.sum()
+
+
+def test_threshold_merges_are_a_prefix_of_the_full_history():
+    rng = np.random.default_rng(5)
+    colors, counts = rng.random((30, 3)) * 80, rng.integers(1, 100, 30)
+    full = merging.merge_regions(colors, counts)
+    assert len(full) == 1
+    partial = merging.merge_regions(colors, counts, threshold=15.0)
+    assert partial.merges == full.merges[:len(partial.merges)]
+    assert full.merges[len(partial.merges)][2] > 15.0
+
+
+def test_adjacent_only_keeps_separated_regions_apart():
+    labels = np.array([[0, 0, 1, 1, 2, 2]] * 3)
+    colors = np.array([[50.0, 0, 0], [90.0, 0, 0], [51.0, 0, 0]])
+    counts = np.bincount(labels.ravel())
+    merged, _ = merging.auto_merge(labels, colors, counts, 5.0, adjacent_only=True)
+    assert len(np.unique(merged)) == 3
+    merged, result = merging.auto_merge(labels, colors, counts, 5.0)
+    assert len(result) == 2
+    assert merged[0, 0] == merged[0, 5] != merged[0, 2]
+
+
+def test_auto_merge_keeps_transparent_pixels_and_empty_regions():
+    labels = np.array([[-1, 0, 0], [-1, 3, 3]])
+    colors = np.array([[50.0, 0, 0], [0, 0, 0], [0, 0, 0], [52.0, 0, 0]])
+    counts = np.array([2, 0, 0, 2])
+    merged, result = merging.auto_merge(labels, colors, counts, 5.0, adjacent_only=True)
+    assert np.array_equal(merged, [[-1, 0, 0], [-1, 0, 0]])
+    assert np.array_equal(result.mapping, [0, -1, -1, 0])
+    assert np.allclose(result.colors, [[51.0, 0, 0]])
+
+
+def random_regions(n=30, seed=7):
+    rng = np.random.default_rng(seed)
+    return rng.random((n, 3)) * 80, rng.integers(1, 300, n)
+
+
+@pytest.mark.parametrize("threshold", [0.0, 8.0, 20.0, 45.0, np.inf])
+def test_tree_cut_matches_direct_merge(threshold):
+    colors, counts = random_regions()
+    tree = merging.MergeTree.build(colors, counts)
+    cut = tree.cut(threshold=threshold)
+    direct = merging.merge_regions(colors, counts, threshold)
+    assert np.array_equal(cut.mapping, direct.mapping)
+    assert np.allclose(cut.colors, direct.colors)
+    assert cut.merges == direct.merges
+
+
+def test_tree_cut_by_layer_count():
+    colors, counts = random_regions()
+    counts[4] = 0
+    tree = merging.MergeTree.build(colors, counts)
+    assert tree.n_regions == 29
+    for n_layers in (1, 5, 29):
+        cut = tree.cut(n_layers=n_layers)
+        assert len(cut) == n_layers
+        assert cut.mapping[4] == -1
+    assert len(tree.cut(n_layers=100)) == 29
+    with pytest.raises(ValueError):
+        tree.cut()
+
+
+def test_adjacent_tree_cannot_merge_past_components():
+    labels = np.array([[0, 0, -1, 1, 1]])
+    tree = merging.merge_tree(labels, [[1.0, 0, 0], [2.0, 0, 0]], [2, 2], adjacent_only=True)
+    assert tree.min_layers == 2
+    assert len(tree.cut(n_layers=1)) == 2
+
+
+def test_tree_round_trips_through_file(tmp_path):
+    colors, counts = random_regions()
+    tree = merging.MergeTree.build(colors, counts)
+    path = str(tmp_path / "upload" / merging.MERGE_TREE_FILE)
+    tree.save(path)
+    loaded = merging.MergeTree.load(path)
+    assert np.array_equal(loaded.cut(n_layers=6).mapping, tree.cut(n_layers=6).mapping)
+    assert [p.name for p in (tmp_path / "upload").iterdir()] == [merging.MERGE_TREE_FILE]
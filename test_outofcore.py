@@ -0,0 +1,69 @@
+import numpy as np
+
+import layers
+import outofcore
+import pipeline
+import slic
+from colorspace import srgb_to_lab
+from testutil import make_icon, make_rounded_icon
+
+
+def test_banded_slic_matches_in_memory_slic(tmp_path):
+    lab = srgb_to_lab(make_icon(96)).astype(np.float32)
+    expected = slic.slic(lab, n_segments=120, enforce=False)
+    with outofcore.Scratch(str(tmp_path)) as scratch:
+        labels = scratch.array("labels", (96 * 96,), np.int32)
+        outofcore.slic_bands(lab, labels, scratch.array("distances", (96 * 96,)),
+                             n_segments=120, band_rows=17)
+        assert np.array_equal(labels.reshape(96, 96), expected)
+
+
+def test_banded_slic_matches_with_odd_band_rows(tmp_path):
+    rng = np.random.default_rng(0)
+    lab = srgb_to_lab(rng.integers(0, 256, (301, 257, 3)).astype(np.uint8)).astype(np.float32)
+    expected = slic.slic(lab, n_segments=150, enforce=False)
+    with outofcore.Scratch(str(tmp_path)) as scratch:
+        labels = scratch.array("labels", (301 * 257,), np.int32)
+        outofcore.slic_bands(lab, labels, scratch.array("distances", (301 * 257,)),
+                             n_segments=150, band_rows=101)
+        assert np.array_equal(labels.reshape(301, 257), expected)
+
+
+def test_out_of_core_matches_in_memory_stages(tmp_path):
+    rgba = make_rounded_icon(96)
+    params = pipeline.ProcessingParams(n_segments=120, n_clusters=4, lab_backend="exact",
+                                       merge_threshold=8.0, adjacent_only=True)
+    with outofcore.Scratch(str(tmp_path)) as scratch:
+        result = outofcore.process_out_of_core(rgba, scratch, params, band_rows=20)
+        visible = rgba[..., 3] > 0
+        assert np.array_equal(result.labels >= 0, visible)
+        assert isinstance(result.layers[0].rgba, np.memmap)
+        for layer in result.layers:
+            assert np.array_equal(layer.full(), layers.extract_layers(
+                rgba, np.asarray(result.labels))[layer.label].full())
+        assert sum(layer.pixel_count for layer in result.layers) == visible.sum()
+    assert not list(tmp_path.iterdir())
+
+
+def test_out_of_core_transparent_image(tmp_path):
+    params = pipeline.ProcessingParams(n_clusters=3, merge_threshold=5.0)
+    with outofcore.Scratch(str(tmp_path)) as scratch:
+        result = outofcore.process_out_of_core(np.zeros((16, 16, 4), np.uint8), scratch,
+                                               params, band_rows=5)
+        assert result.layers == [] and result.clusters is None
+        assert (result.labels == -1).all() and (result.superpixel_labels == -1).all()
+
+
+def test_banded_features_and_adjacency_match_whole_image():
+    from merging import adjacency_edges
+    from superpixels import superpixel_features
+    lab = srgb_to_lab(make_icon(64))
+    labels = slic.slic(lab, n_segments=50)
+    labels[:5] = -1
+    banded = outofcore.features_bands(lab, labels, labels.max() + 1, band_rows=9)
+    whole = superpixel_features(lab, labels)
+    assert np.allclose(banded.mean_lab, whole.mean_lab)
+    assert np.allclose(banded.center, whole.center)
+    a, b = outofcore.adjacency_bands(labels, band_rows=9)
+    ea, eb, _ = adjacency_edges(labels)
+    assert np.array_equal(a, ea) and np.array_equal(b, eb)
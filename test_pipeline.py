@@ -0,0 +1,156 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import cache
+import pipeline
+from testutil import make_icon, make_rounded_icon
+
+PARAMS = pipeline.ProcessingParams(n_segments=150, n_clusters=3, lab_backend="exact")
+
+
+def test_process_dense_icon():
+    rgb = make_icon(96)
+    result = pipeline.process(rgb, PARAMS)
+    assert len(result.layers) == 3
+    assert sum(layer.pixel_count for layer in result.layers) == 96 * 96
+    assert (result.labels >= 0).all()
+    assert set(result.timings) == {"lab", "superpixels", "features", "clusters", "layers"}
+
+
+def test_process_sparse_icon_with_merge():
+    rgba = make_rounded_icon(96)
+    params = pipeline.ProcessingParams(n_segments=150, n_clusters=6, lab_backend="exact",
+                                       merge_threshold=10.0)
+    result = pipeline.process(rgba, params)
+    visible = rgba[..., 3] > 0
+    assert np.array_equal(result.labels >= 0, visible)
+    assert np.array_equal(result.superpixel_labels >= 0, visible)
+    assert len(result.layers) == len(result.merge) < result.clusters.k
+    assert all(distance <= 10.0 for _, _, distance in result.merge.merges)
+    assert "merge" in result.timings
+
+
+def test_small_isolated_island_keeps_its_pixels():
+    rgba = make_rounded_icon(96)
+    rgba[1:4, 1:4] = (250, 250, 0, 255)     # dot in the transparent corner
+    result = pipeline.process(rgba, PARAMS)
+    visible = rgba[..., 3] > 0
+    assert np.array_equal(result.labels >= 0, visible)
+    assert sum(layer.pixel_count for layer in result.layers) == visible.sum()
+
+
+def test_fully_transparent_icon_has_no_layers():
+    params = pipeline.ProcessingParams(n_clusters=3, merge_threshold=5.0)
+    result = pipeline.process(np.zeros((16, 16, 4), np.uint8), params)
+    assert result.layers == []
+    assert (result.labels == -1).all() and (result.superpixel_labels == -1).all()
+    assert result.clusters is None and result.merge is None
+
+
+def test_process_many_matches_process(tmp_path):
+    from PIL import Image
+    path = str(tmp_path / "icon.png")
+    Image.fromarray(make_rounded_icon(64)).save(path)
+    images = [make_icon(64), path, make_icon(64, seed=1)]
+    results = dict(pipeline.process_many(images, PARAMS, workers=2))
+    assert sorted(results) == [0, 1, 2]
+    for i, image in enumerate(images):
+        expected = pipeline.process(image, PARAMS)
+        assert np.array_equal(results[i].labels, expected.labels)
+
+
+def test_process_many_rejects_mismatched_params():
+    with pytest.raises(ValueError):
+        list(pipeline.process_many([make_icon(32)], [PARAMS, PARAMS]))
+
+
+def test_stages_arrive_in_order_and_match_process():
+    rgba = make_rounded_icon(96)
+    params = pipeline.ProcessingParams(n_segments=150, n_clusters=4, lab_backend="exact",
+                                       merge_threshold=5.0)
+    stages = list(pipeline.process_stages(rgba, params))
+    names = [stage.name for stage in stages]
+    assert names[:5] == ["lab", "superpixels", "features", "clusters", "merge"]
+    assert names[-1] == "result"
+    result = stages[-1].value
+    assert [s.value for s in stages if s.name == "layer"] == result.layers
+    assert np.array_equal(stages[1].value, result.superpixel_labels)
+    assert np.array_equal(result.labels, pipeline.process(rgba, params).labels)
+
+
+def test_closing_the_stream_stops_early(monkeypatch):
+    calls = []
+    monkeypatch.setattr(pipeline.clustering, "cluster_superpixels",
+                        lambda *args, **kwargs: calls.append(args))
+    stream = pipeline.process_stages(make_icon(64), PARAMS)
+    assert next(stream).name == "lab"
+    assert next(stream).name == "superpixels"
+    stream.close()
+    assert not calls
+
+
+def test_async_stages():
+    async def collect():
+        return [stage.name async for stage in pipeline.aprocess_stages(make_icon(64), PARAMS)]
+
+    names = asyncio.run(collect())
+    assert names[0] == "lab" and names[-1] == "result"
+
+
+def test_concurrent_async_streams():
+    rgba = make_rounded_icon(96)
+    expected = pipeline.process(rgba, PARAMS).labels
+
+    async def run():
+        async def labels():
+            async for stage in pipeline.aprocess_stages(rgba, PARAMS):
+                if stage.name == "result":
+                    return stage.value.labels
+        return await asyncio.gather(*[labels() for _ in range(12)])
+
+    for labels in asyncio.run(run()):
+        assert np.array_equal(labels, expected)
+
+
+def test_cancelling_an_async_stream():
+    async def run():
+        stream = pipeline.aprocess_stages(make_rounded_icon(96), PARAMS)
+
+        async def consume():
+            async for _ in stream:
+                pass
+
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.5)
+
+    asyncio.run(run())
+
+
+def test_memo_reuses_unchanged_stages(tmp_path, monkeypatch):
+    from PIL import Image
+    path = str(tmp_path / "icon.png")
+    Image.fromarray(make_rounded_icon(96)).save(path)
+    memo = cache.MemoryLRU()
+    first = pipeline.process(path, PARAMS, memo=memo, key="upload")
+    assert len(memo) == 3
+
+    calls = []
+    real = pipeline.slic.slic_sparse
+    monkeypatch.setattr(pipeline.slic, "slic_sparse",
+                        lambda *args, **kwargs: calls.append(1) or real(*args, **kwargs))
+    more_clusters = pipeline.ProcessingParams(n_segments=150, n_clusters=5, lab_backend="exact")
+    second = pipeline.process(path, more_clusters, memo=memo, key="upload")
+    assert not calls
+    assert np.array_equal(first.superpixel_labels, second.superpixel_labels)
+
+    finer = pipeline.ProcessingParams(n_segments=300, n_clusters=3, lab_backend="exact")
+    pipeline.process(path, finer, memo=memo, key="upload")
+    assert calls == [1]
+    assert memo.stats()["hits"] >= 4
+
@@ -0,0 +1,112 @@
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import jobs
+import pipeline
+import progress
+from testutil import make_icon, make_rounded_icon
+
+PARAMS = pipeline.ProcessingParams(n_segments=100, n_clusters=3, lab_backend="exact",
+                                   merge_threshold=5.0)
+
+
+def test_format_sse():
+    assert progress.format_sse("a\nb", "stage", 3) == "id: 3\nevent: stage\ndata: a\ndata: b\n\n"
+    assert progress.format_sse({"k": 2}) == 'data: {"k":2}\n\n'
+
+
+def test_process_with_progress_reports_every_stage():
+    events = []
+    result = progress.process_with_progress(make_rounded_icon(64), PARAMS,
+                                            lambda event, data: events.append((event, data)))
+    stages = [data["stage"] for event, data in events if event == "stage"]
+    assert stages[0] == "decode"
+    assert stages[1] == "lab"
+    assert "slic_iteration" in stages
+    assert stages.index("superpixels") < stages.index("clusters") < stages.index("merge")
+    assert stages.count("layer") == len(result.layers)
+    assert events[-1] == ("timings", result.timings)
+    assert "decode" in result.timings
+    json.dumps(events)
+    clusters = next(data for event, data in events if data.get("stage") == "clusters")
+    assert clusters["preview"].startswith("data:image/png;base64,")
+    expected = pipeline.process(make_rounded_icon(64), PARAMS)
+    assert np.array_equal(result.labels, expected.labels)
+
+
+def test_process_with_progress_of_a_transparent_icon():
+    events = []
+    result = progress.process_with_progress(np.zeros((16, 16, 4), np.uint8), PARAMS,
+                                            lambda event, data: events.append((event, data)))
+    assert result.layers == [] and (result.labels == -1).all()
+    stages = [data["stage"] for event, data in events if event == "stage"]
+    assert stages == ["decode", "lab", "superpixels", "features"]
+    assert events[-1] == ("timings", result.timings)
+
+
+def test_cluster_preview_uses_mean_colours():
+    rgba = np.zeros((4, 4, 4), dtype=np.uint8)
+    rgba[:, :2] = (10, 20, 30, 255)
+    rgba[0, 0] = (18, 28, 38, 255)
+    labels = np.full((4, 4), -1)
+    labels[:, :2] = 0
+    preview = progress.cluster_preview(rgba, labels)
+    assert preview[1, 1].tolist() == [11, 21, 31, 255]
+    assert preview[0, 3].tolist() == [0, 0, 0, 0]
+
+
+def test_broker_replays_and_resumes():
+    broker = progress.ProgressBroker()
+    broker.publish("job", "stage", {"stage": "lab"})
+    broker.publish("job", "stage", {"stage": "superpixels"})
+    received = []
+    thread = threading.Thread(target=lambda: received.extend(broker.events("job")))
+    thread.start()
+    broker.publish("job", "done", {})
+    thread.join(5)
+    assert [event_id for event_id, _, _ in received] == [1, 2, 3]
+    assert list(broker.events("job", last_event_id="2")) == [(3, "done", {})]
+    chunks = list(broker.stream("job", last_event_id=1))
+    assert chunks[-1] == "id: 3\nevent: done\ndata: {}\n\n"
+
+
+def test_broker_keepalive():
+    broker = progress.ProgressBroker()
+    broker.publish("idle", "queued", {})
+    assert next(broker.stream("idle", last_event_id=1, keepalive=0.01)) == ": keep-alive\n\n"
+
+
+def test_unknown_jobs_end_without_creating_state():
+    broker = progress.ProgressBroker()
+    assert list(broker.stream("stale", keepalive=0.01, start_timeout=0.05)) == []
+    assert "stale" not in broker
+    received = []
+    thread = threading.Thread(target=lambda: received.extend(broker.events("late")))
+    thread.start()
+    broker.publish("late", "done", {})
+    thread.join(5)
+    assert received == [(1, "done", {})]
+
+
+def test_job_manager_publishes_progress():
+    events = queue.Queue()
+    broker = progress.ProgressBroker()
+    relay = broker.relay(events)
+    manager = jobs.JobManager(events=events, executor=ThreadPoolExecutor(1))
+    assert manager.task is progress.process_with_progress
+    try:
+        job_id = manager.submit(make_icon(64), PARAMS)
+        received = list(broker.events(job_id))
+    finally:
+        manager.shutdown()
+        events.put(None)
+        relay.join(5)
+    names = [event for _, event, _ in received]
+    assert names[:3] == ["queued", "running", "stage"]
+    assert names[-1] == "done"
+    assert "timings" in names
+    assert manager.status(job_id)["status"] == "done"
@@ -0,0 +1,230 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+import slic
+import slic_tiled
+from colorspace import srgb_to_lab
+from sparse import PixelIndex
+from superpixels import superpixel_features
+from testutil import make_icon, make_rounded_icon
+
+
+def naive_assign(lab, centers, step, compactness):
+    """Per-center reference implementation of the assignment step."""
+    h, w = lab.shape[:2]
+    radius = int(np.ceil(step))
+    best = np.full((h, w), np.inf)
+    labels = np.full((h, w), -1)
+    for k, (l, a, b, cy, cx) in enumerate(centers):
+        y0, y1 = max(int(np.rint(cy)) - radius, 0), min(int(np.rint(cy)) + radius + 1, h)
+        x0, x1 = max(int(np.rint(cx)) - radius, 0), min(int(np.rint(cx)) + radius + 1, w)
+        yy, xx = np.mgrid[y0:y1, x0:x1]
+        dc = ((lab[y0:y1, x0:x1] - (l, a, b)) ** 2).sum(-1)
+        d = dc + (compactness / step) ** 2 * ((yy - cy) ** 2 + (xx - cx) ** 2)
+        better = d < best[y0:y1, x0:x1]
+        best[y0:y1, x0:x1][better] = d[better]
+        labels[y0:y1, x0:x1][better] = k
+    return labels
+
+
+def test_assignment_matches_per_center_reference():
+    rng = np.random.default_rng(1)
+    lab = (rng.random((40, 52, 3)) * 50).astype(np.float32)
+    centers, step = slic.initial_centers(lab, 30)
+    centers[:, slic.Y] += rng.normal(0, 1.5, len(centers))
+    centers[:, slic.X] += rng.normal(0, 1.5, len(centers))
+    labels, _ = slic.assign_labels(lab, centers, step, 10.0)
+    expected = naive_assign(lab.astype(np.float64), centers, step, 10.0)
+    assert np.array_equal(labels.reshape(lab.shape[:2]), expected)
+
+
+def test_slic_labels_are_sequential_and_cover_image():
+    lab = srgb_to_lab(make_icon())
+    labels = slic.slic(lab, n_segments=64, compactness=10.0)
+    assert labels.shape == lab.shape[:2]
+    assert labels.dtype == np.int32
+    assert labels.min() == 0
+    assert np.array_equal(np.unique(labels), np.arange(labels.max() + 1))
+    assert 32 <= labels.max() + 1 <= 100
+
+
+def test_superpixels_respect_colour_edges():
+    img = make_icon()
+    labels = slic.slic(srgb_to_lab(img), n_segments=64, compactness=10.0)
+    red = np.all(img > (200, -1, -1), axis=-1) & (img[..., 1] < 60)
+    # Superpixels should be (nearly) pure: most pixels of each label agree on
+    # whether they belong to the red rectangle.
+    purity = []
+    for k in np.unique(labels):
+        inside = red[labels == k].mean()
+        purity.append(max(inside, 1 - inside))
+    assert np.mean(purity) > 0.95
+
+
+def test_callback_reports_each_iteration():
+    calls = []
+    slic.slic(srgb_to_lab(make_icon(48)), n_segments=16, max_iter=3,
+              callback=lambda i, seconds: calls.append(i))
+    assert calls and calls == list(range(len(calls))) and len(calls) <= 3
+
+
+def test_max_iter_must_be_positive():
+    with pytest.raises(ValueError):
+        slic.slic(np.zeros((8, 8, 3)), max_iter=0)
+
+
+def overlap_score(a, b):
+    """Fraction of pixels whose ``a`` segment's best-matching ``b`` segment agrees."""
+    joint = np.bincount(a.ravel() * (b.max() + 1) + b.ravel(),
+                        minlength=(a.max() + 1) * (b.max() + 1))
+    return joint.reshape(a.max() + 1, b.max() + 1).max(axis=1).sum() / a.size
+
+
+@pytest.mark.parametrize("factor", [2, 4])
+def test_pyramid_mode_is_close_to_dense(factor):
+    lab = srgb_to_lab(make_icon(160))
+    dense = slic.slic(lab, n_segments=100, compactness=10.0)
+    pyramid = slic.slic(lab, n_segments=100, compactness=10.0, mode="pyramid",
+                        pyramid_factor=factor)
+    assert abs((pyramid.max() + 1) - (dense.max() + 1)) <= 10
+    assert overlap_score(pyramid, dense) > 0.75
+
+
+def test_unknown_mode_rejected():
+    with pytest.raises(ValueError):
+        slic.slic(np.zeros((8, 8, 3)), mode="sparse-ish")
+
+
+def test_tiled_slic_matches_single_process():
+    lab = srgb_to_lab(make_icon(256))
+    expected = slic.slic(lab, n_segments=150, compactness=10.0)
+    tiled = slic_tiled.tiled_slic(lab, n_segments=150, compactness=10.0,
+                                  workers=2, strips=3)
+    assert np.array_equal(tiled, expected)
+
+
+def test_band_assignment_rounds_half_integer_centers_like_whole_image():
+    lab = np.zeros((20, 20, 3), dtype=np.float32)
+    centers = np.array([[0.0, 0.0, 0.0, 9.5, 9.5]])
+    whole, _ = slic.assign_labels(lab, centers, 4.0, 10.0)
+    band, _ = slic.assign_labels(lab[1:], centers, 4.0, 10.0, row_offset=1)
+    assert np.array_equal(band, whole[20:])
+
+
+def test_tiled_slic_matches_with_odd_strip_boundary():
+    rng = np.random.default_rng(0)
+    lab = srgb_to_lab(rng.integers(0, 256, (302, 257, 3)).astype(np.uint8))
+    assert slic_tiled.strip_bounds(302, 2)[1][0] % 2 == 1
+    expected = slic.slic(lab, n_segments=150, compactness=10.0)
+    tiled = slic_tiled.tiled_slic(lab, n_segments=150, compactness=10.0,
+                                  workers=2, strips=2)
+    assert np.array_equal(tiled, expected)
+
+
+def test_strip_halo_includes_centers_reaching_the_seam():
+    centers = np.zeros((3, 5))
+    centers[:, slic.Y] = [10.0, 95.0, 140.0]
+    assert list(slic_tiled.centers_for_strip(centers, 10.0, 100, 200)) == [1, 2]
+    assert list(slic_tiled.centers_for_strip(centers, 10.0, 0, 100)) == [0, 1]
+
+
+def test_enforce_connectivity_merges_orphans_into_largest_neighbour():
+    labels = np.zeros((6, 8), dtype=np.int32)
+    labels[:, 4:] = 1
+    labels[0:2, 6:] = 2
+    labels[4, 1] = 1      # fragment of 1 inside 0
+    labels[4, 7] = 2      # fragment of 2 touching 1 only
+    result = slic.enforce_connectivity(labels, min_size=2)
+    assert result.max() == 2
+    assert result[4, 1] == result[0, 0]
+    assert result[4, 7] == result[5, 7]
+    assert result[0, 7] != result[5, 7]
+
+
+def test_enforce_connectivity_keeps_isolated_islands():
+    labels = np.full((12, 12), -1, dtype=np.int32)
+    labels[:, :5] = 0
+    labels[6:9, 8:11] = 1     # 3x3 dot surrounded by background
+    result = slic.enforce_connectivity(labels, min_size=20)
+    assert np.array_equal(result >= 0, labels >= 0)
+    assert len(np.unique(result[6:9, 8:11])) == 1
+    assert result[7, 9] != result[0, 0]
+
+
+def test_enforce_connectivity_leaves_single_regions():
+    labels = slic.slic(srgb_to_lab(make_icon(120)), n_segments=80, max_iter=3,
+                       enforce=False)
+    result = slic.enforce_connectivity(labels, min_size=20)
+    for k in range(result.max() + 1):
+        _, fragments = ndimage.label(result == k)
+        assert fragments == 1
+    assert np.bincount(result.ravel()).min() >= 20
+
+
+def test_enforce_connectivity_on_noise():
+    rng = np.random.default_rng(3)
+    labels = rng.integers(0, 40, (64, 64)).astype(np.int32)
+    result = slic.enforce_connectivity(labels, min_size=10)
+    assert np.bincount(result.ravel()).min() >= 10
+    for k in range(result.max() + 1):
+        assert ndimage.label(result == k)[1] == 1
+
+
+def test_timings_report_connectivity_separately():
+    timings = {}
+    slic.slic(srgb_to_lab(make_icon(48)), n_segments=16, timings=timings)
+    assert set(timings) == {"iterations", "connectivity"}
+
+
+def test_sparse_assignment_matches_dense_for_same_centers():
+    rng = np.random.default_rng(4)
+    lab = (rng.random((40, 52, 3)) * 50).astype(np.float32)
+    centers, step = slic.initial_centers(lab, 30)
+    centers[:, slic.Y] += rng.normal(0, 1.5, len(centers))
+    dense, _ = slic.assign_labels(lab, centers, step, 10.0)
+    index = PixelIndex.full(lab.shape)
+    sparse_labels, _ = slic.assign_sparse(index.gather(lab), index, centers, step, 10.0)
+    assert np.array_equal(dense, sparse_labels)
+
+
+def test_slic_sparse_only_labels_visible_pixels():
+    rgba = make_rounded_icon()
+    index = PixelIndex.from_alpha(rgba, threshold=0)
+    assert 0.5 < index.coverage < 1.0
+    labels = slic.slic_sparse(srgb_to_lab(index.gather(rgba)), index, n_segments=60)
+    visible = rgba[..., 3] > 0
+    assert (labels[~visible] == -1).all()
+    assert (labels[visible] >= 0).all()
+    assert np.array_equal(np.unique(labels[visible]), np.arange(labels.max() + 1))
+    for k in range(labels.max() + 1):
+        assert ndimage.label(labels == k)[1] == 1
+
+
+def test_superpixel_features_dense_and_sparse_agree():
+    rgba = make_rounded_icon()
+    lab = srgb_to_lab(rgba)
+    index = PixelIndex.from_alpha(rgba)
+    labels = slic.slic_sparse(index.gather(lab), index, n_segments=40)
+
+    sparse = superpixel_features(index.gather(lab), labels, index)
+    dense = superpixel_features(lab, labels)
+    assert len(sparse) == labels.max() + 1
+    assert sparse.pixel_count.sum() == index.size
+    assert np.allclose(sparse.mean_lab, dense.mean_lab)
+    assert np.allclose(sparse.center, dense.center)
+    k = 0
+    ys, xs = np.nonzero(labels == k)
+    assert np.allclose(sparse.center[k], (ys.mean(), xs.mean()))
+    assert np.allclose(sparse.mean_lab[k], lab[labels == k].mean(axis=0))
+
+
+def test_pixel_index_round_trip():
+    rgba = make_rounded_icon(32, 8)
+    index = PixelIndex.from_alpha(rgba, threshold=128)
+    values = index.gather(rgba)
+    assert values.shape == (index.size, 4)
+    restored = index.scatter(values)
+    assert np.array_equal(restored[rgba[..., 3] > 128], rgba[rgba[..., 3] > 128])
+    assert (restored[rgba[..., 3] <= 128] == 0).all()
+    assert index.bbox() == (6, 6, 26, 26)
@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+
+import slic
+from colorspace import srgb_to_lab
+from sparse import PixelIndex
+from testutil import make_icon, make_rounded_icon
+from workspace import Workspace, default_workspace
+
+
+def test_buffers_are_reused_for_same_shape():
+    ws = Workspace()
+    a = ws.get("lab", (4, 5, 3))
+    b = ws.get("lab", (4, 5, 3))
+    assert a is b
+    assert a.dtype == np.float32
+    assert ws.stats()["allocations"] == 1
+    assert ws.stats()["reuses"] == 1
+
+
+def test_new_shape_replaces_buffer_of_same_name():
+    ws = Workspace()
+    ws.get("labels", 100, np.int32)
+    ws.get("labels", 200, np.int32)
+    stats = ws.stats()
+    assert stats["buffers"] == 1
+    assert stats["current_bytes"] == 800
+    assert stats["peak_bytes"] == 800
+
+
+def test_budget_evicts_least_recently_used():
+    ws = Workspace(max_bytes=1000)
+    ws.get("a", 100, np.int32)
+    ws.get("b", 100, np.int32)
+    ws.get("a", 100, np.int32)
+    ws.get("c", 100, np.int32)
+    assert ws.stats()["buffers"] == 2
+    assert ws.current_bytes == 800
+    assert ws.get("a", 100, np.int32) is not None
+    assert ws.stats()["allocations"] == 3
+
+
+def test_fill():
+    ws = Workspace()
+    assert (ws.get("mask", 10, np.int32, fill=-1) == -1).all()
+
+
+def test_slic_steady_state_allocates_nothing():
+    ws = Workspace()
+    lab = srgb_to_lab(make_icon(64))
+    with ws.request():
+        first = slic.slic(lab, n_segments=30, workspace=ws)
+    assert ws.request_allocated_bytes > 0
+    with ws.request():
+        second = slic.slic(lab, n_segments=30, workspace=ws)
+    assert ws.request_allocated_bytes == 0
+    assert np.array_equal(first, second)
+    assert np.array_equal(first, slic.slic(lab, n_segments=30))
+
+
+def test_sparse_slic_and_lab_use_workspace():
+    ws = Workspace()
+    rgba = make_rounded_icon(64, 16)
+    index = PixelIndex.from_alpha(rgba)
+    for _ in range(2):
+        with ws.request():
+            values = srgb_to_lab(index.gather(rgba),
+                                 out=ws.get("lab", (index.size, 3), np.float32))
+            labels = slic.slic_sparse(values, index, n_segments=20, workspace=ws)
+    assert ws.request_allocated_bytes == 0
+    assert np.array_equal(labels, slic.slic_sparse(values, index, n_segments=20))
+
+
+def test_default_workspace_is_per_thread():
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(default_workspace()))
+    thread.start()
+    thread.join()
+    assert default_workspace() is default_workspace()
+    assert seen[0] is not default_workspace()
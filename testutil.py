@@ -0,0 +1,42 @@
+"""Synthetic icons and assertions shared by the test modules."""
+
+import numpy as np
+
+from layers import extract_layers
+
+
+def make_icon(size=96, seed=0):
+    rng = np.random.default_rng(seed)
+    img = np.zeros((size, size, 3), dtype=np.uint8)
+    img[:] = (30, 60, 200)
+    img[size // 5:size // 2, size // 5:4 * size // 5] = (250, 20, 20)
+    img[2 * size // 3:, :size // 3] = (20, 200, 30)
+    noise = rng.integers(-6, 7, img.shape)
+    return np.clip(img.astype(int) + noise, 0, 255).astype(np.uint8)
+
+
+def make_rounded_icon(size=128, radius=40):
+    """RGBA icon with transparent rounded corners and a 6 px transparent margin."""
+    rgba = np.zeros((size, size, 4), dtype=np.uint8)
+    rgba[..., :3] = make_icon(size)
+    yy, xx = np.mgrid[:size, :size]
+    inner = np.clip(np.minimum(yy, xx), 0, None) >= 6
+    inner &= np.maximum(yy, xx) < size - 6
+    cy = np.clip(yy, 6 + radius, size - 7 - radius)
+    cx = np.clip(xx, 6 + radius, size - 7 - radius)
+    inner &= (yy - cy) ** 2 + (xx - cx) ** 2 <= radius ** 2
+    rgba[inner, 3] = 255
+    return rgba
+
+
+def make_icon_layers(size=64, band=22):
+    """Layers of :func:`make_rounded_icon` split into horizontal bands."""
+    rgba = make_rounded_icon(size)
+    labels = np.where(rgba[..., 3] > 0, (np.arange(size) // band)[:, None], -1)
+    return extract_layers(rgba, labels)
+
+
+def same_partition(a, b):
+    """Whether label arrays ``a`` and ``b`` group the items identically."""
+    pairs = set(zip(a.tolist(), b.tolist()))
+    return len(pairs) == len(set(a.tolist())) == len(set(b.tolist()))
@@ -0,0 +1,120 @@
+"""Reusable scratch buffers for the processing pipeline.
+
+A request allocates several full-resolution arrays (LAB image, distances,
+labels, masks).  Allocating them afresh for every request churns hundreds of
+megabytes per second under load and fragments worker memory, so the stages
+take their scratch arrays from a :class:`Workspace` instead.  Buffers are keyed
+by name, shape and dtype and handed out again for the next image of the same
+size.
+
+Buffers handed out by a workspace are only valid until the same name is
+requested again; stages must copy anything they return to the caller.
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Workspace:
+    """Pool of preallocated NumPy buffers with memory counters.
+
+    Args:
+        max_bytes: optional budget.  When a new buffer would exceed it, the
+            least recently used buffers are dropped first.
+
+    Counters (see :meth:`stats`):
+        ``current_bytes``: bytes held by the pool right now.
+        ``peak_bytes``: highest ``current_bytes`` seen.
+        ``allocations`` / ``reuses``: how requests for buffers were served.
+        ``request_allocated_bytes``: bytes newly allocated during the last
+        :meth:`request` scope; zero once the pool is warm for a shape, i.e.
+        the steady state.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self._buffers = OrderedDict()
+        self.current_bytes = 0
+        self.peak_bytes = 0
+        self.allocations = 0
+        self.reuses = 0
+        self.request_allocated_bytes = 0
+        self._request_bytes = None
+
+    def get(self, name, shape, dtype=np.float32, fill=None):
+        """Return a buffer of ``shape``/``dtype`` for ``name``.
+
+        The contents are undefined unless ``fill`` is given.
+        """
+        shape = tuple(int(n) for n in np.atleast_1d(shape))
+        dtype = np.dtype(dtype)
+        key = (name, shape, dtype.str)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._allocate(key, shape, dtype)
+        else:
+            self._buffers.move_to_end(key)
+            self.reuses += 1
+        if fill is not None:
+            buf.fill(fill)
+        return buf
+
+    def _allocate(self, key, shape, dtype):
+        # A name holds one buffer at a time: drop the old size when the image
+        # shape changes so the pool does not grow with every distinct size.
+        for old in [k for k in self._buffers if k[0] == key[0]]:
+            self._drop(old)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if self.max_bytes is not None:
+            while self._buffers and self.current_bytes + nbytes > self.max_bytes:
+                self._drop(next(iter(self._buffers)))
+        buf = np.empty(shape, dtype=dtype)
+        self._buffers[key] = buf
+        self.allocations += 1
+        self.current_bytes += nbytes
+        self.peak_bytes = max(self.peak_bytes, self.current_bytes)
+        if self._request_bytes is not None:
+            self._request_bytes += nbytes
+        return buf
+
+    def _drop(self, key):
+        self.current_bytes -= self._buffers.pop(key).nbytes
+
+    @contextmanager
+    def request(self):
+        """Scope one request so its new allocations can be counted."""
+        self._request_bytes = 0
+        try:
+            yield self
+        finally:
+            self.request_allocated_bytes = self._request_bytes
+            self._request_bytes = None
+
+    def clear(self):
+        """Release every buffer (counters other than ``current_bytes`` are kept)."""
+        self._buffers.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        return {
+            "buffers": len(self._buffers),
+            "current_bytes": self.current_bytes,
+            "peak_bytes": self.peak_bytes,
+            "allocations": self.allocations,
+            "reuses": self.reuses,
+            "request_allocated_bytes": self.request_allocated_bytes,
+        }
+
+
+_local = threading.local()
+
+
+def default_workspace():
+    """The workspace of the calling worker (one per thread)."""
+    ws = getattr(_local, "workspace", None)
+    if ws is None:
+        ws = _local.workspace = Workspace()
+    return ws